@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Checkpoints of completed Agent Mode stages, so a failed run can resume.
+
+Every Agent Mode run gets a directory keyed by a SHA-256 of (endpoint,
+model, user input, prompt template version). Each stage that finishes is
+saved there as `<stage key>.json` together with a hash of the exact system
+and rendered prompt it was called with, plus the stage's `variant` (the
+routed models and generation params it was sent with, so a stage moved to
+another model or profile is not replayed). With `--resume` (or
+PROMPTOPT_AGENT_RESUME=1) a stage whose prompt hash still matches is not
+called again: its stored output is replayed into its `<STAGE>` section.
+Stages downstream of anything that changed get a different prompt and run
+normally.
+
+A run that completes deletes its directory, so only failed or interrupted
+runs leave checkpoints behind. Run directories are garbage-collected when
+the store is opened: those untouched for the TTL are removed, then the
+oldest until the total fits the size budget.
+
+Writes use a temp file plus `os.replace`, as in response_cache, so a crash
+never leaves a partial checkpoint.
+
+Environment:
+    PROMPTOPT_AGENT_CHECKPOINT=0        disable checkpoints entirely
+    PROMPTOPT_AGENT_RESUME=1            resume from checkpoints without --resume
+    PROMPTOPT_AGENT_CHECKPOINT_DIR      directory (default: %TEMP%/promptopt_agent_runs)
+    PROMPTOPT_AGENT_CHECKPOINT_TTL      seconds a run directory is kept (default 86400)
+    PROMPTOPT_AGENT_CHECKPOINT_MAX_MB   size budget in megabytes (default 20)
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+import agent_mode_prompts
+
+
+def _sha(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def template_version() -> str:
+    """Hash of every Agent Mode prompt template; editing any prompt invalidates old checkpoints."""
+    names = sorted(n for n in dir(agent_mode_prompts) if n.isupper() and isinstance(getattr(agent_mode_prompts, n), str))
+    return _sha(*(f"{n}={getattr(agent_mode_prompts, n)}" for n in names))[:16]
+
+
+class RunCheckpoint:
+    """
+    Stage outputs of one Agent Mode run.
+
+    Args:
+        path: Run directory
+        resume: Serve matching stages from disk; when False they are only saved
+        variant: Stage key -> what else its output depends on besides the
+            prompt (routed models, generation params); hashed with the prompt
+    """
+
+    def __init__(self, path: str, resume: bool = False, variant: Optional[Callable[[str], str]] = None):
+        self.path = path
+        self.resume = resume
+        self.variant = variant
+        self.saved: List[str] = []
+
+    def _file(self, stage_key: str) -> str:
+        return os.path.join(self.path, f"{stage_key}.json")
+
+    @staticmethod
+    def prompt_hash(system: str, prompt: str, variant: str = "") -> str:
+        return _sha(system, prompt, variant)
+
+    def _stage_hash(self, stage_key: str, system: str, prompt: str) -> str:
+        return self.prompt_hash(system, prompt, self.variant(stage_key) if self.variant else "")
+
+    def load(self, stage_key: str, system: str, prompt: str) -> Optional[str]:
+        """Stored output for this stage if it was produced from the same prompt and variant, else None."""
+        if not self.resume:
+            return None
+        try:
+            with open(self._file(stage_key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("prompt_hash") != self._stage_hash(stage_key, system, prompt):
+            return None
+        output = entry.get("output")
+        return output if isinstance(output, str) and output else None
+
+    def save(self, stage_key: str, system: str, prompt: str, output: str) -> None:
+        if not output:
+            return
+        entry = {"created": time.time(), "stage": stage_key, "prompt_hash": self._stage_hash(stage_key, system, prompt), "output": output}
+        tmp = os.path.join(self.path, f".{stage_key}.{uuid.uuid4().hex}.tmp")
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8', newline='') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, self._file(stage_key))
+        except OSError:
+            _remove_quietly(tmp)
+            return
+        self.saved.append(stage_key)
+
+    def discard(self) -> None:
+        """Drop the run directory (the run completed, nothing left to resume)."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class CheckpointStore:
+    """
+    Directory of per-run checkpoint directories with age and size limits.
+
+    Args:
+        root: Directory holding one subdirectory per run key
+        ttl_sec: Seconds a run directory is kept after its last write
+        max_bytes: Total size before the oldest run directories are removed
+    """
+
+    def __init__(self, root: str, ttl_sec: float = 86400.0, max_bytes: int = 20 * 1024 * 1024):
+        self.root = root
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def run_key(base_url: str, model: str, user_input: str) -> str:
+        return _sha(template_version(), base_url.rstrip("/"), model, user_input)[:32]
+
+    def run(self, base_url: str, model: str, user_input: str, resume: bool = False, variant: Optional[Callable[[str], str]] = None) -> RunCheckpoint:
+        return RunCheckpoint(os.path.join(self.root, self.run_key(base_url, model, user_input)), resume=resume, variant=variant)
+
+    def _runs(self) -> List[Tuple[float, int, str]]:
+        runs = []
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return runs
+        for name in names:
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path):
+                continue
+            size = 0
+            try:
+                newest = os.stat(path).st_mtime
+                for entry in os.scandir(path):
+                    st = entry.stat()
+                    newest = max(newest, st.st_mtime)
+                    size += st.st_size
+            except OSError:
+                continue
+            runs.append((newest, size, path))
+        return runs
+
+    def gc(self) -> int:
+        """Remove expired run directories, then the oldest until under the size budget."""
+        now = time.time()
+        removed = 0
+        keep = []
+        for newest, size, path in self._runs():
+            if now - newest > self.ttl_sec:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+            else:
+                keep.append((newest, size, path))
+        total = sum(size for _, size, _ in keep)
+        if total > self.max_bytes:
+            keep.sort()
+            for _, size, path in keep:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                removed += 1
+        return removed
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def resume_from_env(explicit: bool = False) -> bool:
+    return explicit or os.environ.get("PROMPTOPT_AGENT_RESUME", "").strip() == "1"
+
+
+def open_checkpoints() -> Optional[CheckpointStore]:
+    """Build the store from the environment (None when disabled or unusable) and garbage-collect it."""
+    if os.environ.get("PROMPTOPT_AGENT_CHECKPOINT", "").strip() == "0":
+        return None
+    root = os.environ.get("PROMPTOPT_AGENT_CHECKPOINT_DIR") or os.path.join(tempfile.gettempdir(), "promptopt_agent_runs")
+    try:
+        ttl = float(os.environ.get("PROMPTOPT_AGENT_CHECKPOINT_TTL", "86400"))
+    except ValueError:
+        ttl = 86400.0
+    try:
+        max_mb = float(os.environ.get("PROMPTOPT_AGENT_CHECKPOINT_MAX_MB", "20"))
+    except ValueError:
+        max_mb = 20.0
+    try:
+        store = CheckpointStore(root, ttl_sec=ttl, max_bytes=int(max_mb * 1024 * 1024))
+    except OSError:
+        return None
+    store.gc()
+    return store
@@ -10,6 +10,13 @@ Stages:
 2. Clarification - Remove ambiguity, contradictions, soft permissions
 3. Structure - Apply task-specific scaffolding
 4. Final Assembly - Polish and validate against GPT-5.1 checklist
+
+STAGE34_PROMPT fuses Stages 3 and 4 into one call for simple inputs
+(adaptive Agent Mode); it is assembled from the two templates above so
+their scaffolding rules and checklist stay in one place.
+
+JSON_REPAIR_PROMPT re-asks a JSON stage (1, 5) whose answer did not parse,
+with only the stage's schema and its previous answer, not the whole input.
 """
 
 STAGE1_PROMPT = """You are a prompt analysis expert. Analyze the user's input to extract structured intent.
@@ -164,6 +171,18 @@ Add these sections if not already present:
 - Ensure the prompt is immediately usable"""
 
 
+
+def _fuse_structure_and_assembly(structure: str, assembly: str) -> str:
+    # Stage 3's task type and scaffolding rules, then Stage 4 from the goal analysis on
+    scaffolding = structure[structure.index("## TASK TYPE"):structure.rindex("\n\n## OUTPUT\n")]
+    checklist = assembly[assembly.index("## ORIGINAL GOAL ANALYSIS"):]
+    return ("You are a prompt engineer. Design the optimal structure for the request and assemble it "
+            "into a production-ready optimized prompt in one pass.\n\n"
+            "## REQUEST\n{input}\n\n" + scaffolding + "\n\n" + checklist)
+
+
+STAGE34_PROMPT = _fuse_structure_and_assembly(STAGE3_PROMPT, STAGE4_PROMPT)
+
 STAGE5_PROMPT = """You are a prompt quality evaluator. Review the optimized prompt against strict quality criteria.
 
 ## PROMPT TO EVALUATE
@@ -214,6 +233,25 @@ STAGE5_REWRITE_PROMPT = """You are a prompt engineer. Apply the suggested fixes
 ## OUTPUT
 The revised prompt (no explanations):"""
 
+JSON_REPAIR_PROMPT = """Your previous answer could not be parsed. Rewrite it as valid JSON matching the schema below.
+
+{schema}
+
+## PREVIOUS ANSWER
+{previous}
+
+Keep the content of the previous answer; fix only the JSON. Output ONLY the JSON object. No code fence, no commentary."""
+
+
+def _json_schema(template: str, heading: str) -> str:
+    # The stage's JSON block, with the str.format brace escapes undone
+    block = template[template.index(heading):]
+    return block[:block.rindex("}}") + 2].replace("{{", "{").replace("}}", "}")
+
+
+STAGE1_SCHEMA = _json_schema(STAGE1_PROMPT, "## REQUIRED OUTPUT (JSON)")
+STAGE5_SCHEMA = _json_schema(STAGE5_PROMPT, "## EVALUATION OUTPUT (JSON)")
+
 # System prompt used for each stage API call
 AGENT_MODE_SYSTEM = """You are an expert prompt engineer optimizing prompts using GPT-5.1 best practices.
 Your goal is to transform user inputs into highly effective, unambiguous prompts.
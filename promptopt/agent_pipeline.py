@@ -0,0 +1,779 @@
+#!/usr/bin/env python3
+"""
+Declarative stage graph and concurrent scheduler for Agent Mode.
+
+Each stage names the context values its prompt placeholders are filled from
+(`input`, `analysis`, `clarified`, `skeleton`, `intent`, ...) and the key its
+output is stored under. `StageGraphRunner` launches every stage whose inputs
+are available, so stages without a data dependency on each other run at the
+same time. Stages whose inputs can no longer be produced (e.g. the rewrite
+stage after a passing self-eval) are skipped.
+
+A stage with a `tap` publishes context values while its output is still
+streaming: Stage 1's `task_type` is read from the JSON deltas by
+json_stream.JSONFieldStream, so a stage that needs only `task_type` (Structure
+in the parallel graph) starts before Stage 1 has finished.
+
+Concurrent stages share one output file. `SectionWriter` keeps each
+`<STAGE>` section contiguous for the AHK preview: the earliest-opened
+section streams live, later ones buffer until it closes and are then
+replayed and continue live.
+
+Graphs:
+    sequential  Stage 1 -> 2 -> 3 -> 4 (-> 5 -> 5b), the original pipeline
+    parallel    Structure runs alongside Clarification (both need only the
+                Stage 1 analysis); Final Assembly receives the clarified
+                request together with the analysis as its intent
+
+Adaptive depth (either graph): when the input is short, Stage 1 also
+chooses the path. An analysis with no `ambiguities` and no `contradictions`
+takes the short path, where one call built from STAGE34_PROMPT replaces
+Clarification, Structure and Final Assembly; anything else (including an
+analysis that does not decode) takes the full path. The choice is made
+from the streamed JSON, so it is known as soon as those two fields close.
+
+Local self-eval: Stage 5 is first scored by prompt_lint. A decisive local
+score answers the stage without a model call (a clear fail still feeds its
+fixes to the rewrite); only borderline prompts go to the LLM evaluator.
+
+Generation profiles: each stage carries a GenerationProfile (max_tokens
+sized to the stage, stop sequences, JSON response mode for Stages 1 and 5)
+that is sent with its request (promptopt.run_agent_mode retries a stage cut
+off at its cap without it). A JSON stage whose answer still does not
+parse gets one targeted repair call (JSON_REPAIR_PROMPT: the schema and the
+previous answer only) before the pipeline falls back to defaults; repaired
+stages are listed in `repaired`.
+
+Compact IR (stage_ir): stages after Stage 1 receive the request with the
+context bundle replaced by a reference, Stage 1's fields as minified JSON and
+Stage 5's fixes as minified JSON. The runner estimates each stage's input
+tokens, and what the raw inputs would have cost, in `tokens`.
+
+Best-of-N: with `candidates` > 1, Final Assembly runs as N concurrent
+candidate stages (`final#1`..`final#N`) at temperatures spread from 0.2 to
+1.0 (a stage route such as `final#2=MODEL` gives a candidate its own model).
+Each candidate is scored by its own `eval#i` stage, locally by prompt_lint or
+by the Stage 5 evaluator, and the local `tournament` stage passes the best
+one on as `final`. Every candidate stays in the output. The tournament
+replaces Stage 5; a failing winner with fixes still goes to the rewrite.
+Candidates apply to the full path only (an adaptive short path runs one
+fused call).
+
+Environment:
+    PROMPTOPT_AGENT_GRAPH               graph to run (sequential|parallel, default sequential)
+    PROMPTOPT_AGENT_ADAPTIVE=1          choose the path from Stage 1 (like --agent-adaptive)
+    PROMPTOPT_AGENT_ADAPTIVE_MAX_CHARS  longest input that may take the short path (default 600)
+    PROMPTOPT_AGENT_LOCAL_EVAL=0        always send Stage 5 to the model
+    PROMPTOPT_AGENT_PROFILES=0          send stage requests without generation profiles
+    PROMPTOPT_AGENT_IR=0                pass raw stage outputs and the full input between stages
+    PROMPTOPT_AGENT_CANDIDATES          Final Assembly candidates (like --agent-candidates, default 1)
+    PROMPTOPT_AGENT_CANDIDATE_SCORER    local|model: who scores the candidates (default local)
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from json_stream import JSONFieldStream, extract_json_fields
+from prompt_lint import lint_prompt, local_verdict
+from stage_ir import IR_KEYS, estimate_tokens, minify_json
+from agent_mode_prompts import (
+    STAGE1_PROMPT, STAGE2_PROMPT, STAGE3_PROMPT, STAGE4_PROMPT, STAGE34_PROMPT,
+    STAGE5_PROMPT, STAGE5_REWRITE_PROMPT, AGENT_MODE_SYSTEM,
+    JSON_REPAIR_PROMPT, STAGE1_SCHEMA, STAGE5_SCHEMA
+)
+
+GRAPHS = ("sequential", "parallel")
+SCORERS = ("local", "model")
+
+ADAPTIVE_MAX_CHARS = 600
+
+# A placeholder is filled from one context key, or several joined by blank lines
+Source = Union[str, Tuple[str, ...]]
+
+# A closing code fence on its own line: everything after it is commentary.
+# ("```json" opening fences do not match, so a fenced answer is kept whole.)
+FENCE_STOP = "\n```\n"
+
+
+@dataclass
+class GenerationProfile:
+    """
+    Chat Completions generation parameters for one stage.
+
+    Token caps are generous: reasoning models count their hidden reasoning
+    against max_tokens, and a truncated stage costs a retry.
+
+    Args:
+        max_tokens: Output token cap, or None for the provider default
+        stop: Stop sequences
+        json_mode: Ask for `response_format: {"type": "json_object"}`
+        temperature: Overrides the default 0.2 (best-of-N candidates)
+    """
+    max_tokens: Optional[int] = None
+    stop: Tuple[str, ...] = ()
+    json_mode: bool = False
+    temperature: Optional[float] = None
+
+    def params(self) -> Dict[str, Any]:
+        """Request payload fields for this profile."""
+        params: Dict[str, Any] = {}
+        if self.max_tokens:
+            params["max_tokens"] = self.max_tokens
+        if self.stop:
+            params["stop"] = list(self.stop)
+        if self.json_mode:
+            params["response_format"] = {"type": "json_object"}
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        return params
+
+
+PROFILES = {
+    "analysis": GenerationProfile(max_tokens=1500, stop=(FENCE_STOP,), json_mode=True),
+    "clarified": GenerationProfile(max_tokens=3000),
+    "skeleton": GenerationProfile(max_tokens=3000),
+    "final": GenerationProfile(max_tokens=4000),
+    "fused": GenerationProfile(max_tokens=4000),
+    "eval": GenerationProfile(max_tokens=1000, stop=(FENCE_STOP,), json_mode=True),
+    "rewrite": GenerationProfile(max_tokens=4000),
+}
+
+
+@dataclass
+class StageSpec:
+    """
+    One Agent Mode stage.
+
+    Args:
+        key: Context key the raw output is stored under
+        title: `<STAGE name="...">` shown in the result window
+        template: Prompt template from agent_mode_prompts
+        inputs: Placeholder -> context key(s) used to format the template
+        status: `[STATUS]` line written when the stage starts ({total} is filled in)
+        parse: Optional (raw, dbg) -> extra context values derived from the output
+        provides: Keys `parse` (or `tap`) may add, so dependants know who produces them
+        tap: Optional factory of a delta -> {key: value} function that publishes
+             `provides` values before the stage finishes
+        requires: Context keys that must exist before the stage starts but are
+                  not rendered into its prompt (adaptive path gates)
+        local: Optional (ctx, dbg) -> output that answers the stage without a
+               model call, or None to call the model
+        profile: Generation parameters sent with the stage's request
+        check: Optional raw -> bool; False means the output did not parse and
+               one repair call is made with `schema`
+        schema: The stage's output schema, shown to the repair call
+    """
+    key: str
+    title: str
+    template: str
+    inputs: Dict[str, Source]
+    status: str = ""
+    parse: Optional[Callable[[str, Callable[[str], None]], Dict[str, Any]]] = None
+    provides: Tuple[str, ...] = ()
+    system: str = AGENT_MODE_SYSTEM
+    tap: Optional[Callable[[], Callable[[str], Dict[str, Any]]]] = None
+    requires: Tuple[str, ...] = ()
+    local: Optional[Callable[[Dict[str, Any], Callable[[str], None]], Optional[str]]] = None
+    profile: Optional[GenerationProfile] = None
+    check: Optional[Callable[[str], bool]] = None
+    schema: str = ""
+
+    def needs(self) -> List[str]:
+        keys: List[str] = list(self.requires)
+        for src in self.inputs.values():
+            keys.extend((src,) if isinstance(src, str) else src)
+        return keys
+
+    def render(self, ctx: Dict[str, Any]) -> str:
+        values = {}
+        for name, src in self.inputs.items():
+            if isinstance(src, str):
+                values[name] = ctx[src]
+            else:
+                values[name] = "\n\n".join(str(ctx[k]) for k in src)
+        return self.template.format(**values)
+
+
+@dataclass
+class StageTiming:
+    key: str
+    title: str
+    start: float
+    end: float = 0.0
+    deps: List[str] = field(default_factory=list)
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+
+def _task_type(fields: Dict[str, Any]) -> Optional[str]:
+    value = fields.get("task_type")
+    return value.strip() if isinstance(value, str) and value.strip() else None
+
+
+def _route(fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Path gate for adaptive depth, or None while `ambiguities`/`contradictions` are not both known."""
+    ambiguities, contradictions = fields.get("ambiguities"), fields.get("contradictions")
+    if not isinstance(ambiguities, list) or not isinstance(contradictions, list):
+        return None
+    return {"full_path": True} if ambiguities or contradictions else {"short_path": True}
+
+
+def _analysis_tap(adaptive: bool = False) -> Callable[[str], Dict[str, Any]]:
+    # task_type drives the Stage 3 scaffolding; publish it the moment its string closes
+    fields = JSONFieldStream()
+
+    def feed(text: str) -> Dict[str, Any]:
+        new = fields.feed(text)
+        out: Dict[str, Any] = {}
+        task_type = _task_type(new)
+        if task_type:
+            out["task_type"] = task_type
+        if adaptive and new:
+            out.update(_route(fields.fields) or {})
+        return out
+    return feed
+
+
+def _parse_analysis(raw: str, dbg: Callable[[str], None], adaptive: bool = False) -> Dict[str, Any]:
+    fields = extract_json_fields(raw)
+    task_type = _task_type(fields.fields)
+    if task_type:
+        dbg(f"Detected task_type: {task_type}")
+    else:
+        dbg(f"Could not read task_type from Stage 1 JSON (fields: {sorted(fields.fields)}, undecodable: {fields.errors})")
+    values: Dict[str, Any] = {"task_type": task_type or "other",
+                              "analysis_ir": minify_json(fields.fields) if fields.fields else raw.strip()}
+    if adaptive:
+        # Undecodable ambiguities/contradictions count as "not simple"
+        route = _route(fields.fields) or {"full_path": True}
+        dbg(f"Adaptive path: {'short' if 'short_path' in route else 'full'}")
+        values.update(route)
+    return values
+
+
+def _analysis_ok(raw: str) -> bool:
+    return _task_type(extract_json_fields(raw).fields) is not None
+
+
+def _eval_ok(raw: str) -> bool:
+    # Without `pass` the verdict would silently default to passing
+    return isinstance(extract_json_fields(raw).fields.get("pass"), bool)
+
+
+def _parse_eval(raw: str, dbg: Callable[[str], None]) -> Dict[str, Any]:
+    # Only a failed evaluation with concrete fixes produces `feedback`, which unlocks the rewrite
+    eval_result = extract_json_fields(raw).fields
+    if not eval_result:
+        dbg("Could not parse Stage 5 JSON")
+        return {}
+    eval_passed = eval_result.get("pass", True)
+    dbg(f"Eval score: {eval_result.get('overall_score', 5.0)}, pass: {eval_passed}")
+    if not eval_passed and eval_result.get("suggested_fixes"):
+        return {"feedback": json.dumps(eval_result, indent=2),
+                "feedback_ir": minify_json({k: eval_result.get(k, []) for k in ("critical_issues", "suggested_fixes")})}
+    return {}
+
+
+def _local_eval(ctx: Dict[str, Any], dbg: Callable[[str], None]) -> Optional[str]:
+    result = lint_prompt(ctx["final"])
+    verdict = local_verdict(result)
+    dbg(f"Local eval: score {result['overall_score']}, {verdict or 'borderline, asking the model'}")
+    return json.dumps(result, indent=2) if verdict else None
+
+
+def _lint_eval(ctx: Dict[str, Any], dbg: Callable[[str], None], key: str) -> str:
+    return json.dumps(lint_prompt(ctx[key]), indent=2)
+
+
+def _eval_score(raw: str) -> Tuple[float, bool]:
+    # Stage 5's overall_score, else the mean of its axis scores; unreadable counts as 0
+    fields = extract_json_fields(raw).fields
+    score = fields.get("overall_score")
+    if not isinstance(score, (int, float)) or isinstance(score, bool):
+        axes = [v for v in (fields.get("scores") or {}).values() if isinstance(v, (int, float))]
+        score = sum(axes) / len(axes) if axes else 0.0
+    return float(score), fields.get("pass") is True
+
+
+def _tournament(candidates: List[StageSpec]) -> Tuple[Callable, Callable]:
+    """(local, parse) for the stage that picks the best candidate; parse passes on what local picked."""
+    picked: Dict[str, Any] = {}
+
+    def select(ctx: Dict[str, Any], dbg: Callable[[str], None]) -> str:
+        ranked = []
+        for i, st in enumerate(candidates):
+            score, passed = _eval_score(ctx[f"eval#{i + 1}"]) if ctx[st.key].strip() else (0.0, False)
+            ranked.append((score, passed, -i, st))
+        score, passed, _, winner = max(ranked, key=lambda r: r[:3])
+        idx = candidates.index(winner) + 1
+        dbg(f"Tournament: candidate {idx} wins with {score:.2f}")
+        picked.clear()
+        picked["final"] = ctx[winner.key]
+        picked.update(_parse_eval(ctx[f"eval#{idx}"], dbg))
+        lines = [f"Winner: {winner.title} (score {score:.2f})"]
+        for s, p, _, st in ranked:
+            lines.append(f"- {st.title}: {s:.2f}{' pass' if p else ''}")
+        return "\n".join(lines)
+
+    return select, lambda raw, dbg: dict(picked)
+
+
+def _best_of(final: StageSpec, n: int, scorer: str, intent: Source) -> List[StageSpec]:
+    """N Final Assembly candidates, a scoring stage for each and the tournament that provides `final`."""
+    stages: List[StageSpec] = []
+    cands: List[StageSpec] = []
+    for i in range(n):
+        t = round(0.2 + 0.8 * i / (n - 1), 2)
+        cand = replace(final, key=f"final#{i + 1}", title=f"Final Assembly {i + 1}/{n} (t={t})",
+                       status=f"Stage 4/{{total}}: Final assembly, candidate {i + 1}/{n}...",
+                       profile=replace(final.profile or GenerationProfile(), temperature=t))
+        cands.append(cand)
+        local = (lambda ctx, dbg, key=cand.key: _lint_eval(ctx, dbg, key)) if scorer == "local" else None
+        stages += [cand, StageSpec(f"eval#{i + 1}", f"Score {i + 1}/{n}", STAGE5_PROMPT, {"prompt": cand.key, "intent": intent},
+                                   local=local, profile=PROFILES["eval"] if final.profile else None,
+                                   check=_eval_ok, schema=STAGE5_SCHEMA)]
+    select, parse = _tournament(cands)
+    keys = tuple(k for st in cands for k in (st.key, f"eval#{cands.index(st) + 1}"))
+    stages.append(StageSpec("tournament", "Tournament", "", {}, status=f"Stage 5/{{total}}: Picking the best of {n} candidates...",
+                            requires=keys, local=select, parse=parse, provides=("final", "feedback", "feedback_ir")))
+    return stages
+
+
+def build_graph(name: str = "sequential", enable_eval: bool = False, adaptive: bool = False, local_eval: bool = False, profiles: bool = False, compact: bool = False, candidates: int = 1, scorer: str = "local") -> List[StageSpec]:
+    """
+    Stage list for a named graph; order is the launch order among ready stages.
+
+    With `adaptive`, Stage 1 publishes a `full_path` or `short_path` gate:
+    Stages 2-4 require the first, the fused Structure + Final Assembly stage
+    (which also provides `final`) the second. With `local_eval`, Stage 5 is
+    answered by prompt_lint unless its score is borderline. With `profiles`,
+    every stage gets its entry from PROFILES. With `compact`, stages after
+    Stage 1 read the stage_ir keys (`request`, `analysis_ir`, `feedback_ir`).
+    With `candidates` > 1, Final Assembly becomes a best-of-N tournament
+    scored by `scorer` (local|model) in place of Stage 5.
+    """
+    if name not in GRAPHS:
+        raise ValueError(f"unknown agent graph {name!r} (expected one of: {', '.join(GRAPHS)})")
+    request, analysis, feedback = ("request", "analysis_ir", "feedback_ir") if compact else ("input", "analysis", "feedback")
+    intent: Source = analysis if name == "sequential" else (analysis, "clarified")
+    full: Tuple[str, ...] = ("full_path",) if adaptive else ()
+    stages = [
+        StageSpec("analysis", "Goal Extraction", STAGE1_PROMPT, {"input": "input"},
+                  status="Stage 1/{total}: Extracting goals and intent...",
+                  parse=(lambda raw, dbg: _parse_analysis(raw, dbg, adaptive=True)) if adaptive else _parse_analysis,
+                  provides=("task_type", "analysis_ir", "full_path", "short_path") if adaptive else ("task_type", "analysis_ir"),
+                  tap=(lambda: _analysis_tap(adaptive=True)) if adaptive else _analysis_tap,
+                  check=_analysis_ok, schema=STAGE1_SCHEMA),
+        StageSpec("clarified", "Clarification", STAGE2_PROMPT, {"input": request, "analysis": analysis},
+                  status="Stage 2/{total}: Removing ambiguity and redundancy...", requires=full),
+        StageSpec("skeleton", "Structure", STAGE3_PROMPT,
+                  {"clarified": "clarified" if name == "sequential" else request, "task_type": "task_type"},
+                  status="Stage 3/{total}: Optimizing structure...", requires=full),
+        StageSpec("final", "Final Assembly", STAGE4_PROMPT, {"skeleton": "skeleton", "intent": intent},
+                  status="Stage 4/{total}: Final assembly and polish..."),
+    ]
+    if adaptive:
+        stages.append(
+            StageSpec("fused", "Structure + Final Assembly", STAGE34_PROMPT,
+                      {"input": request, "task_type": "task_type", "intent": analysis},
+                      status="Simple input: structure and final assembly in one pass (Stages 2-4 fused)...",
+                      parse=lambda raw, dbg: {"final": raw}, provides=("final",), requires=("short_path",)))
+    if profiles:
+        for st in stages:
+            st.profile = PROFILES.get(st.key)
+    if candidates > 1:
+        if scorer not in SCORERS:
+            raise ValueError(f"unknown candidate scorer {scorer!r} (expected one of: {', '.join(SCORERS)})")
+        at = next(i for i, st in enumerate(stages) if st.key == "final")
+        stages[at:at + 1] = _best_of(stages[at], candidates, scorer, analysis)
+    if enable_eval and candidates == 1:
+        stages.append(
+            StageSpec("eval", "Self-Eval", STAGE5_PROMPT, {"prompt": "final", "intent": analysis},
+                      status="Stage 5/{total}: Self-evaluation and refinement...",
+                      parse=_parse_eval, provides=("feedback", "feedback_ir"), local=_local_eval if local_eval else None,
+                      check=_eval_ok, schema=STAGE5_SCHEMA, profile=PROFILES["eval"] if profiles else None))
+    if enable_eval:
+        stages.append(
+            StageSpec("rewrite", "Rewrite", STAGE5_REWRITE_PROMPT, {"prompt": "final", "feedback": feedback},
+                      status="Stage 5b: Applying evaluation fixes...", profile=PROFILES["rewrite"] if profiles else None))
+    return stages
+
+
+def graph_from_env(explicit: Optional[str] = None) -> str:
+    name = (explicit or os.environ.get("PROMPTOPT_AGENT_GRAPH", "") or "sequential").strip().lower()
+    return name if name in GRAPHS else "sequential"
+
+
+def adaptive_from_env(explicit: bool = False) -> bool:
+    return explicit or os.environ.get("PROMPTOPT_AGENT_ADAPTIVE", "").strip() == "1"
+
+
+def adaptive_max_chars() -> int:
+    try:
+        return int(os.environ.get("PROMPTOPT_AGENT_ADAPTIVE_MAX_CHARS", str(ADAPTIVE_MAX_CHARS)))
+    except ValueError:
+        return ADAPTIVE_MAX_CHARS
+
+
+def local_eval_from_env() -> bool:
+    return os.environ.get("PROMPTOPT_AGENT_LOCAL_EVAL", "").strip() != "0"
+
+
+def candidates_from_env(explicit: Optional[int] = None) -> int:
+    if explicit:
+        return max(1, explicit)
+    try:
+        return max(1, int(os.environ.get("PROMPTOPT_AGENT_CANDIDATES", "1")))
+    except ValueError:
+        return 1
+
+
+def scorer_from_env() -> str:
+    name = os.environ.get("PROMPTOPT_AGENT_CANDIDATE_SCORER", "").strip().lower() or "local"
+    return name if name in SCORERS else "local"
+
+
+def compact_ir_from_env() -> bool:
+    return os.environ.get("PROMPTOPT_AGENT_IR", "").strip() != "0"
+
+
+def profiles_from_env() -> bool:
+    return os.environ.get("PROMPTOPT_AGENT_PROFILES", "").strip() != "0"
+
+
+def agent_path(ctx: Dict[str, Any]) -> str:
+    """Path an adaptive run took: "short" or "full"."""
+    return "short" if ctx.get("short_path") else "full"
+
+
+class _Section:
+    def __init__(self, writer: "SectionWriter", title: str):
+        self.writer = writer
+        self.title = title
+        self.buf: List[str] = []
+        self.closed = False
+        self.tap: Optional[Callable[[str], None]] = None
+
+    def write(self, text: str, tap: bool = True) -> None:
+        if tap and self.tap is not None:
+            self.tap(text)
+        self.writer._write(self, text)
+
+    def observe(self, text: str) -> None:
+        """Feed a delta to the stage's tap without writing it (the caller writes the whole text later)."""
+        if self.tap is not None:
+            self.tap(text)
+
+    def close(self) -> None:
+        self.writer._close(self)
+
+
+class SectionWriter:
+    """Serialises concurrent `<STAGE>` sections and `[STATUS]` lines onto one sink."""
+
+    def __init__(self, sink):
+        self._sink = sink
+        self._lock = threading.Lock()
+        self._live: Optional[_Section] = None
+        self._waiting: List[_Section] = []
+        self._status: List[str] = []
+        self._detached = False
+
+    def detach(self) -> None:
+        """Drop everything written from now on (the run failed and the caller is closing the sink)."""
+        with self._lock:
+            self._detached = True
+
+    def _emit(self, text: str) -> None:
+        if not self._detached:
+            self._sink.write(text)
+
+    def status(self, msg: str) -> None:
+        with self._lock:
+            if self._live is None:
+                self._emit(f"[STATUS] {msg}\n")
+            else:
+                self._status.append(msg)
+
+    def open(self, title: str) -> _Section:
+        sec = _Section(self, title)
+        with self._lock:
+            if self._live is None:
+                self._go_live(sec)
+            else:
+                self._waiting.append(sec)
+        return sec
+
+    def _go_live(self, sec: _Section) -> None:
+        self._live = sec
+        self._emit(f'<STAGE name="{sec.title}">\n' + "".join(sec.buf))
+        sec.buf = []
+
+    def _write(self, sec: _Section, text: str) -> None:
+        with self._lock:
+            if sec is self._live:
+                self._emit(text)
+            else:
+                sec.buf.append(text)
+
+    def _close(self, sec: _Section) -> None:
+        with self._lock:
+            if sec.closed:
+                return
+            sec.closed = True
+            if sec is not self._live:
+                return
+            self._emit('\n</STAGE>\n\n')
+            self._live = None
+            # Hand the output over to the next section in open order
+            while self._live is None:
+                for msg in self._status:
+                    self._emit(f"[STATUS] {msg}\n")
+                self._status = []
+                if not self._waiting:
+                    return
+                nxt = self._waiting.pop(0)
+                self._go_live(nxt)
+                if nxt.closed:
+                    self._emit('\n</STAGE>\n\n')
+                    self._live = None
+
+
+# call(stage, prompt, section) -> raw stage output; it writes the stage body into section
+StageCall = Callable[[StageSpec, str, _Section], str]
+
+
+class StageGraphRunner:
+    """
+    Run a stage graph, launching each stage as soon as its inputs exist.
+
+    After `run()`, `timings` holds per-stage start/end offsets and `report()`
+    gives the critical path against wall time.
+
+    With a `checkpoint` (agent_checkpoint.RunCheckpoint), every completed
+    stage is saved and, when resuming, a stage with a stored output for the
+    same prompt is replayed instead of called; those are listed in `resumed`.
+
+    Values a stage's tap publishes early are recorded in `early` (key ->
+    seconds after start). `prewarm(n)` is called when a tapped stage starts
+    and n stages could start from its early values alone, so their
+    connections can be opened while it is still generating.
+
+    Stages answered by their `local` hook instead of a model call are listed
+    in `local`; stages whose output failed their `check` and was replaced by
+    a repair call are listed in `repaired`.
+
+    `tokens` maps each stage sent to a model to (estimated input tokens,
+    estimate had the raw values been sent instead of stage_ir's compact ones).
+
+    If a stage raises, stages not yet started are cancelled, `abort()` is
+    called so the caller can stop the requests of stages still running, and
+    the writer is detached before the error propagates, so those stages
+    cannot write into a sink the caller has closed.
+    """
+
+    def __init__(self, stages: List[StageSpec], call: StageCall, writer: SectionWriter, total: int, max_workers: Optional[int] = None, dbg: Optional[Callable[[str], None]] = None, checkpoint=None, prewarm: Optional[Callable[[int], None]] = None, abort: Optional[Callable[[], None]] = None):
+        self.stages = stages
+        self.call = call
+        self.writer = writer
+        self.total = total
+        self.max_workers = max_workers or len(stages)
+        self.timings: Dict[str, StageTiming] = {}
+        self.skipped: List[str] = []
+        self.resumed: List[str] = []
+        self.local: List[str] = []
+        self.repaired: List[str] = []
+        self.tokens: Dict[str, Tuple[int, int]] = {}
+        self.checkpoint = checkpoint
+        self.prewarm = prewarm
+        self.abort = abort
+        self.early: Dict[str, float] = {}
+        self.wall = 0.0
+        self._lock = threading.Lock()
+        self._published: Dict[str, Any] = {}
+        self._wake: Future = Future()
+        self._dbg = dbg or (lambda msg: None)
+        # Several stages may provide one key (`final` from Final Assembly or the fused stage)
+        self._producer: Dict[str, List[StageSpec]] = {}
+        for st in stages:
+            for k in (st.key,) + st.provides:
+                self._producer.setdefault(k, []).append(st)
+
+    def _publish(self, st: StageSpec, values: Dict[str, Any], t0: float) -> None:
+        # Called from the stage's worker thread; the scheduler merges these into ctx
+        with self._lock:
+            fresh = {k: v for k, v in values.items() if k in st.provides and k not in self._published}
+            if not fresh:
+                return
+            self._published.update(fresh)
+            for k in fresh:
+                self.early[k] = time.monotonic() - t0
+            wake = self._wake
+        self._dbg(f"Stage early output: {st.title} {', '.join(f'{k}={v}' for k, v in fresh.items())}")
+        if not wake.done():
+            wake.set_result(None)
+
+    def _run_one(self, st: StageSpec, prompt: str, t0: float, local: Optional[str] = None) -> str:
+        timing = self.timings[st.key]
+        timing.start = time.monotonic() - t0
+        sec = self.writer.open(st.title)
+        if st.tap is not None:
+            feed = st.tap()
+            sec.tap = lambda text: self._publish(st, feed(text), t0)
+        try:
+            if local is not None:
+                self.local.append(st.key)
+                sec.write(local)
+                return local
+            if self.checkpoint is not None:
+                stored = self.checkpoint.load(st.key, st.system, prompt)
+                if stored is not None:
+                    self._dbg(f"Stage resumed from checkpoint: {st.title}")
+                    self.resumed.append(st.key)
+                    sec.write(stored)
+                    return stored
+            raw = self.call(st, prompt, sec)
+            if st.check is not None and not st.check(raw):
+                sec.close()
+                raw = self._repair(st, raw)
+            if self.checkpoint is not None:
+                self.checkpoint.save(st.key, st.system, prompt, raw)
+            return raw
+        finally:
+            sec.close()
+            timing.end = time.monotonic() - t0
+
+    def _repair(self, st: StageSpec, raw: str) -> str:
+        """One targeted call to fix output that failed `st.check`; the original is kept if the repair fails too."""
+        self._dbg(f"Stage output did not parse: {st.title}; asking for a JSON repair")
+        repair = StageSpec(st.key, f"{st.title} (JSON repair)", JSON_REPAIR_PROMPT, {}, system=st.system, profile=st.profile)
+        sec = self.writer.open(repair.title)
+        try:
+            fixed = self.call(repair, JSON_REPAIR_PROMPT.format(schema=st.schema, previous=raw), sec)
+        except Exception as e:
+            self._dbg(f"JSON repair failed: {st.title}: {e}")
+            return raw
+        finally:
+            sec.close()
+        if not st.check(fixed):
+            self._dbg(f"JSON repair did not parse either: {st.title}; keeping the original output")
+            return raw
+        self.repaired.append(st.key)
+        return fixed
+
+    def run(self, ctx: Dict[str, Any]) -> Dict[str, Any]:
+        ctx = dict(ctx)
+        pending = list(self.stages)
+        running: Dict[Future, StageSpec] = {}
+        finished: set = set()
+        t0 = time.monotonic()
+        pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="promptopt-stage")
+        try:
+            while pending or running:
+                progressed = False
+                for st in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    needs = st.needs()
+                    if all(k in ctx for k in needs):
+                        pending.remove(st)
+                        progressed = True
+                        if st.status:
+                            self.writer.status(st.status.format(total=self.total))
+                        self._dbg(f"Stage start: {st.title}")
+                        deps = sorted({p.key for k in needs for p in self._producer.get(k, ())})
+                        self.timings[st.key] = StageTiming(st.key, st.title, time.monotonic() - t0, deps=deps)
+                        local = st.local(ctx, self._dbg) if st.local is not None else None
+                        prompt = st.render(ctx)
+                        if local is None:
+                            raw_ctx = {**ctx, **{k: ctx[v] for k, v in IR_KEYS.items() if v in ctx}}
+                            self.tokens[st.key] = (estimate_tokens(prompt), estimate_tokens(st.render(raw_ctx)))
+                        running[pool.submit(self._run_one, st, prompt, t0, local)] = st
+                        if st.tap is not None and self.prewarm is not None:
+                            early_ready = [p for p in pending if all(k in ctx or k in st.provides for k in p.needs())]
+                            if early_ready:
+                                self.prewarm(len(early_ready))
+                    elif any(k not in ctx and all(p.key in finished for p in self._producer.get(k, ())) for k in needs):
+                        # An input that nothing left to run can produce
+                        pending.remove(st)
+                        progressed = True
+                        self.skipped.append(st.key)
+                        finished.add(st.key)
+                        self._dbg(f"Stage skipped: {st.title}")
+                if not running:
+                    if progressed:
+                        continue
+                    # Nothing runnable remains (unsatisfiable inputs)
+                    for st in pending:
+                        self.skipped.append(st.key)
+                    break
+                done, _ = wait(list(running) + [self._wake], return_when=FIRST_COMPLETED)
+                with self._lock:
+                    for k, v in self._published.items():
+                        ctx.setdefault(k, v)
+                    if self._wake.done():
+                        self._wake = Future()
+                for fut in done:
+                    if fut not in running:
+                        continue
+                    st = running.pop(fut)
+                    raw = fut.result()
+                    ctx[st.key] = raw
+                    if st.parse:
+                        # Values already published early keep the value dependants started with
+                        for k, v in st.parse(raw, self._dbg).items():
+                            ctx.setdefault(k, v)
+                    finished.add(st.key)
+        except BaseException:
+            if self.abort is not None:
+                self.abort()
+            self.writer.detach()
+            raise
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.wall = time.monotonic() - t0
+        return ctx
+
+    def critical_path(self) -> List[StageTiming]:
+        """Chain of stages that bounded wall time: from the last to finish, back through its latest-finishing dependency."""
+        if not self.timings:
+            return []
+        node = max(self.timings.values(), key=lambda t: t.end)
+        path = [node]
+        while node.deps:
+            deps = [self.timings[d] for d in node.deps if d in self.timings]
+            if not deps:
+                break
+            node = max(deps, key=lambda t: t.end)
+            path.append(node)
+        return list(reversed(path))
+
+    def report(self) -> str:
+        path = self.critical_path()
+        stage_sum = sum(t.seconds for t in self.timings.values())
+        chain = " -> ".join(f"{t.title} {t.seconds:.2f}s" for t in path)
+        lines = [f"agent graph: wall {self.wall:.2f}s, stage time {stage_sum:.2f}s, overlap saved {max(0.0, stage_sum - self.wall):.2f}s",
+                 f"agent graph: critical path {chain} = {sum(t.seconds for t in path):.2f}s"]
+        for t in sorted(self.timings.values(), key=lambda t: t.start):
+            lines.append(f"agent graph:   {t.title:<16} +{t.start:.2f}s .. +{t.end:.2f}s ({t.seconds:.2f}s)")
+        if self.skipped:
+            lines.append(f"agent graph: skipped {', '.join(self.skipped)}")
+        if self.resumed:
+            lines.append(f"agent graph: resumed from checkpoint {', '.join(self.resumed)}")
+        if self.local:
+            lines.append(f"agent graph: answered locally (model call avoided) {', '.join(self.local)}")
+        if self.repaired:
+            lines.append(f"agent graph: repaired unparseable JSON {', '.join(self.repaired)}")
+        if self.tokens:
+            sent, raw = (sum(t[i] for t in self.tokens.values()) for i in (0, 1))
+            per_stage = ", ".join(f"{k} ~{c}" + (f" (raw ~{r})" if r != c else "") for k, (c, r) in self.tokens.items())
+            lines.append(f"agent graph: input tokens ~{sent} vs ~{raw} raw ({100.0 * (raw - sent) / raw if raw else 0.0:.0f}% saved): {per_stage}")
+        if self.early:
+            lines.append("agent graph: early values " + ", ".join(f"{k} at +{t:.2f}s" for k, t in self.early.items()))
+        return "\n".join(lines)
@@ -0,0 +1,700 @@
+#!/usr/bin/env python3
+"""
+asyncio HTTP client layer for PromptOpt.
+
+`AsyncConnectionPool` speaks HTTP/1.1 over `asyncio` streams with per-host
+keep-alive reuse, so the Agent Mode stages and the `models_to_try` fallbacks
+reuse the TCP+TLS connection to the provider instead of handshaking per call.
+`AsyncClient` adds a concurrency semaphore and per-request deadlines on top,
+and `acall`/`astream` in promptopt.py build on it.
+
+Cancelling the awaiting task aborts the socket immediately, even mid-read,
+and the connection is never returned to the pool. Deadlines bound the whole
+request (connect, headers and every body read), while `timeout` still bounds
+each individual wait.
+
+Blocking callers go through `run_sync()` / `iter_sync()`, which run the
+coroutine on one background event loop thread. A `CancelToken` passed to
+them cancels the underlying task; a `CancelGroup` cancels many at once.
+Embedding processes can await the coroutines on their own loop instead;
+`get_client()` keeps one client per loop.
+
+Environment:
+    PROMPTOPT_MAX_INFLIGHT       concurrent requests per client (default 32)
+    PROMPTOPT_POOL_SIZE          idle connections kept per host (default 4)
+    PROMPTOPT_POOL_MAX_LIFETIME  seconds before a connection is retired (default 300)
+    PROMPTOPT_POOL_IDLE_TIMEOUT  seconds an idle connection may sit in the pool (default 60)
+"""
+import asyncio
+import concurrent.futures
+import http.client
+import io
+import json
+import os
+import queue
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import weakref
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from sse_parser import ChatEvent, SSEParser, chat_events_batch
+from tracing import Span
+
+READ_SIZE = 64 * 1024
+
+HostKey = Tuple[str, str, int]
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _split_url(url: str) -> Tuple[HostKey, str]:
+    parts = urllib.parse.urlsplit(url)
+    scheme = (parts.scheme or "https").lower()
+    if scheme not in ("http", "https"):
+        raise urllib.error.URLError(f"unsupported scheme: {scheme}")
+    host = parts.hostname or ""
+    port = parts.port or (443 if scheme == "https" else 80)
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+    return (scheme, host, port), target
+
+
+def _proxy_for(scheme: str, host: str) -> Optional[Tuple[str, int]]:
+    """Honor HTTP(S)_PROXY/NO_PROXY like urllib does; returns (proxy_host, proxy_port) or None."""
+    try:
+        proxy = urllib.request.getproxies().get(scheme)
+        if not proxy or urllib.request.proxy_bypass(host):
+            return None
+        p = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+        return (p.hostname, p.port or 8080) if p.hostname else None
+    except Exception:
+        return None
+
+
+def _remaining(timeout: Optional[float], deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return timeout
+    left = deadline - asyncio.get_running_loop().time()
+    if left <= 0:
+        raise TimeoutError("deadline exceeded")
+    return left if timeout is None else min(timeout, left)
+
+
+async def _bounded(aw: Awaitable, timeout: Optional[float], deadline: Optional[float]) -> Any:
+    """Await with the tighter of the per-wait timeout and the request deadline."""
+    try:
+        limit = _remaining(timeout, deadline)
+    except TimeoutError:
+        if asyncio.iscoroutine(aw):
+            aw.close()
+        raise
+    try:
+        return await asyncio.wait_for(aw, limit)
+    except asyncio.TimeoutError:
+        raise TimeoutError("deadline exceeded" if deadline is not None and limit != timeout else "read timed out") from None
+
+
+class _AsyncConnection:
+    __slots__ = ("reader", "writer", "created", "last_used", "uses", "connect_time")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, connect_time: float):
+        self.reader = reader
+        self.writer = writer
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.uses = 0
+        self.connect_time = connect_time
+
+    def usable(self) -> bool:
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def abort(self) -> None:
+        try:
+            self.writer.transport.abort()
+        except Exception:
+            pass
+
+
+class AsyncResponse:
+    """
+    Response whose body is read incrementally with `read_chunk()`.
+
+    The connection goes back to the pool only once the body was fully read
+    and the server allows keep-alive; `abort()` drops it.
+    """
+
+    def __init__(self, pool: "AsyncConnectionPool", key: HostKey, conn: _AsyncConnection, status: int, reason: str, headers: http.client.HTTPMessage, reused: bool, timeout: Optional[float], deadline: Optional[float]):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.reused = reused
+        self.connect_time = 0.0 if reused else conn.connect_time
+        self._timeout = timeout
+        self._deadline = deadline
+        self._released = False
+        self._done = False
+        self._chunk_left = 0
+        te = (headers.get("Transfer-Encoding") or "").lower()
+        length = headers.get("Content-Length")
+        self._will_close = (headers.get("Connection") or "").lower() == "close"
+        if "chunked" in te:
+            self._mode = "chunked"
+        elif length is not None and length.strip().isdigit():
+            self._mode = "length"
+            self._remaining = int(length)
+            self._done = self._remaining == 0
+        else:
+            self._mode = "eof"
+            self._will_close = True
+
+    async def _read(self, aw: Awaitable) -> Any:
+        return await _bounded(aw, self._timeout, self._deadline)
+
+    async def read_chunk(self, n: int = READ_SIZE) -> bytes:
+        """Next piece of the body (at most n bytes); b"" once it is complete."""
+        if self._done:
+            return b""
+        reader = self._conn.reader
+        if self._mode == "length":
+            data = await self._read(reader.read(min(n, self._remaining)))
+            if not data:
+                raise ConnectionResetError("connection closed mid-body")
+            self._remaining -= len(data)
+            self._done = self._remaining <= 0
+            return data
+        if self._mode == "eof":
+            data = await self._read(reader.read(n))
+            self._done = not data
+            return data
+        if self._chunk_left == 0:
+            line = await self._read(reader.readline())
+            if not line:
+                raise ConnectionResetError("connection closed mid-body")
+            size = int(line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                # Trailer section ends with an empty line
+                while True:
+                    trailer = await self._read(reader.readline())
+                    if trailer in (b"\r\n", b"\n", b""):
+                        break
+                self._done = True
+                return b""
+            self._chunk_left = size
+        data = await self._read(reader.read(min(n, self._chunk_left)))
+        if not data:
+            raise ConnectionResetError("connection closed mid-chunk")
+        self._chunk_left -= len(data)
+        if self._chunk_left == 0:
+            await self._read(reader.readexactly(2))
+        return data
+
+    async def read(self) -> bytes:
+        parts = []
+        while True:
+            data = await self.read_chunk()
+            if not data:
+                return b"".join(parts)
+            parts.append(data)
+
+    def abort(self) -> None:
+        self._conn.abort()
+        self.release()
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._pool._checkin(self._key, self._conn, self._done and not self._will_close)
+
+    async def __aenter__(self) -> "AsyncResponse":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        # Finish a nearly complete body (e.g. the chunk terminator after `[DONE]`) so the connection can be reused
+        if exc_type is None and not self._done:
+            try:
+                self._deadline = None
+                self._timeout = 1.0
+                while await self.read_chunk():
+                    pass
+            except Exception:
+                self._conn.abort()
+        elif exc_type is not None:
+            self._conn.abort()
+        self.release()
+
+
+class AsyncConnectionPool:
+    """
+    Per-host pool of keep-alive asyncio connections, bound to one event loop.
+
+    Args:
+        max_per_host: Idle connections retained per (scheme, host, port)
+        max_lifetime: Seconds after which a connection is retired even if healthy
+        idle_timeout: Seconds an idle connection may wait before it is discarded
+    """
+
+    def __init__(self, max_per_host: int = 4, max_lifetime: float = 300.0, idle_timeout: float = 60.0):
+        self.max_per_host = max(1, int(max_per_host))
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self._idle: Dict[HostKey, Deque[_AsyncConnection]] = {}
+        self._lock = threading.Lock()  # stats() may be read from other threads
+        self._stats = {
+            "requests": 0,
+            "new": 0,
+            "reused": 0,
+            "stale_retries": 0,
+            "retired_lifetime": 0,
+            "retired_idle": 0,
+            "discarded": 0,
+        }
+        self._ssl_context = ssl.create_default_context()
+
+    @classmethod
+    def from_env(cls) -> "AsyncConnectionPool":
+        return cls(
+            max_per_host=int(_env_float("PROMPTOPT_POOL_SIZE", 4)),
+            max_lifetime=_env_float("PROMPTOPT_POOL_MAX_LIFETIME", 300.0),
+            idle_timeout=_env_float("PROMPTOPT_POOL_IDLE_TIMEOUT", 60.0),
+        )
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            snap = dict(self._stats)
+            snap["idle"] = sum(len(q) for q in self._idle.values())
+        return snap
+
+    async def _connect(self, key: HostKey, timeout: Optional[float], deadline: Optional[float]) -> _AsyncConnection:
+        scheme, host, port = key
+        ctx = self._ssl_context if scheme == "https" else None
+        proxy = _proxy_for(scheme, host)
+        started = time.monotonic()
+        try:
+            if proxy:
+                loop = asyncio.get_running_loop()
+                sock = await _bounded(loop.run_in_executor(None, _open_tunnel, proxy, host, port, timeout), timeout, deadline)
+                reader, writer = await _bounded(asyncio.open_connection(sock=sock, ssl=ctx, server_hostname=host if ctx else None), timeout, deadline)
+            else:
+                reader, writer = await _bounded(asyncio.open_connection(host, port, ssl=ctx), timeout, deadline)
+        except TimeoutError:
+            raise
+        except (OSError, ssl.SSLError) as e:
+            raise urllib.error.URLError(e)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+        self._count("new")
+        return _AsyncConnection(reader, writer, time.monotonic() - started)
+
+    def _checkout(self, key: HostKey) -> Optional[_AsyncConnection]:
+        now = time.monotonic()
+        q = self._idle.get(key)
+        while q:
+            conn = q.pop()  # most recently used first
+            if now - conn.created > self.max_lifetime:
+                self._count("retired_lifetime")
+            elif now - conn.last_used > self.idle_timeout:
+                self._count("retired_idle")
+            elif conn.usable():
+                return conn
+            conn.abort()
+        return None
+
+    def _checkin(self, key: HostKey, conn: _AsyncConnection, reusable: bool) -> None:
+        conn.last_used = time.monotonic()
+        if reusable and conn.usable() and (conn.last_used - conn.created) <= self.max_lifetime:
+            q = self._idle.setdefault(key, deque())
+            if len(q) < self.max_per_host:
+                q.append(conn)
+                return
+            self._count("discarded")
+        conn.abort()
+
+    async def prewarm(self, url: str, timeout: float = 10.0) -> bool:
+        """Open one connection to url's host ahead of the first request (daemon start-up)."""
+        try:
+            key, _ = _split_url(url)
+            conn = await self._connect(key, timeout, None)
+        except Exception:
+            return False
+        self._checkin(key, conn, True)
+        return True
+
+    def close_all(self) -> None:
+        queues = list(self._idle.values())
+        self._idle.clear()
+        for q in queues:
+            for conn in q:
+                conn.abort()
+
+    async def request(self, method: str, url: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = 60, deadline: Optional[float] = None) -> AsyncResponse:
+        """
+        Send a request; returns once the status line and headers are in.
+
+        Raises urllib.error.HTTPError for status >= 400, urllib.error.URLError
+        when no connection could be made and TimeoutError when the timeout or
+        deadline expires.
+        """
+        key, target = _split_url(url)
+        scheme, host, port = key
+        default_port = 443 if scheme == "https" else 80
+        hdrs = {"Host": host if port == default_port else f"{host}:{port}", "Connection": "keep-alive", "Accept-Encoding": "identity"}
+        if headers:
+            hdrs.update(headers)
+        hdrs["Content-Length"] = str(len(body or b""))
+        head = f"{method} {target} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in hdrs.items()) + "\r\n"
+        wire = head.encode("latin-1") + (body or b"")
+        self._count("requests")
+
+        for attempt in (1, 2):
+            conn = self._checkout(key)
+            reused = conn is not None
+            if conn is None:
+                conn = await self._connect(key, timeout, deadline)
+            try:
+                conn.writer.write(wire)
+                await _bounded(conn.writer.drain(), timeout, deadline)
+                status_line = await _bounded(conn.reader.readline(), timeout, deadline)
+                if not status_line:
+                    raise ConnectionResetError("connection closed before response")
+            except TimeoutError:
+                conn.abort()
+                raise
+            except (OSError, asyncio.IncompleteReadError) as e:
+                conn.abort()
+                if reused and attempt == 1:
+                    # Idle keep-alive connection was closed by the server; retry once on a fresh one
+                    self._count("stale_retries")
+                    continue
+                raise urllib.error.URLError(e)
+            except BaseException:
+                conn.abort()
+                raise
+            break
+
+        try:
+            parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+            status = int(parts[1])
+            reason = parts[2] if len(parts) > 2 else ""
+            msg = http.client.HTTPMessage()
+            while True:
+                line = await _bounded(conn.reader.readline(), timeout, deadline)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                msg[name.strip()] = value.strip()
+        except (ValueError, IndexError) as e:
+            conn.abort()
+            raise urllib.error.URLError(f"malformed response: {e}")
+        except BaseException:
+            conn.abort()
+            raise
+
+        conn.uses += 1
+        if reused:
+            self._count("reused")
+        resp = AsyncResponse(self, key, conn, status, reason, msg, reused, timeout, deadline)
+        if parts[0] == "HTTP/1.0":
+            resp._will_close = True
+        if status >= 400:
+            try:
+                data = await resp.read()
+            except Exception:
+                data = b""
+                conn.abort()
+            resp.release()
+            raise urllib.error.HTTPError(url, status, reason, msg, io.BytesIO(data))
+        return resp
+
+
+def _open_tunnel(proxy: Tuple[str, int], host: str, port: int, timeout: Optional[float]) -> socket.socket:
+    """Blocking CONNECT through an HTTP proxy (run in an executor); returns the tunnelled socket."""
+    sock = socket.create_connection(proxy, timeout=timeout)
+    try:
+        sock.sendall(f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n".encode("latin-1"))
+        reply = b""
+        while b"\r\n\r\n" not in reply:
+            data = sock.recv(4096)
+            if not data:
+                raise OSError("proxy closed the connection during CONNECT")
+            reply += data
+        first = reply.split(b"\r\n", 1)[0]
+        status = first.split()
+        if len(status) < 2 or status[1] != b"200":
+            raise OSError("proxy CONNECT failed: " + first.decode("latin-1", errors="replace"))
+        sock.settimeout(None)
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+class AsyncClient:
+    """
+    Pool plus a concurrency limit and deadlines for Chat Completions calls.
+
+    Args:
+        pool: Connection pool (default: built from the environment)
+        max_concurrency: Requests allowed in flight at once
+    """
+
+    def __init__(self, pool: Optional[AsyncConnectionPool] = None, max_concurrency: Optional[int] = None):
+        self.pool = pool or AsyncConnectionPool.from_env()
+        if max_concurrency is None:
+            max_concurrency = int(_env_float("PROMPTOPT_MAX_INFLIGHT", 32))
+        self.max_concurrency = max(1, max_concurrency)
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the loop that actually runs the requests
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        return self._sem
+
+    @staticmethod
+    def deadline_at(deadline_sec: Optional[float]) -> Optional[float]:
+        return None if deadline_sec is None else asyncio.get_running_loop().time() + deadline_sec
+
+    async def _send(self, url: str, data: bytes, headers: Dict[str, str], timeout_sec: float, deadline: Optional[float], span: Optional[Span]) -> AsyncResponse:
+        if span is None:
+            return await self.pool.request("POST", url, data, headers, timeout_sec, deadline)
+        span.mark("queue")
+        try:
+            resp = await self.pool.request("POST", url, data, headers, timeout_sec, deadline)
+        except urllib.error.HTTPError as e:
+            span.set(status=e.code)
+            raise
+        span.mark("ttfb")
+        span.set(connect_ms=round(resp.connect_time * 1000.0, 2), reused=resp.reused, status=resp.status)
+        return resp
+
+    async def post_json(self, url: str, body: dict, headers: Dict[str, str], timeout_sec: float = 20, deadline_sec: Optional[float] = None, span: Optional[Span] = None) -> dict:
+        data = json.dumps(body).encode("utf-8")
+        deadline = self.deadline_at(deadline_sec)
+        async with self._semaphore():
+            resp = await self._send(url, data, headers, timeout_sec, deadline, span)
+            async with resp:
+                raw = await resp.read()
+        if span is not None:
+            span.set(wire_bytes=len(raw))
+        return json.loads(raw.decode("utf-8", errors="replace"))
+
+    async def stream_events(self, url: str, body: dict, headers: Dict[str, str], timeout_sec: float = 60, deadline_sec: Optional[float] = None, span: Optional[Span] = None) -> AsyncIterator[ChatEvent]:
+        """
+        Typed Chat Completions events from an SSE response, ending at `[DONE]` or end of body.
+
+        With a span, queue/connect/TTFB timings and wire bytes are recorded on it.
+        """
+        data = json.dumps(body).encode("utf-8")
+        deadline = self.deadline_at(deadline_sec)
+        async with self._semaphore():
+            resp = await self._send(url, data, headers, timeout_sec, deadline, span)
+            async with resp:
+                parser = SSEParser()
+                while True:
+                    block = await resp.read_chunk(READ_SIZE)
+                    if span is not None:
+                        span.attrs["wire_bytes"] = span.attrs.get("wire_bytes", 0) + len(block)
+                    for ev in chat_events_batch(parser.feed(block) if block else parser.close()):
+                        yield ev
+                        if ev.kind == "done":
+                            return
+                    if not block:
+                        return
+
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncClient]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def get_client() -> AsyncClient:
+    """The client for the running event loop (one pool per loop)."""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None:
+            client = _clients[loop] = AsyncClient()
+        return client
+
+
+# ----- blocking bridge -----
+
+_bg_loop: Optional[asyncio.AbstractEventLoop] = None
+_bg_lock = threading.Lock()
+
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """Event loop thread shared by every blocking caller in this process."""
+    global _bg_loop
+    if _bg_loop is None:
+        with _bg_lock:
+            if _bg_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="promptopt-aio", daemon=True).start()
+                _bg_loop = loop
+    return _bg_loop
+
+
+class _TaskHandle:
+    """Adapter so a CancelToken can cancel a task running on the background loop."""
+
+    def __init__(self, fut: concurrent.futures.Future):
+        self._fut = fut
+
+    def abort(self) -> None:
+        self._fut.cancel()
+
+
+class CancelToken:
+    """
+    Cross-thread cancellation handle for one blocking call.
+
+    `run_sync()`/`iter_sync()` attach the task they run; `cancel()` cancels it,
+    which aborts its socket, so a losing hedged request stops consuming
+    tokens immediately instead of at its next chunk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._task: Optional[_TaskHandle] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def attach(self, task: _TaskHandle) -> None:
+        with self._lock:
+            self._task = task
+            cancelled = self._cancelled
+        if cancelled:
+            task.abort()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled = True
+            task = self._task
+        if task is not None:
+            task.abort()
+
+
+class CancelGroup:
+    """
+    Cancellation for many concurrent calls, such as the stages of one run.
+
+    `token()` hands out a CancelToken per call; `cancel()` aborts them all,
+    and tokens handed out afterwards start cancelled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._tokens: List[CancelToken] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def token(self) -> CancelToken:
+        token = CancelToken()
+        with self._lock:
+            cancelled = self._cancelled
+            if not cancelled:
+                self._tokens.append(token)
+        if cancelled:
+            token.cancel()
+        return token
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled = True
+            tokens, self._tokens = self._tokens, []
+        for token in tokens:
+            token.cancel()
+
+
+def run_sync(coro: Awaitable, cancel: Optional[CancelToken] = None) -> Any:
+    """Run a coroutine on the background loop and wait for its result."""
+    fut = asyncio.run_coroutine_threadsafe(coro, background_loop())
+    if cancel:
+        cancel.attach(_TaskHandle(fut))
+    return fut.result()
+
+
+def iter_sync(agen: AsyncIterator, cancel: Optional[CancelToken] = None) -> Iterator:
+    """
+    Iterate an async generator from blocking code.
+
+    Cancellation (token or closing this iterator) cancels the producing task;
+    a cancelled stream ends quietly like the blocking transport did.
+    """
+    items: "queue.Queue" = queue.Queue()
+
+    async def pump() -> None:
+        try:
+            async for item in agen:
+                items.put(("item", item))
+        except Exception as e:
+            items.put(("error", e))
+
+    fut = asyncio.run_coroutine_threadsafe(pump(), background_loop())
+    # Always fires, including when the task is cancelled before it starts
+    fut.add_done_callback(lambda f: items.put(("end", None)))
+    if cancel:
+        cancel.attach(_TaskHandle(fut))
+    try:
+        while True:
+            kind, value = items.get()
+            if kind == "item":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
+    finally:
+        if not fut.done():
+            fut.cancel()
+
+
+def pool_stats() -> Dict[str, int]:
+    """Counters of the background loop's pool (what blocking callers used)."""
+    loop = _bg_loop
+    client = _clients.get(loop) if loop is not None else None
+    return client.pool.stats() if client else {}
+
+
+def prewarm(url: str) -> bool:
+    async def _go() -> bool:
+        return await get_client().pool.prewarm(url)
+    return run_sync(_go())
+
+
+def prewarm_later(url: str, count: int = 1) -> None:
+    """Open `count` connections to url's host in the background without waiting for them."""
+    async def _go() -> None:
+        pool = get_client().pool
+        await asyncio.gather(*(pool.prewarm(url) for _ in range(count)))
+    asyncio.run_coroutine_threadsafe(_go(), background_loop())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of promptopt.py against the local mock server.
+
+Starts bench/mock_openai.py in-process and runs promptopt.py as a
+subprocess, the way the AHK bridge does, once per mode and repeat:
+
+  standard        plain JSON call
+  stream          --stream
+  agent           --agent-mode
+  agent-stream    --agent-mode-streaming
+  agent-eval      --agent-mode --agent-mode-eval
+
+Each run records wall time, time until the first byte lands in the output
+file, child CPU time (user + sys) and peak RSS. The summary (median/min/max
+per mode, plus the mock settings, commit and platform) is printed and
+optionally written as JSON; --compare prints the change against an earlier
+results file so regressions show up between commits.
+
+No network access or API key is needed. CPU and RSS come from wait4() and
+are null where it is unavailable (Windows).
+
+Usage:
+    python bench/bench_e2e.py [--modes standard,stream,agent] [--runs 5]
+                              [--ttfb 0.2 --token-delay 0.01 --tokens 200]
+                              [--error openai/gpt-oss-120b=429]
+                              [--json results.json] [--compare baseline.json --fail-above 20]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from mock_openai import MockOpenAI, add_mock_arguments, config_from_args  # noqa: E402
+
+MODES: Dict[str, List[str]] = {
+    "standard": [],
+    "stream": ["--stream"],
+    "agent": ["--agent-mode"],
+    "agent-stream": ["--agent-mode-streaming"],
+    "agent-eval": ["--agent-mode", "--agent-mode-eval"],
+}
+
+METRICS = ("wall_ms", "ttfb_ms", "cpu_ms", "peak_rss_kb")
+
+SYSTEM_PROMPT = "You are a prompt optimizer. Rewrite the user's prompt to be clear and specific."
+USER_INPUT = "write a python function that parses ISO dates and explain edge cases"
+
+
+def _watch_first_byte(path: Path, t0: float, stop: threading.Event, out: dict) -> None:
+    # Polls like the AHK preview does; 1 ms granularity is far below what we measure
+    while not stop.is_set():
+        try:
+            if path.stat().st_size > 0:
+                out["ttfb_ms"] = (time.perf_counter() - t0) * 1000.0
+                return
+        except OSError:
+            pass
+        time.sleep(0.001)
+
+
+def run_once(mode: str, base_url: str, workdir: Path, extra_args: List[str]) -> dict:
+    """Run promptopt.py once and measure it."""
+    sys_file = workdir / "system.txt"
+    in_file = workdir / "input.txt"
+    out_file = workdir / f"output-{mode}.txt"
+    sys_file.write_text(SYSTEM_PROMPT, encoding="utf-8")
+    in_file.write_text(USER_INPUT, encoding="utf-8")
+    if out_file.exists():
+        out_file.unlink()
+    cmd = [sys.executable, str(REPO_ROOT / "promptopt.py"), "--system-prompt-file", str(sys_file),
+           "--user-input-file", str(in_file), "--output-file", str(out_file),
+           "--base-url", base_url, "--no-cache"] + MODES[mode] + extra_args
+    env = dict(os.environ, PROMPTOPT_API_KEY="sk-bench-offline")
+    for name in ("OPENAI_API_KEY", "PROMPTOPT_CACHE", "PROMPTOPT_HEDGE_DELAY", "PROMPTOPT_HEDGE_COUNT", "PROMPTOPT_PROVIDER_ONLY"):
+        env.pop(name, None)
+
+    first: dict = {}
+    stop = threading.Event()
+    with open(workdir / "stderr.log", "wb") as err:
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=err, env=env, cwd=str(REPO_ROOT))
+        watcher = threading.Thread(target=_watch_first_byte, args=(out_file, t0, stop, first), daemon=True)
+        watcher.start()
+        cpu_ms = rss_kb = None
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            cpu_ms = (usage.ru_utime + usage.ru_stime) * 1000.0
+            # ru_maxrss is KiB on Linux and bytes on macOS
+            rss_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+        else:
+            proc.wait()
+        wall_ms = (time.perf_counter() - t0) * 1000.0
+        stop.set()
+        watcher.join()
+    run = {"exit": proc.returncode, "wall_ms": wall_ms, "ttfb_ms": first.get("ttfb_ms"), "cpu_ms": cpu_ms, "peak_rss_kb": rss_kb,
+           "output_bytes": out_file.stat().st_size if out_file.exists() else 0}
+    if proc.returncode != 0:
+        run["stderr_tail"] = (workdir / "stderr.log").read_text(encoding="utf-8", errors="replace")[-400:]
+    return run
+
+
+def summarize(runs: List[dict]) -> dict:
+    out: dict = {"runs": len(runs), "exit_codes": sorted({r["exit"] for r in runs}), "output_bytes": runs[-1]["output_bytes"]}
+    for metric in METRICS:
+        vals = [r[metric] for r in runs if r.get(metric) is not None]
+        if vals:
+            out[metric] = {"median": round(statistics.median(vals), 2), "min": round(min(vals), 2), "max": round(max(vals), 2)}
+        else:
+            out[metric] = None
+    errors = [r["stderr_tail"] for r in runs if "stderr_tail" in r]
+    if errors:
+        out["last_error"] = errors[-1]
+    return out
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(REPO_ROOT), capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results: dict, baseline: dict) -> List[tuple]:
+    """(mode, metric, baseline median, current median, percent change) for every metric both runs have."""
+    lines = []
+    for mode, cur in results["modes"].items():
+        base = baseline.get("modes", {}).get(mode)
+        if not base:
+            continue
+        for metric in METRICS:
+            if not cur.get(metric) or not (base.get(metric) or {}).get("median"):
+                continue
+            b, c = base[metric]["median"], cur[metric]["median"]
+            pct = (c - b) / b * 100.0
+            lines.append((mode, metric, b, c, pct))
+    return lines
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark promptopt.py end to end against a local mock server")
+    ap.add_argument("--modes", default=",".join(MODES), help=f"Comma-separated subset of: {', '.join(MODES)}")
+    ap.add_argument("--runs", type=int, default=3, help="Runs per mode (after one warm-up run)")
+    ap.add_argument("--no-warmup", action="store_true", help="Skip the untimed first run per mode")
+    ap.add_argument("--json", dest="json_out", help="Write results as JSON to this file")
+    ap.add_argument("--compare", help="Earlier results JSON to compare medians against")
+    ap.add_argument("--fail-above", type=float, default=None, metavar="PCT", help="With --compare: exit 1 if any wall/ttfb median regresses by more than PCT percent")
+    ap.add_argument("--promptopt-arg", action="append", default=[], metavar="ARG", help="Extra argument passed to promptopt.py (repeatable)")
+    add_mock_arguments(ap)
+    args = ap.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        ap.error(f"unknown mode(s): {', '.join(unknown)}")
+
+    config = config_from_args(args)
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "mock": asdict(config),
+        "promptopt_args": args.promptopt_arg,
+        "modes": {},
+    }
+    with MockOpenAI(config) as mock, tempfile.TemporaryDirectory(prefix="promptopt-bench-") as tmp:
+        workdir = Path(tmp)
+        for mode in modes:
+            if not args.no_warmup:
+                run_once(mode, mock.base_url, workdir, args.promptopt_arg)
+            runs = [run_once(mode, mock.base_url, workdir, args.promptopt_arg) for _ in range(max(1, args.runs))]
+            results["modes"][mode] = summary = summarize(runs)
+            fmt = lambda m: "n/a" if summary[m] is None else f"{summary[m]['median']:.1f}"  # noqa: E731
+            print(f"{mode:13s} wall {fmt('wall_ms'):>8s} ms  ttfb {fmt('ttfb_ms'):>8s} ms  cpu {fmt('cpu_ms'):>7s} ms  "
+                  f"rss {fmt('peak_rss_kb'):>8s} KiB  exit {summary['exit_codes']}")
+        results["mock_status_counts"] = {str(k): v for k, v in sorted(mock.status_counts.items())}
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    code = 0 if all(m["exit_codes"] == [0] for m in results["modes"].values()) else 1
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print(f"compared with {args.compare} (commit {baseline.get('commit')}):")
+        for mode, metric, b, c, pct in compare(results, baseline):
+            regressed = args.fail_above is not None and metric in ("wall_ms", "ttfb_ms") and pct > args.fail_above
+            print(f"  {mode:13s} {metric:12s} {b:>10.1f} -> {c:>10.1f}  {pct:+6.1f}%{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                code = 1
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the streaming SSE path.
+
+Replays a Chat Completions event stream (a synthetic OpenRouter-shaped
+capture by default, or a raw recording via --recording) through:
+
+  readline   the previous per-line decode/strip/json loop
+  sse        sse_parser.SSEParser fed in large read1()-sized blocks
+
+and reports wall time, ns per delta and MB/s. Both paths must produce the
+same text; the run fails otherwise.
+
+Usage:
+    python bench/bench_sse.py [--deltas 100000] [--block 65536] [--repeat 3]
+                              [--recording stream.txt] [--json results.json]
+"""
+import argparse
+import io
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sse_parser import SSEParser, chat_events_batch  # noqa: E402
+
+WORDS = ["the", "prompt", "model", "stream", "token", "output", "context", "café", "naïve", "→", "🙂", "\n", "json", "{", "}", "data:"]
+
+
+def synth_stream(deltas: int, seed: int = 7) -> bytes:
+    """OpenRouter-shaped SSE capture: keep-alive comments, content deltas, finish and usage chunks."""
+    rng = random.Random(seed)
+    out = [b": OPENROUTER PROCESSING\n\n"]
+    for i in range(deltas):
+        piece = rng.choice(WORDS) + (" " if rng.random() < 0.7 else "")
+        chunk = {
+            "id": "gen-bench",
+            "provider": "Bench",
+            "model": "bench/model",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None, "native_finish_reason": None, "logprobs": None}],
+        }
+        out.append(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+        if i and i % 5000 == 0:
+            out.append(b": OPENROUTER PROCESSING\n\n")
+    out.append(b'data: {"choices":[{"index":0,"delta":{"content":""},"finish_reason":"stop"}]}\n\n')
+    out.append(b'data: {"choices":[],"usage":{"prompt_tokens":10,"completion_tokens":%d,"total_tokens":%d}}\n\n' % (deltas, deltas + 10))
+    out.append(b"data: [DONE]\n\n")
+    return b"".join(out)
+
+
+def run_readline(raw: bytes) -> str:
+    """The pre-SSEParser loop from stream_chat_completions, minus the socket."""
+    resp = io.BufferedReader(io.BytesIO(raw))
+    parts = []
+    while True:
+        line = resp.readline()
+        if not line:
+            break
+        s = line.decode("utf-8", errors="replace").strip()
+        if not s or not s.startswith("data:"):
+            continue
+        d = s[5:].strip()
+        if d == "[DONE]":
+            break
+        try:
+            obj = json.loads(d)
+        except Exception:
+            continue
+        choices = obj.get("choices")
+        if isinstance(choices, list) and choices and isinstance(choices[0], dict):
+            delta = choices[0].get("delta", {})
+            if isinstance(delta, dict):
+                piece = delta.get("content")
+                if isinstance(piece, str) and piece:
+                    parts.append(piece)
+    return "".join(parts)
+
+
+def run_sse(raw: bytes, block: int) -> str:
+    resp = io.BufferedReader(io.BytesIO(raw), buffer_size=block)
+    parser = SSEParser()
+    parts = []
+    while True:
+        data = resp.read1(block)
+        events = parser.feed(data) if data else parser.close()
+        for cev in chat_events_batch(events):
+            if cev.kind == "content":
+                parts.append(cev.text)
+        if not data:
+            break
+    return "".join(parts)
+
+
+def measure(fn, raw: bytes, repeat: int):
+    best = None
+    text = ""
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        text = fn(raw)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, text
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark SSE parsing for PromptOpt streaming")
+    ap.add_argument("--deltas", type=int, default=100000, help="Synthetic content deltas (ignored with --recording)")
+    ap.add_argument("--block", type=int, default=64 * 1024, help="read1() block size for the SSE parser")
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per parser; the best time is reported")
+    ap.add_argument("--recording", help="Raw SSE capture to replay instead of the synthetic stream")
+    ap.add_argument("--json", dest="json_out", help="Write results as JSON to this file")
+    args = ap.parse_args(argv)
+
+    if args.recording:
+        raw = Path(args.recording).read_bytes()
+    else:
+        raw = synth_stream(args.deltas)
+
+    results = {"bytes": len(raw), "block": args.block, "repeat": args.repeat, "source": args.recording or f"synthetic:{args.deltas}"}
+    texts = {}
+    for name, fn in (("readline", run_readline), ("sse", lambda r: run_sse(r, args.block))):
+        secs, text = measure(fn, raw, args.repeat)
+        texts[name] = text
+        results[name] = {"seconds": round(secs, 4), "mb_per_sec": round(len(raw) / secs / 1e6, 1)}
+
+    if texts["readline"] != texts["sse"]:
+        print("ERROR: parsers produced different text", file=sys.stderr)
+        return 1
+
+    # Count deltas once with the parser so recordings report per-token cost too
+    parser = SSEParser()
+    deltas = sum(1 for cev in chat_events_batch(parser.feed(raw) + parser.close()) if cev.kind == "content")
+    results["deltas"] = deltas
+    for name in ("readline", "sse"):
+        results[name]["ns_per_delta"] = round(results[name]["seconds"] / max(deltas, 1) * 1e9)
+    results["speedup"] = round(results["readline"]["seconds"] / results["sse"]["seconds"], 2)
+
+    print(f"{deltas} deltas, {len(raw) / 1e6:.1f} MB, block {args.block}")
+    for name in ("readline", "sse"):
+        r = results[name]
+        print(f"  {name:9s} {r['seconds']:.3f}s  {r['ns_per_delta']:>6d} ns/delta  {r['mb_per_sec']:>6.1f} MB/s")
+    print(f"  speedup   {results['speedup']}x")
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an OpenAI/OpenRouter `/chat/completions` endpoint.
+
+Answers both JSON and SSE (`"stream": true`) requests with deterministic
+text, so benchmarks and tests run offline. Agent Mode prompts get the shape
+each stage expects: the analysis stage gets fenced JSON, final assembly gets
+a well-formed markdown prompt (plain text with --eval-fail, so the local
+pre-evaluator defers to the model), the self-eval stage gets a passing (or
+failing, with --eval-fail) score, and the other stages get plain text.
+
+Latency and failure knobs:
+  ttfb          seconds before the status line is sent
+  token_delay   seconds between streamed deltas (non-stream responses wait
+                tokens * token_delay before answering, like a real provider)
+  errors        {model: status}; that model always fails with the status
+                (401/429/5xx bodies use the OpenAI error shape)
+  error_rate    fraction of requests failing with error_status (seeded)
+  stall_after   after this many deltas the stream stops for `stall` seconds
+  model_speed   {model: factor}; that model's ttfb and token_delay are
+                multiplied by factor (0.3 = a model ~3x faster)
+
+Generation parameters are honoured: `max_tokens` truncates the answer
+(finish_reason "length"), `stop` cuts it at the first stop sequence, and
+`response_format` json_object drops the code fence around JSON answers.
+Knobs for the JSON stages:
+  ramble        prose after the closing fence, as chatty models add
+  bad_json      undecodable JSON unless the prompt is a JSON repair
+                ("## PREVIOUS ANSWER")
+  reject_params 400 for any request carrying max_tokens/stop/response_format
+  preamble      text put before plain answers ("Here is the prompt:\n\n"), left
+                out when the system prompt says "Do not open with a preamble"
+
+Usage:
+    python bench/mock_openai.py [--port 8791] [--ttfb 0.2] [--token-delay 0.01]
+                                [--tokens 200] [--error m/a=429] [--stall-after 5 --stall 30]
+                                [--model-speed m/small=0.3]
+
+or in-process: `with MockOpenAI(MockConfig(ttfb=0.1)) as mock: mock.base_url`.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+WORDS = ["Define", "the", "task", "scope", "inputs", "and", "outputs;", "list", "constraints", "explicitly", "with", "examples", "café", "→", "then", "verify", "each", "step."]
+
+ANALYSIS_JSON = {
+    "primary_goal": "Benchmark the optimizer",
+    "task_type": "coding",
+    "target_audience": "developers",
+    "output_type": "prompt",
+    "explicit_constraints": [],
+    "implicit_constraints": [],
+    "success_criteria": ["runs offline"],
+    "ambiguities": [],
+    "contradictions": [],
+}
+
+FINAL_PROMPT = """# Role
+You are a senior engineer.
+
+## Requirements
+1. {body}
+2. Return exactly one answer.
+3. Finish within 200 words.
+
+## Output Format
+A markdown bullet list, for example:
+- step one
+
+## Edge Cases
+- If the input is empty, reply "no input".
+"""
+
+# Generation parameters `reject_params` refuses, like a provider without support for them
+GEN_PARAMS = ("max_tokens", "stop", "response_format")
+
+ERROR_MESSAGES = {401: "Invalid API key", 429: "Rate limit exceeded", 500: "Internal server error", 502: "Bad gateway", 503: "Service unavailable"}
+
+
+@dataclass
+class MockConfig:
+    ttfb: float = 0.0
+    token_delay: float = 0.0
+    tokens: int = 60
+    errors: Dict[str, int] = field(default_factory=dict)
+    error_rate: float = 0.0
+    error_status: int = 503
+    stall_after: Optional[int] = None
+    stall: float = 0.0
+    model_speed: Dict[str, float] = field(default_factory=dict)
+    ramble: int = 0
+    bad_json: bool = False
+    reject_params: bool = False
+    preamble: str = ""
+    eval_pass: bool = True
+    provider: str = "Mock"
+    seed: int = 7
+
+
+def _words(n: int) -> str:
+    return " ".join(WORDS[i % len(WORDS)] for i in range(n))
+
+
+def _json_answer(obj: dict, cfg: MockConfig, json_mode: bool, repair: bool) -> str:
+    text = json.dumps(obj, indent=2)
+    if cfg.bad_json and not repair:
+        # An unquoted value: that field is undecodable, the rest of the object is fine
+        key = next(iter(obj))
+        text = text.replace(f'"{key}": {json.dumps(obj[key])}', f'"{key}": {str(obj[key]).lower()}x', 1)
+    if json_mode:
+        return text
+    return "```json\n" + text + "\n```\n" + (f"\n{_words(cfg.ramble)}" if cfg.ramble else "")
+
+
+def completion_text(user_content: str, cfg: MockConfig, json_mode: bool = False) -> str:
+    """Deterministic answer shaped for the Agent Mode stage the prompt belongs to."""
+    repair = "## PREVIOUS ANSWER" in user_content
+    if "## REQUIRED OUTPUT (JSON)" in user_content:
+        return _json_answer({"task_type": ANALYSIS_JSON["task_type"], **ANALYSIS_JSON}, cfg, json_mode, repair)
+    if "## FINAL ASSEMBLY CHECKLIST" in user_content and cfg.eval_pass:
+        return FINAL_PROMPT.format(body=_words(cfg.tokens))
+    if "## EVALUATION OUTPUT (JSON)" in user_content:
+        score = 4.6 if cfg.eval_pass else 3.2
+        fixes = [] if cfg.eval_pass else ["State the output format explicitly"]
+        return _json_answer({"pass": cfg.eval_pass, "overall_score": score, "scores": {}, "critical_issues": [], "suggested_fixes": fixes}, cfg, json_mode, repair)
+    return _words(cfg.tokens)
+
+
+def split_deltas(text: str) -> list:
+    """Word-sized deltas (whitespace kept with the preceding word), like a tokenizer would stream."""
+    parts, start = [], 0
+    for i, ch in enumerate(text):
+        if ch in " \n" and i + 1 < len(text) and text[i + 1] not in " \n":
+            parts.append(text[start:i + 1])
+            start = i + 1
+    parts.append(text[start:])
+    return [p for p in parts if p]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, obj: dict) -> None:
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        mock = self.server.mock
+        cfg = mock.config
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON body", "code": 400}})
+            return
+        model = str(body.get("model", ""))
+        status = cfg.errors.get(model)
+        if status is None and cfg.error_rate > 0 and mock.roll() < cfg.error_rate:
+            status = cfg.error_status
+        rejected = [p for p in GEN_PARAMS if p in body] if cfg.reject_params else []
+        if status is None and rejected:
+            status = 400
+        mock.count(status or 200)
+        speed = cfg.model_speed.get(model, 1.0)
+        token_delay = cfg.token_delay * speed
+        if cfg.ttfb > 0:
+            time.sleep(cfg.ttfb * speed)
+        if status:
+            message = f"Unsupported parameter: '{rejected[0]}'" if status == 400 and rejected else ERROR_MESSAGES.get(status, f"HTTP {status}")
+            self._send_json(status, {"error": {"message": message, "code": status}})
+            return
+
+        messages = body.get("messages") or [{}]
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        text = completion_text(str(messages[-1].get("content", "")), cfg, json_mode=json_mode)
+        system = str(messages[0].get("content", "")) if len(messages) > 1 else ""
+        if cfg.preamble and not text.startswith(("{", "```")) and "Do not open with a preamble" not in system:
+            text = cfg.preamble + text
+        finish = "stop"
+        stops = body.get("stop") or []
+        for stop in [stops] if isinstance(stops, str) else stops:
+            if stop in text:
+                text = text[:text.index(stop)]
+        deltas = split_deltas(text)
+        if isinstance(body.get("max_tokens"), int) and len(deltas) > body["max_tokens"]:
+            deltas = deltas[:body["max_tokens"]]
+            text = "".join(deltas)
+            finish = "length"
+        usage = {"prompt_tokens": sum(len(str(m.get("content", "")).split()) for m in messages), "completion_tokens": len(deltas)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not body.get("stream"):
+            if token_delay > 0:
+                time.sleep(token_delay * len(deltas))
+            self._send_json(200, {"id": "gen-mock", "model": model, "provider": cfg.provider, "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish}], "usage": usage})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self._chunk(b": OPENROUTER PROCESSING\n\n")
+            for i, piece in enumerate(deltas):
+                if cfg.stall_after is not None and i == cfg.stall_after:
+                    time.sleep(cfg.stall)
+                chunk = {"id": "gen-mock", "model": model, "provider": cfg.provider, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self._chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+                if token_delay > 0:
+                    time.sleep(token_delay)
+            final = {"id": "gen-mock", "model": model, "provider": cfg.provider, "choices": [{"index": 0, "delta": {}, "finish_reason": finish}], "usage": usage}
+            self._chunk(b"data: " + json.dumps(final).encode("utf-8") + b"\n\n")
+            self._chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled mid-stream (hedging, deadlines); nothing to finish
+            pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    mock: "MockOpenAI"
+
+
+class MockOpenAI:
+    """Loopback mock server; use as a context manager or call start()/stop()."""
+
+    def __init__(self, config: Optional[MockConfig] = None, port: int = 0):
+        self.config = config or MockConfig()
+        self._httpd = _Server(("127.0.0.1", port), _Handler)
+        self._httpd.mock = self
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.status_counts: Dict[int, int] = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/v1"
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def count(self, status: int) -> None:
+        with self._lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def start(self) -> "MockOpenAI":
+        threading.Thread(target=self._httpd.serve_forever, name="mock-openai", daemon=True).start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockOpenAI":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+
+def parse_errors(specs) -> Dict[str, int]:
+    """`model=status` pairs from the command line."""
+    errors = {}
+    for spec in specs or []:
+        model, _, status = spec.rpartition("=")
+        if not model or not status.isdigit():
+            raise argparse.ArgumentTypeError(f"expected MODEL=STATUS, got {spec!r}")
+        errors[model] = int(status)
+    return errors
+
+
+def parse_speeds(specs) -> Dict[str, float]:
+    """`model=factor` pairs from the command line."""
+    speeds = {}
+    for spec in specs or []:
+        model, _, factor = spec.rpartition("=")
+        try:
+            value = float(factor)
+        except ValueError:
+            value = None
+        if not model or value is None:
+            raise argparse.ArgumentTypeError(f"expected MODEL=FACTOR, got {spec!r}")
+        speeds[model] = value
+    return speeds
+
+
+def add_mock_arguments(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--ttfb", type=float, default=0.0, help="Seconds before the status line")
+    ap.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed deltas")
+    ap.add_argument("--tokens", type=int, default=60, help="Deltas per plain-text answer")
+    ap.add_argument("--error", action="append", metavar="MODEL=STATUS", help="Always fail MODEL with STATUS (repeatable)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with --error-status")
+    ap.add_argument("--error-status", type=int, default=503)
+    ap.add_argument("--stall-after", type=int, default=None, metavar="N", help="Stall streams after N deltas")
+    ap.add_argument("--stall", type=float, default=0.0, help="Stall length in seconds")
+    ap.add_argument("--model-speed", action="append", metavar="MODEL=FACTOR", help="Scale MODEL's ttfb and token delay by FACTOR (repeatable)")
+    ap.add_argument("--ramble", type=int, default=0, metavar="N", help="JSON stages add N words of prose after the closing fence")
+    ap.add_argument("--bad-json", action="store_true", help="JSON stages answer with an undecodable field unless asked for a repair")
+    ap.add_argument("--reject-params", action="store_true", help="Answer 400 to requests with max_tokens/stop/response_format")
+    ap.add_argument("--preamble", default="", help="Put this text before plain answers (\\n for newlines)")
+    ap.add_argument("--eval-fail", action="store_true", help="Self-eval answers fail with a suggested fix (runs the rewrite stage)")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(ttfb=args.ttfb, token_delay=args.token_delay, tokens=args.tokens, errors=parse_errors(args.error),
+                      error_rate=args.error_rate, error_status=args.error_status, stall_after=args.stall_after,
+                      stall=args.stall, eval_pass=not args.eval_fail, model_speed=parse_speeds(args.model_speed),
+                      ramble=args.ramble, bad_json=args.bad_json, reject_params=args.reject_params,
+                      preamble=args.preamble.replace("\\n", "\n"))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Mock OpenAI/OpenRouter chat completions server")
+    ap.add_argument("--port", type=int, default=8791)
+    add_mock_arguments(ap)
+    args = ap.parse_args(argv)
+    mock = MockOpenAI(config_from_args(args), port=args.port)
+    print(f"mock server on {mock.base_url} config={json.dumps(asdict(mock.config))}", flush=True)
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
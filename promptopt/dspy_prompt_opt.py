@@ -4,6 +4,8 @@ import argparse
 import dspy
 from dotenv import load_dotenv
 
+from prompt_lint import check_preamble
+
 # Load environment variables
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
@@ -101,20 +103,8 @@ def parse_formatter_file(file_path):
 
 def validate_formatted_output(text):
     """Ensure output starts immediately and has no pre/post-amble."""
-    if text is None:
-        return False, "Output is None"
-    if text == "":
-        return False, "Output is empty"
-    if text[0].isspace():
-        return False, "Output starts with whitespace"
-    stripped = text.lstrip()
-    banned_prefixes = ("Below is", "Here is", "Here are", "Below are")
-    if any(stripped.startswith(pfx) for pfx in banned_prefixes):
-        return False, "Output starts with a preamble"
-    # Require first non-space to be a structural character or word character
-    if not re.match(r"^[\[{<\w]", stripped):
-        return False, "Output does not start with structured content"
-    return True, ""
+    # The rules live in prompt_lint, which also applies them to Agent Mode prompts
+    return check_preamble(text, markdown=False)
 
 def main():
     parser = argparse.ArgumentParser(description="Optimize prompts using DSPy and strict formats.")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Hedged model fallback for PromptOpt.
+
+Instead of walking `models_to_try` strictly in order, a `HedgedRace` starts
+the primary model, launches the next fallback whenever no content has arrived
+within the hedge delay (or starts the top N at once), and keeps whichever
+contender produces non-whitespace content first. Losers are cancelled through
+their `CancelToken`, which aborts the socket so the provider stops generating
+for them. Only the winner's chunks are yielded, so only the winner writes to
+the output file.
+"""
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from async_client import CancelToken
+
+# A contender is (label, start) where start(token) returns an iterable of text chunks
+Contender = Tuple[str, Callable[[CancelToken], Iterable[str]]]
+
+
+class _Entrant:
+    __slots__ = ("index", "label", "token", "launched_at", "first_at", "error", "finished", "pending")
+
+    def __init__(self, index: int, label: str, launched_at: float):
+        self.index = index
+        self.label = label
+        self.token = CancelToken()
+        self.launched_at = launched_at
+        self.first_at: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self.finished = False
+        self.pending: List[str] = []
+
+
+class HedgedRace:
+    """
+    Race contenders and yield the winner's chunks.
+
+    Args:
+        contenders: Ordered (label, start) pairs; index 0 is the primary model
+        hedge_delay: Seconds without content before the next contender is launched
+                     (None: only launch a new contender when a running one fails)
+        launch_now: Contenders started immediately (top N)
+
+    After iteration, `winner`, `entrants` and `report()` describe the race. If
+    every contender fails, the last error is re-raised.
+    """
+
+    def __init__(self, contenders: List[Contender], hedge_delay: Optional[float] = None, launch_now: int = 1, dbg: Optional[Callable[[str], None]] = None):
+        if not contenders:
+            raise ValueError("HedgedRace needs at least one contender")
+        self.contenders = contenders
+        self.hedge_delay = hedge_delay
+        self.launch_now = max(1, launch_now)
+        self.winner: Optional[_Entrant] = None
+        self.entrants: List[_Entrant] = []
+        self._dbg = dbg or (lambda msg: None)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._t0 = 0.0
+
+    def _launch(self) -> None:
+        idx = len(self.entrants)
+        label, start = self.contenders[idx]
+        ent = _Entrant(idx, label, time.monotonic())
+        self.entrants.append(ent)
+        self._dbg(f"hedge: launching #{idx} {label} at +{ent.launched_at - self._t0:.2f}s")
+
+        def worker() -> None:
+            try:
+                for piece in start(ent.token):
+                    if ent.token.cancelled:
+                        return
+                    self._queue.put((ent, "piece", piece))
+                self._queue.put((ent, "done", None))
+            except BaseException as e:
+                self._queue.put((ent, "error", e))
+
+        threading.Thread(target=worker, name=f"promptopt-hedge-{idx}", daemon=True).start()
+
+    def _running(self) -> List[_Entrant]:
+        return [e for e in self.entrants if not e.finished]
+
+    def __iter__(self):
+        self._t0 = time.monotonic()
+        for _ in range(min(self.launch_now, len(self.contenders))):
+            self._launch()
+        last_launch = time.monotonic()
+        last_error: Optional[BaseException] = None
+
+        while self.winner is None:
+            timeout = None
+            if self.hedge_delay is not None and len(self.entrants) < len(self.contenders):
+                timeout = max(0.0, last_launch + self.hedge_delay - time.monotonic())
+            try:
+                ent, kind, value = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._launch()
+                last_launch = time.monotonic()
+                continue
+            if kind == "piece":
+                ent.pending.append(value)
+                if value.strip():
+                    ent.first_at = time.monotonic()
+                    self.winner = ent
+                continue
+            # Contender ended without producing content
+            ent.finished = True
+            if kind == "error":
+                ent.error = value
+                last_error = value
+                self._dbg(f"hedge: #{ent.index} {ent.label} failed: {value}")
+            else:
+                self._dbg(f"hedge: #{ent.index} {ent.label} finished without content")
+            if not self._running():
+                if len(self.entrants) < len(self.contenders):
+                    self._launch()
+                    last_launch = time.monotonic()
+                else:
+                    raise last_error or ValueError("all hedged models returned no content")
+
+        winner = self.winner
+        for ent in self.entrants:
+            if ent is not winner and not ent.finished:
+                ent.token.cancel()
+        self._dbg(self.report())
+
+        yield from winner.pending
+        while True:
+            ent, kind, value = self._queue.get()
+            if ent is not winner:
+                continue
+            if kind == "piece":
+                yield value
+            elif kind == "error":
+                winner.error = value
+                raise value
+            else:
+                winner.finished = True
+                return
+
+    def report(self) -> str:
+        """One-line summary: who won, when its first content arrived, and how long the others had waited."""
+        w = self.winner
+        if w is None:
+            return "hedge: no winner"
+        ttft = w.first_at - w.launched_at
+        parts = [f"hedge: winner #{w.index} {w.label} first content at +{w.first_at - self._t0:.2f}s (ttft {ttft:.2f}s)"]
+        for ent in self.entrants:
+            if ent is w:
+                continue
+            if ent.error is not None:
+                parts.append(f"#{ent.index} {ent.label} failed")
+            else:
+                parts.append(f"#{ent.index} {ent.label} cancelled with no content after {w.first_at - ent.launched_at:.2f}s")
+        return "; ".join(parts)
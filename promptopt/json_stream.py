@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Incremental, tolerant extraction of top-level fields from streamed JSON.
+
+Agent Mode stages that answer with a JSON object (Stage 1 analysis, Stage 5
+self-eval) used to be parsed only after the whole response arrived, by
+splitting on code fences and calling `json.loads`, so one stray character
+anywhere lost every field. `JSONFieldStream.feed()` takes text deltas as
+they stream in and returns each top-level field as soon as its value is
+complete: strings on their closing quote, arrays/objects on their closing
+bracket, numbers and literals on the next `,` or `}`.
+
+Tolerances:
+  - anything before the object (prose, a ```json fence) is skipped; a `{`
+    only opens it when the next non-blank character is `"` or `}`, and an
+    object that closes without one decodable field (prose such as
+    `{"name"} here`) is dropped and the search resumes at the next `{`
+  - `extract_json_fields` (whole responses) first tries a `{` that opens a
+    line, as in a fenced block or bare JSON, before braces inside prose
+  - anything after the object closes (closing fence, trailing prose) is ignored
+  - a field whose value does not decode is dropped and recorded in `errors`;
+    the fields before and after it are kept
+  - a response cut off mid-object keeps every field completed so far
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+_WS = " \t\r\n"
+
+# A "{" opening a line, possibly right after a ``` fence on the same line
+_LINE_START_RE = re.compile(r"^[ \t]*(?:```\w*[ \t]*)?(?=\{)", re.MULTILINE)
+
+
+class JSONFieldStream:
+    """Feed text deltas; completed top-level fields come back from `feed()` and collect in `fields`."""
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self._restart("")
+
+    def _restart(self, lead: str) -> None:
+        self.errors: List[str] = []
+        self.started = False
+        self.complete = False
+        self._lead = lead
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key: Optional[str] = None
+        self._key_start = -1
+        self._value_start = -1
+        self._value_done = False
+
+    def feed(self, text: str) -> Dict[str, Any]:
+        """Add a delta; returns the fields that completed within it."""
+        if self.complete or not text:
+            return {}
+        new: Dict[str, Any] = {}
+        if self.started:
+            self._text += text
+        else:
+            self._lead += text
+        while self.started or self._start():
+            self._scan(new)
+            if not self.complete or self.fields:
+                break
+            # Closed without a decodable field: a brace in prose, so look again after its "{"
+            self._restart(self._text)
+        return new
+
+    def _start(self) -> bool:
+        """Open the object at the first plausible "{" in the skipped text; False until one arrives."""
+        lead = self._lead
+        i = lead.find("{")
+        while i >= 0:
+            j = i + 1
+            while j < len(lead) and lead[j] in _WS:
+                j += 1
+            if j == len(lead):
+                self._lead = lead[i:]  # decided by the next delta
+                return False
+            if lead[j] in '"}':
+                self.started = True
+                self._depth = 1
+                self._text = lead[i + 1:]
+                self._lead = ""
+                return True
+            i = lead.find("{", i + 1)
+        self._lead = ""
+        return False
+
+    def _scan(self, new: Dict[str, Any]) -> None:
+        s = self._text
+        i = self._pos
+        n = len(s)
+        while i < n:
+            ch = s[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._string_closed(i, new)
+                i += 1
+                continue
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._key is None and self._key_start < 0:
+                    self._key_start = i
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._value_start >= 0 and not self._value_done:
+                    self._finish_value(i + 1, new)
+                elif self._depth == 0:
+                    if self._value_start >= 0 and not self._value_done:
+                        self._finish_value(i, new)
+                    self.complete = True
+                    self._pos = i + 1
+                    return
+            elif self._depth == 1:
+                if ch == ":" and self._key is not None and self._value_start < 0:
+                    self._value_start = i + 1
+                elif ch == ",":
+                    if self._value_start >= 0 and not self._value_done:
+                        self._finish_value(i, new)
+                    self._reset_field()
+            i += 1
+        self._pos = i
+
+    def _string_closed(self, end: int, new: Dict[str, Any]) -> None:
+        if self._key is None and self._key_start >= 0:
+            try:
+                self._key = json.loads(self._text[self._key_start:end + 1])
+            except ValueError:
+                self._key = self._text[self._key_start + 1:end]
+            return
+        if self._value_start >= 0 and not self._value_done and self._text[self._value_start:end].strip(_WS).startswith('"'):
+            self._finish_value(end + 1, new)
+
+    def _finish_value(self, end: int, new: Dict[str, Any]) -> None:
+        self._value_done = True
+        raw = self._text[self._value_start:end].strip(_WS)
+        if not raw or self._key is None:
+            return
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            self.errors.append(self._key)
+            return
+        self.fields[self._key] = value
+        new[self._key] = value
+
+    def _reset_field(self) -> None:
+        self._key = None
+        self._key_start = -1
+        self._value_start = -1
+        self._value_done = False
+
+
+def extract_json_fields(raw: str) -> JSONFieldStream:
+    """Run a whole response through the extractor (the non-streaming case)."""
+    m = _LINE_START_RE.search(raw)
+    if m and m.end() > 0:
+        stream = JSONFieldStream()
+        stream.feed(raw[m.end():])
+        if stream.fields:
+            return stream
+    stream = JSONFieldStream()
+    stream.feed(raw)
+    return stream
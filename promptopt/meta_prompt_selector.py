@@ -2,15 +2,76 @@
 """
 Meta-Prompt Selector for PromptOpt
 Intelligently selects the best meta-prompt template based on input text analysis.
+
+Meta-prompt definitions (keywords, patterns, weights) live in
+meta-prompts/selector.json. They are compiled into an index that is pickled
+next to them and reused until the definitions change; `--build-index`
+rebuilds it ahead of time.
+
+Environment:
+    PROMPTOPT_SELECTOR_TIMING=1   print index status and load/score times to stderr
+
+Inputs longer than `stream_min_chars` are scored from sampled windows (see
+`MetaPromptSelector.score_stream`); the result records the fraction scanned.
+
+`--corpus FILE.jsonl` scores many texts at once through `score_batch`
+(selector_batch.py, requires NumPy) for offline threshold and weight tuning.
+
+With PROMPTOPT_SELECTOR_LEARN=1, selections and the user's menu choices
+are logged locally (choices only when the menu's caller runs
+`--record-choice ID`; promptopt.ps1 and the AHK scripts do not), and a model trained on them
+(`--train`, see selector_learn.py) picks instead of showing the menu when it
+is confident; `--learn-report` shows how many menus it avoided.
 """
 import os
 import re
 import json
 import sys
+import time
+import pickle
+import hashlib
 import argparse
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 from dataclasses import dataclass, asdict
+from itertools import islice
+
+from selector_learn import SelectionLearner, history_path_from_env, open_learner
+
+PATTERN_FLAGS = re.IGNORECASE | re.MULTILINE
+PATTERN_CAP = 2  # a pattern's score stops growing after two matches
+
+# Structure signals
+CODE_BLOCK_RE = re.compile(r'```[\s\S]*?```')
+CODE_TAG_RE = re.compile(r'<code>[\s\S]*?</code>', re.IGNORECASE)
+URL_RE = re.compile(r'https?://[^\s]+')
+# Matched against the lowercased text
+EDIT_INDICATORS = [
+    re.compile(r'\b(rewrite|refactor|polish|revise|clean up|improve|fix|correct|modify|update)\b'),
+    re.compile(r'\b(make|make it).*\b(more|better|clearer|professional|formal|casual)'),
+    re.compile(r'\b(before|after|original|current|existing)\b'),
+]
+RAG_INDICATORS = [
+    re.compile(r'\b(context|retrieve|search|document|chunk|embedding|vector|knowledge base|source)\b'),
+    re.compile(r'{{.*?}}'),  # Template placeholders
+]
+
+_IMPORTED = time.perf_counter()
+
+DEFINITIONS_FILE = 'selector.json'
+INDEX_FILE = '.selector_index.pickle'
+INDEX_VERSION = 1  # bump when the pickled matcher's layout changes
+
+SCORE_GAP = 0.15  # auto-select only when the top score leads the runner-up by this much
+
+# Sampled scoring of large inputs
+STREAM_MIN_CHARS = 64 * 1024
+WINDOW_CHARS = 8 * 1024
+MAX_SCAN_CHARS = 128 * 1024
+STABLE_WINDOWS = 3
+
+# `\b(word|other word|...)` at the start of a pattern: it can only match where one of the words occurs
+_LEAD_RE = re.compile(r'\\b\(((?:[\w \-]|\\\.)+(?:\|(?:[\w \-]|\\\.)+)*)\)')
 
 
 @dataclass
@@ -28,13 +89,16 @@ class MetaPrompt:
     def score_keywords(self, text: str) -> float:
         """Score based on keyword matches with weighted importance."""
         text_lower = text.lower()
+        # Count occurrences (more occurrences = stronger signal)
+        counts = {kw.lower(): text_lower.count(kw.lower()) for kw in self.keywords}
+        return self._keyword_score(counts, len(text.split()))
+    
+    def _keyword_score(self, counts: Dict[str, int], word_count: int) -> float:
         matches = 0
         total_weight = 0
         
         for kw in self.keywords:
-            kw_lower = kw.lower()
-            # Count occurrences (more occurrences = stronger signal)
-            count = text_lower.count(kw_lower)
+            count = counts.get(kw.lower(), 0)
             if count > 0:
                 # Weight by keyword length (longer = more specific)
                 kw_weight = len(kw.split()) * (1 + count * 0.3)
@@ -45,7 +109,6 @@ class MetaPrompt:
             return 0.0
         
         # Normalize by text length to avoid bias
-        word_count = len(text.split())
         if word_count == 0:
             return 0.0
         
@@ -55,12 +118,14 @@ class MetaPrompt:
     
     def score_patterns(self, text: str) -> float:
         """Score based on domain-specific regex patterns."""
-        score = 0.0
-        text_lower = text.lower()
+        counts = {p: len(re.findall(p, text, PATTERN_FLAGS)) for p in self.patterns}
+        return self._pattern_score(counts)
+    
+    def _pattern_score(self, counts: Dict[str, int]) -> float:
         max_pattern_score = 0.0
         
         for pattern in self.patterns:
-            matches = len(re.findall(pattern, text, re.IGNORECASE | re.MULTILINE))
+            matches = counts.get(pattern, 0)
             if matches > 0:
                 # Pattern matches are strong signals
                 pattern_score = min(matches * 0.2, 0.4)  # Cap per pattern
@@ -70,44 +135,31 @@ class MetaPrompt:
     
     def score_structure(self, text: str) -> float:
         """Score based on structural elements (code blocks, URLs, etc.)."""
-        score = 0.0
         text_lower = text.lower()
+        code = self.category == 'coding' and has_code(text)
+        urls = self.category == 'browser' and bool(URL_RE.search(text))
+        edit = self.mode == 'edit' and any(r.search(text_lower) for r in EDIT_INDICATORS)
+        rag = self.category == 'rag' and any(r.search(text_lower) for r in RAG_INDICATORS)
+        return self._structure_score(code, urls, edit, rag)
+    
+    def _structure_score(self, code: bool, urls: bool, edit: bool, rag: bool) -> float:
+        score = 0.0
         
         # Code block detection
-        if self.category == 'coding':
-            code_blocks = len(re.findall(r'```[\s\S]*?```', text))
-            code_tags = len(re.findall(r'<code>[\s\S]*?</code>', text, re.IGNORECASE))
-            if code_blocks > 0 or code_tags > 0:
-                score += 0.5
+        if self.category == 'coding' and code:
+            score += 0.5
         
         # URL/web detection
-        if self.category == 'browser':
-            urls = len(re.findall(r'https?://[^\s]+', text))
-            if urls > 0:
-                score += 0.5  # Strong signal for browser operations
+        if self.category == 'browser' and urls:
+            score += 0.5  # Strong signal for browser operations
         
         # Edit mode detection
-        if self.mode == 'edit':
-            edit_indicators = [
-                r'\b(rewrite|refactor|polish|revise|clean up|improve|fix|correct|modify|update)\b',
-                r'\b(make|make it).*\b(more|better|clearer|professional|formal|casual)',
-                r'\b(before|after|original|current|existing)\b',
-            ]
-            for pattern in edit_indicators:
-                if re.search(pattern, text_lower):
-                    score += 0.4  # Strong signal for edit mode
-                    break
+        if self.mode == 'edit' and edit:
+            score += 0.4  # Strong signal for edit mode
         
         # RAG/context detection
-        if self.category == 'rag':
-            rag_indicators = [
-                r'\b(context|retrieve|search|document|chunk|embedding|vector|knowledge base|source)\b',
-                r'{{.*?}}',  # Template placeholders
-            ]
-            for pattern in rag_indicators:
-                if re.search(pattern, text_lower):
-                    score += 0.3
-                    break
+        if self.category == 'rag' and rag:
+            score += 0.3
         
         return min(score, 1.0)
     
@@ -116,9 +168,24 @@ class MetaPrompt:
         if not text or not text.strip():
             return 0.0
         
-        keyword_score = self.score_keywords(text) * 0.5
-        pattern_score = self.score_patterns(text) * 0.3
-        structure_score = self.score_structure(text) * 0.2
+        return self._combine(self.score_keywords(text), self.score_patterns(text), self.score_structure(text))
+    
+    def score_hits(self, hits: 'TextHits') -> float:
+        """Same as `score`, from a `CompiledMatcher.scan` of the text."""
+        if hits.word_count == 0:
+            return 0.0
+        
+        return self._combine(
+            self._keyword_score(hits.keywords, hits.word_count),
+            self._pattern_score(hits.patterns),
+            self._structure_score(hits.code, hits.urls, hits.edit, hits.rag),
+        )
+    
+    @staticmethod
+    def _combine(keywords: float, patterns: float, structure: float) -> float:
+        keyword_score = keywords * 0.5
+        pattern_score = patterns * 0.3
+        structure_score = structure * 0.2
         
         total = keyword_score + pattern_score + structure_score
         
@@ -130,10 +197,285 @@ class MetaPrompt:
         return min(total, 1.0)
 
 
+@dataclass
+class TextHits:
+    """Everything the scorers read from one text, gathered by `CompiledMatcher.scan`."""
+    keywords: Dict[str, int]  # lowercased keyword or lead word -> occurrences, as str.count counts them
+    patterns: Dict[str, int]  # pattern -> matches, capped at PATTERN_CAP
+    word_count: int
+    code: bool
+    urls: bool
+    edit: bool
+    rag: bool
+    
+    def merge(self, other: 'TextHits') -> None:
+        """Add the hits of another window of the same text."""
+        for kw, count in other.keywords.items():
+            self.keywords[kw] = self.keywords.get(kw, 0) + count
+        for pattern, count in other.patterns.items():
+            self.patterns[pattern] = min(self.patterns.get(pattern, 0) + count, PATTERN_CAP)
+        self.word_count += other.word_count
+        self.code = self.code or other.code
+        self.urls = self.urls or other.urls
+        self.edit = self.edit or other.edit
+        self.rag = self.rag or other.rag
+
+
+def text_windows(text: str, size: int = WINDOW_CHARS) -> List[Tuple[int, int]]:
+    """(start, end) spans of about `size` characters, cut after whitespace so no word is split."""
+    spans = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = max(text.rfind('\n', start, end), text.rfind(' ', start, end))
+            if cut > start:
+                end = cut + 1
+        spans.append((start, end))
+        start = end
+    return spans
+
+
+def spread_order(n: int) -> List[int]:
+    """0..n-1 as first, last, middle, quarters, ...: every prefix covers the whole range evenly."""
+    if n <= 0:
+        return []
+    order = [0] + ([n - 1] if n > 1 else [])
+    intervals = [(0, n - 1)]
+    for lo, hi in intervals:
+        if hi - lo >= 2:
+            mid = (lo + hi) // 2
+            order.append(mid)
+            intervals += [(lo, mid), (mid, hi)]
+    return order
+
+
+def has_code(text: str) -> bool:
+    return bool(CODE_BLOCK_RE.search(text) or CODE_TAG_RE.search(text))
+
+
+def lead_words(pattern: str) -> Optional[List[str]]:
+    """Lowercased words one of which must occur for `pattern` to match, or None if it has no literal lead."""
+    m = _LEAD_RE.match(pattern)
+    if not m:
+        return None
+    return [alt.replace('\\.', '.').lower() for alt in m.group(1).split('|')]
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """Regex for a keyword trie: at any position it matches the longest keyword starting there."""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+    
+    def build(node: Dict) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ''
+        body = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+        # Greedy: try the longer keyword first, fall back to the one ending here
+        return '(?:' + body + ')?' if '' in node else body
+    
+    return build(trie)
+
+
+class KeywordAutomaton:
+    """
+    Counts every keyword in one pass over the text (Aho-Corasick style).
+    
+    The keyword trie is compiled into a single lookahead regex, so the scan
+    runs in the regex engine instead of a Python loop per character. Each
+    position reports the longest keyword starting there; every other keyword
+    starting there is a prefix of it, so `_prefixes` recovers them all.
+    Counts are non-overlapping per keyword, exactly like `str.count`.
+    """
+    
+    def __init__(self, keywords):
+        self.keywords = sorted({kw.lower() for kw in keywords if kw})
+        self.source = '(?=(' + _trie_pattern(self.keywords) + '))' if self.keywords else ''
+        self._prefixes = {kw: [p for p in self.keywords if kw.startswith(p)] for kw in self.keywords}
+        self._regex = None
+    
+    def __getstate__(self):
+        # A compiled regex pickles as its source and is recompiled on load; compile on first use instead
+        return dict(self.__dict__, _regex=None)
+    
+    def count(self, text_lower: str) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        if not self.source:
+            return counts
+        if self._regex is None:
+            self._regex = re.compile(self.source)
+        next_free: Dict[str, int] = {}
+        for m in self._regex.finditer(text_lower):
+            pos = m.start()
+            for kw in self._prefixes[m.group(1)]:
+                if pos >= next_free.get(kw, 0):
+                    counts[kw] = counts.get(kw, 0) + 1
+                    next_free[kw] = pos + len(kw)
+        return counts
+
+
+class CompiledMatcher:
+    """
+    All keywords, patterns and structure checks of a set of meta-prompts,
+    compiled once. `scan` lowercases and splits the text once and makes a
+    single automaton pass that counts the keywords together with the lead
+    words of every pattern and indicator (`lead_words`). A pattern none of
+    whose lead words occur cannot match and is never run; the others run once
+    for all meta-prompts that share them and stop at their PATTERN_CAP-th
+    match, where `min(matches * 0.2, 0.4)` saturates.
+    
+    Patterns are not merged into one alternation: a combined scan consumes
+    each match for the first alternative only, which would change the
+    per-pattern counts the scores are built from.
+    
+    Patterns are compiled on first use, so a pickled matcher (see
+    `load_index`) loads without compiling anything and patterns that are
+    always gated out are never compiled.
+    """
+    
+    def __init__(self, meta_prompts: List[MetaPrompt]):
+        self.patterns = list(dict.fromkeys(p for mp in meta_prompts for p in mp.patterns))
+        self._categories = {mp.category for mp in meta_prompts}
+        self._edit = any(mp.mode == 'edit' for mp in meta_prompts)
+        indicators = [r.pattern for r in EDIT_INDICATORS + RAG_INDICATORS]
+        self._leads = {p: lead_words(p) for p in self.patterns + indicators}
+        self.automaton = KeywordAutomaton(
+            [kw for mp in meta_prompts for kw in mp.keywords] +
+            [w for words in self._leads.values() if words for w in words]
+        )
+        self._compiled: Dict[str, 're.Pattern'] = {}
+    
+    def __getstate__(self):
+        return dict(self.__dict__, _compiled={})
+    
+    def _regex(self, pattern: str) -> 're.Pattern':
+        regex = self._compiled.get(pattern)
+        if regex is None:
+            regex = self._compiled[pattern] = re.compile(pattern, PATTERN_FLAGS)
+        return regex
+    
+    def scan(self, text: str) -> TextHits:
+        text_lower = text.lower()
+        counts = self.automaton.count(text_lower)
+        # Under IGNORECASE a few non-ASCII letters (long s, Kelvin sign) match
+        # ASCII ones that lower() does not map them to; only gate ASCII text
+        ascii_only = text.isascii()
+        
+        def could_match(pattern: str, lowered: bool) -> bool:
+            words = self._leads[pattern]
+            return words is None or not (lowered or ascii_only) or any(w in counts for w in words)
+        
+        def search(regexes) -> bool:
+            return any(could_match(r.pattern, True) and r.search(text_lower) for r in regexes)
+        
+        patterns = {}
+        for pattern in self.patterns:
+            if could_match(pattern, False):
+                patterns[pattern] = sum(1 for _ in islice(self._regex(pattern).finditer(text), PATTERN_CAP))
+            else:
+                patterns[pattern] = 0
+        return TextHits(
+            keywords=counts,
+            patterns=patterns,
+            word_count=len(text.split()),
+            code='coding' in self._categories and has_code(text),
+            urls='browser' in self._categories and bool(URL_RE.search(text)),
+            edit=self._edit and search(EDIT_INDICATORS),
+            rag='rag' in self._categories and search(RAG_INDICATORS),
+        )
+
+
+def _meta_prompt(definition: Dict, meta_prompt_dir: Path) -> MetaPrompt:
+    return MetaPrompt(
+        id=definition['id'],
+        name=definition['name'],
+        description=definition['description'],
+        keywords=definition['keywords'],
+        patterns=definition['patterns'],
+        file_path=str(meta_prompt_dir / definition['file']),
+        category=definition['category'],
+        mode=definition['mode'],
+        weight=definition.get('weight', 1.0),
+    )
+
+
+def compile_index(raw: bytes, stat: os.stat_result) -> Dict:
+    """Compile the contents of a definitions file (read after `stat`) into an index."""
+    definitions = json.loads(raw.decode('utf-8'))['meta_prompts']
+    meta_prompts = [_meta_prompt(d, Path()) for d in definitions]
+    return {
+        'version': INDEX_VERSION,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': hashlib.sha256(raw).hexdigest(),
+        'definitions': definitions,
+        'matcher': CompiledMatcher(meta_prompts),
+    }
+
+
+def read_index(index_path: Path) -> Optional[Dict]:
+    """The pickled index, or None if it is missing, unreadable or from another INDEX_VERSION."""
+    try:
+        with open(index_path, 'rb') as f:
+            index = pickle.load(f)
+    except Exception:
+        return None
+    return index if isinstance(index, dict) and index.get('version') == INDEX_VERSION else None
+
+
+def write_index(index: Dict, index_path: Path) -> bool:
+    """Atomically replace the pickled index; False if the directory is not writable."""
+    tmp = index_path.with_name(f'{index_path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp, 'wb') as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, index_path)
+        return True
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+
+def load_index(definitions_path: Path, index_path: Path, rebuild: bool = False) -> Tuple[Dict, str]:
+    """
+    Index for `definitions_path` and how it was obtained.
+    
+    The pickled index is reused while the definitions file keeps its mtime
+    and size. If either changed, the file is hashed: same content (a checkout
+    or copy touched it) keeps the index with a refreshed stamp; new content
+    is recompiled. The index is only ever read from the meta-prompt
+    directory, which is as trusted as the definitions themselves.
+    """
+    stat = definitions_path.stat()
+    index = None if rebuild else read_index(index_path)
+    if index is not None and (index['mtime_ns'], index['size']) == (stat.st_mtime_ns, stat.st_size):
+        return index, 'hit'
+    raw = definitions_path.read_bytes()
+    if index is not None and index['sha256'] == hashlib.sha256(raw).hexdigest():
+        index.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        status = 'hit (hash)'
+    else:
+        index = compile_index(raw, stat)
+        status = 'built'
+    if not write_index(index, index_path):
+        status += ', not saved'
+    return index, status
+
+
 class MetaPromptSelector:
-    def __init__(self, meta_prompt_dir: str, config: Optional[Dict] = None):
+    def __init__(self, meta_prompt_dir: str, config: Optional[Dict] = None, rebuild: bool = False,
+                 learner: Optional[SelectionLearner] = None):
         self.meta_prompt_dir = Path(meta_prompt_dir)
         self.meta_prompts: List[MetaPrompt] = []
+        self.learner = learner
         
         # Default configuration
         self.confidence_threshold = 0.65
@@ -141,6 +483,7 @@ class MetaPromptSelector:
         self.show_scores_in_menu = True
         self.fallback_id = "general-meta"
         self.min_text_length = 10
+        self.stream_min_chars = STREAM_MIN_CHARS
         
         if config:
             self.confidence_threshold = config.get('confidence_threshold', 0.65)
@@ -148,260 +491,18 @@ class MetaPromptSelector:
             self.show_scores_in_menu = config.get('show_scores_in_menu', True)
             self.fallback_id = config.get('fallback_metaprompt', 'general-meta')
             self.min_text_length = config.get('min_text_length', 10)
+            self.stream_min_chars = config.get('stream_min_chars', STREAM_MIN_CHARS)
         
-        self.load_meta_prompts()
-    
-    def load_meta_prompts(self):
-        """Load meta-prompt definitions with comprehensive keyword/pattern sets."""
-        self.meta_prompts = [
-            MetaPrompt(
-                id="general-meta",
-                name="General - Meta Prompt",
-                description="Universal orchestration for reasoning, planning, analysis, and everyday assistance",
-                keywords=[
-                    "general", "reasoning", "planning", "analysis", "explain", "help", "assist",
-                    "task", "goal", "objective", "decision", "recommend", "suggest", "advice"
-                ],
-                patterns=[
-                    r'\b(think|reason|analyze|plan|decide|recommend|suggest|explain|help)\b',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt.general.md"),
-                category="general",
-                mode="meta",
-                weight=0.9  # Slightly lower weight (fallback)
-            ),
-            MetaPrompt(
-                id="coding-meta",
-                name="Coding - Meta Prompt",
-                description="Code generation, refactoring, debugging, and programming tasks",
-                keywords=[
-                    "code", "function", "class", "debug", "programming", "api", "json", "xml",
-                    "python", "javascript", "typescript", "java", "c++", "rust", "go",
-                    "algorithm", "data structure", "library", "framework", "syntax", "error",
-                    "test", "unit test", "implementation", "interface", "module", "package"
-                ],
-                patterns=[
-                    r'\b(function|class|def |import |const |let |var |return |async |await )',
-                    r'```[\s\S]*?```',  # Code blocks
-                    r'<code>[\s\S]*?</code>',
-                    r'\b(\.py|\.js|\.ts|\.java|\.cpp|\.rs|\.go)\b',  # File extensions
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt.coding.md"),
-                category="coding",
-                mode="meta",
-                weight=1.2  # Higher weight (strong signals)
-            ),
-            MetaPrompt(
-                id="coding-python-meta",
-                name="Coding Python - Meta Prompt",
-                description="Python-specific code generation with advanced structure and multi-perspective reasoning",
-                keywords=[
-                    "python", "py", "django", "flask", "fastapi", "pandas", "numpy",
-                    "pytest", "pip", "virtualenv", "conda", "pydantic", "typing",
-                    "decorator", "generator", "comprehension", "async", "asyncio",
-                    "__init__", "__main__", "import", "from import"
-                ],
-                patterns=[
-                    r'\b(python|\.py)\b',
-                    r'\b(def |class |import |from .* import |async def )',
-                    r'\b(django|flask|fastapi|pandas|numpy|pytest|pydantic)\b',
-                    r'@\w+',  # Decorators
-                    r'\b(__init__|__main__|__name__)\b',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt.codingpython.md"),
-                category="coding",
-                mode="meta",
-                weight=1.3  # Higher weight for Python-specific signals
-            ),
-            MetaPrompt(
-                id="coding-edit",
-                name="Coding - Edit Mode",
-                description="Code refactoring, style fixes, documentation, and code improvements",
-                keywords=[
-                    "refactor", "clean", "style", "format", "document", "improve code",
-                    "optimize", "simplify", "restructure", "reorganize", "rename",
-                    "add comments", "fix style", "lint", "format code", "code review"
-                ],
-                patterns=[
-                    r'\b(refactor|clean|style|format|document|optimize|simplify)\b.*\b(code|function|class)',
-                    r'\b(fix|improve|update|modify).*code',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt_Edits.coding.md"),
-                category="coding",
-                mode="edit",
-                weight=1.1
-            ),
-            MetaPrompt(
-                id="writing-meta",
-                name="Writing - Meta Prompt",
-                description="Original prose generation: articles, stories, blog posts, marketing copy, emails",
-                keywords=[
-                    "write", "essay", "article", "blog", "story", "email", "letter",
-                    "document", "prose", "narrative", "creative", "copy", "content",
-                    "post", "draft", "compose", "author", "text", "paragraph"
-                ],
-                patterns=[
-                    r'\b(write|compose|draft|author|create).*\b(essay|article|blog|story|email|letter|post)',
-                    r'\b(marketing|copy|content|prose|narrative)\b',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt.writing.md"),
-                category="writing",
-                mode="meta",
-                weight=1.1
-            ),
-            MetaPrompt(
-                id="writing-edit",
-                name="Writing - Edit Mode",
-                description="Style transformations: rewriting text into new tone, voice, or genre",
-                keywords=[
-                    "rewrite", "change tone", "style", "voice", "genre", "transform",
-                    "make it", "convert to", "adapt", "rephrase", "paraphrase"
-                ],
-                patterns=[
-                    r'\b(rewrite|transform|adapt|convert).*\b(tone|style|voice|genre)',
-                    r'\b(make it|change to|convert to)\b.*\b(formal|casual|professional|playful|academic)',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt_Edits.writing.md"),
-                category="writing",
-                mode="edit",
-                weight=1.0
-            ),
-            MetaPrompt(
-                id="browser-meta",
-                name="Browser - Meta Prompt",
-                description="Web/page content operations: summarize, extract, analyze web content",
-                keywords=[
-                    "webpage", "website", "url", "browser", "page", "html", "scrape",
-                    "extract from page", "read page", "web content", "site", "link",
-                    "webpage content", "page content", "from this page", "from this url",
-                    "extract", "summarize", "analyze", "main points", "key points",
-                    "from the page", "from the article", "from the website"
-                ],
-                patterns=[
-                    r'https?://[^\s]+',  # URLs
-                    r'\b(webpage|website|url|browser|page|html)\b',
-                    r'\b(extract|scrape|read|get|summarize|analyze).*\b(page|web|site|url|article)',
-                    r'\b(from|from this|from the).*\b(page|url|website|article|site)',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt.browser.md"),
-                category="browser",
-                mode="meta",
-                weight=1.3  # Higher weight for URL detection
-            ),
-            MetaPrompt(
-                id="browser-edit",
-                name="Browser - Edit Mode",
-                description="Cleaning and refining text extracted from web pages, PDFs, or browser sources",
-                keywords=[
-                    "clean", "remove", "extract", "scraped", "web content", "html artifacts",
-                    "remove navigation", "remove ads", "clean up page", "extract text",
-                    "clean up", "remove html", "strip html", "remove formatting"
-                ],
-                patterns=[
-                    r'\b(clean|remove|extract|strip).*\b(html|web|page|scraped|formatting|artifacts)',
-                    r'\b(remove|strip).*\b(navigation|menu|ads|banner|header|footer)',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt_Edits.browser.md"),
-                category="browser",
-                mode="edit",
-                weight=1.1
-            ),
-            MetaPrompt(
-                id="rag-meta",
-                name="RAG - Meta Prompt",
-                description="Retrieval-augmented generation: using retrieved context chunks for grounded answers",
-                keywords=[
-                    "retrieve", "search", "document", "context", "chunk", "rag",
-                    "embedding", "vector", "knowledge base", "source", "reference",
-                    "based on", "using context", "from documents", "retrieved"
-                ],
-                patterns=[
-                    r'\b(retrieve|search|context|chunk|embedding|vector|rag|knowledge base)\b',
-                    r'{{.*?}}',  # Template placeholders
-                    r'\b(based on|using|from).*\b(context|document|source|reference)',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt.rag.md"),
-                category="rag",
-                mode="meta",
-                weight=1.2
-            ),
-            MetaPrompt(
-                id="rag-edit",
-                name="RAG - Edit Mode",
-                description="Revising text while enforcing consistency with retrieved context chunks",
-                keywords=[
-                    "align", "match context", "revise with", "edit based on", "update from",
-                    "consistent with", "according to", "per context", "based on documents"
-                ],
-                patterns=[
-                    r'\b(align|match|revise|edit|update).*\b(context|document|source)',
-                    r'\b(consistent|according|based).*\b(context|document)',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt_Edits.rag.md"),
-                category="rag",
-                mode="edit",
-                weight=1.1
-            ),
-            MetaPrompt(
-                id="general-edit",
-                name="General - Edit Mode",
-                description="Polishing non-code text: emails, reports, outlines, documentation",
-                keywords=[
-                    "improve", "polish", "refine", "edit", "fix grammar", "clarify",
-                    "make clearer", "better", "enhance", "revise", "clean up text",
-                    "rewrite", "rewrite this", "make more", "make it more", "change tone",
-                    "more professional", "more formal", "more casual", "more concise"
-                ],
-                patterns=[
-                    r'\b(improve|polish|refine|edit|fix|clarify|enhance|revise|rewrite).*\b(text|writing|document|email|message|letter)',
-                    r'\b(make|make it).*\b(clearer|better|more concise|more professional|more formal|more casual)',
-                    r'\b(rewrite|change).*\b(tone|style|voice)',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt_Edits.general.md"),
-                category="general",
-                mode="edit",
-                weight=1.1
-            ),
-            MetaPrompt(
-                id="react-meta",
-                name="ReAct - Tool-Assisted",
-                description="ReAct-style reasoning with tool use: think step-by-step, call tools, observe results",
-                keywords=[
-                    "tool", "action", "observation", "react", "agent", "step-by-step",
-                    "reasoning loop", "use tool", "call function", "execute", "run",
-                    "think then act", "plan then execute", "tool use", "agentic"
-                ],
-                patterns=[
-                    r'\b(tool|action|observation|react|agent|step-by-step)\b',
-                    r'\b(think|reason).*\b(then|and).*\b(act|execute|call|use)',
-                    r'\b(use|call|execute|run).*\b(tool|function|api|action)',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt_ReAct.md"),
-                category="react",
-                mode="meta",
-                weight=1.2
-            ),
-            MetaPrompt(
-                id="relace-meta",
-                name="Relace - Edit Tool",
-                description="Generate precise file edit snippets for RelaceEditTool with minimal diff formatting",
-                keywords=[
-                    "relace", "edit tool", "file edit", "diff", "snippet", "patch",
-                    "code edit", "modify file", "insert", "delete", "replace",
-                    "minimal diff", "edit payload", "json edit", "code change"
-                ],
-                patterns=[
-                    r'\b(relace|edit tool|file edit|diff|patch)\b',
-                    r'\b(insert|delete|replace).*\b(code|line|function|block)',
-                    r'\b(modify|change|update).*\b(file|code)\b',
-                    r'RelaceEditTool',
-                ],
-                file_path=str(self.meta_prompt_dir / "Meta_Prompt.relace.md"),
-                category="coding",
-                mode="meta",
-                weight=1.4  # High weight for specific tool use
-            ),
-        ]
+        self.load_meta_prompts(rebuild)
+    
+    def load_meta_prompts(self, rebuild: bool = False):
+        """Load meta-prompt definitions from selector.json through the compiled index."""
+        start = time.perf_counter()
+        self.index_path = self.meta_prompt_dir / INDEX_FILE
+        index, self.index_status = load_index(self.meta_prompt_dir / DEFINITIONS_FILE, self.index_path, rebuild)
+        self.meta_prompts = [_meta_prompt(d, self.meta_prompt_dir) for d in index['definitions']]
+        self.matcher = index['matcher']
+        self.load_ms = (time.perf_counter() - start) * 1000
     
     def score_all(self, text: str) -> List[Tuple[MetaPrompt, float]]:
         """Score all meta-prompts against input text."""
@@ -412,11 +513,70 @@ class MetaPromptSelector:
                 return [(fallback, 0.5)]
             return []
         
-        scored = [(mp, mp.score(text)) for mp in self.meta_prompts]
+        hits = self.matcher.scan(text)
+        scored = [(mp, mp.score_hits(hits)) for mp in self.meta_prompts]
         # Sort by score descending
         scored.sort(key=lambda x: x[1], reverse=True)
         return scored
     
+    def score_stream(self, text: str) -> Tuple[List[Tuple[MetaPrompt, float]], float]:
+        """
+        Score all meta-prompts, reading only as much of a large text as the decision needs.
+        
+        Returns the `score_all`-style ranking and the fraction of the text
+        scanned. Texts up to `stream_min_chars` (0 disables sampling) are
+        scored whole. Longer ones are split into windows visited in
+        `spread_order`, so the sample spans the whole text rather than its
+        start. Hits accumulate across windows and the ranking is rescored
+        after each one. Scanning stops when the last STABLE_WINDOWS rankings
+        agree on the top meta-prompt and on whether it clears the threshold
+        and the SCORE_GAP margin, and the margin has moved less than its
+        distance from that gap, or after MAX_SCAN_CHARS.
+        
+        The stopping rule is a heuristic, not a statistical test: it only
+        sees the windows read, so a signal confined to windows it never
+        reached is missed and the pick can differ from `score_all` on the
+        whole text. Callers that need the full-scan pick set
+        `stream_min_chars` to 0.
+        """
+        if not self.stream_min_chars or len(text) <= self.stream_min_chars or len(text.strip()) < self.min_text_length:
+            return self.score_all(text), 1.0
+        
+        spans = text_windows(text)
+        hits = None
+        scanned = 0
+        recent: List[Tuple[str, bool, float]] = []
+        for i in spread_order(len(spans)):
+            start, end = spans[i]
+            window = self.matcher.scan(text[start:end])
+            if hits is None:
+                hits = window
+            else:
+                hits.merge(window)
+            scanned += end - start
+            
+            scored = sorted(((mp, mp.score_hits(hits)) for mp in self.meta_prompts), key=lambda x: x[1], reverse=True)
+            (top_mp, top_score), second_score = scored[0], scored[1][1] if len(scored) > 1 else 0.0
+            margin = top_score - second_score
+            recent = (recent + [(top_mp.id, top_score >= self.confidence_threshold and margin >= SCORE_GAP, margin)])[-STABLE_WINDOWS:]
+            if len(recent) == STABLE_WINDOWS and len({(top, auto) for top, auto, _ in recent}) == 1:
+                margins = [m for _, _, m in recent]
+                if max(margins) - min(margins) < abs(sum(margins) / len(margins) - SCORE_GAP):
+                    break
+            if scanned >= MAX_SCAN_CHARS:
+                break
+        return scored, scanned / len(text)
+    
+    def score_batch(self, texts: List[str]):
+        """
+        Score many texts at once (NumPy required; see selector_batch.py).
+        
+        Returns (scores, ids): scores[i, m] equals `self.meta_prompts[m].score(texts[i])`
+        exactly, and ids[i] is the id `select` picks when the whole text is scored.
+        """
+        from selector_batch import score_batch
+        return score_batch(self, texts)
+    
     def select(
         self,
         text: str,
@@ -441,7 +601,7 @@ class MetaPromptSelector:
                 'reason': 'empty_input'
             }
         
-        scored = self.score_all(text)
+        scored, scanned = self.score_stream(text)
         if not scored:
             fallback = self._get_fallback()
             return {
@@ -462,9 +622,17 @@ class MetaPromptSelector:
             not force_menu and
             self.auto_detect_enabled and
             top_score >= self.confidence_threshold and
-            (top_score - second_score) >= 0.15  # At least 15% better than second
+            (top_score - second_score) >= SCORE_GAP  # At least 15% better than second
         )
         
+        # Where the heuristic would show the menu, a confident learned model picks instead
+        learned_mp, confidence = None, 0.0
+        if not should_auto and not force_menu and self.auto_detect_enabled and self.learner is not None:
+            learned = self.learner.predict(text, scored)
+            if learned is not None:
+                learned_mp = next((mp for mp in self.meta_prompts if mp.id == learned[0]), None)
+                confidence = learned[1]
+        
         if should_auto:
             return {
                 'id': top_mp.id,
@@ -474,7 +642,21 @@ class MetaPromptSelector:
                 'score': top_score,
                 'auto_selected': True,
                 'reason': 'high_confidence',
-                'all_scores': {mp.id: score for mp, score in scored[:5]}  # Top 5 for logging
+                'all_scores': {mp.id: score for mp, score in scored[:5]},  # Top 5 for logging
+                'scanned': round(scanned, 3)
+            }
+        elif learned_mp is not None:
+            return {
+                'id': learned_mp.id,
+                'file_path': learned_mp.file_path,
+                'category': learned_mp.category,
+                'mode': learned_mp.mode,
+                'score': next((score for mp, score in scored if mp is learned_mp), 0.0),
+                'auto_selected': True,
+                'reason': 'learned',
+                'learned_confidence': round(confidence, 3),
+                'all_scores': {mp.id: score for mp, score in scored[:5]},
+                'scanned': round(scanned, 3)
             }
         else:
             # Return top choice but mark as needing menu
@@ -487,7 +669,8 @@ class MetaPromptSelector:
                 'auto_selected': False,
                 'reason': 'low_confidence' if top_score < self.confidence_threshold else 'close_scores',
                 'all_scores': {mp.id: score for mp, score in scored[:5]},
-                'show_menu': True
+                'show_menu': True,
+                'scanned': round(scanned, 3)
             }
     
     def _get_fallback(self) -> MetaPrompt:
@@ -501,21 +684,124 @@ class MetaPromptSelector:
         return self.meta_prompts[0] if self.meta_prompts else None
 
 
+def build_index_report(meta_prompt_dir: str) -> int:
+    """`--build-index`: rebuild the index, then time a cold load from it."""
+    try:
+        built = MetaPromptSelector(meta_prompt_dir, rebuild=True)
+    except (OSError, ValueError, KeyError) as e:
+        print(f'Failed to build selector index: {e}', file=sys.stderr)
+        return 1
+    if 'not saved' in built.index_status:
+        print(f'Could not write {built.index_path}', file=sys.stderr)
+        return 1
+    loaded = MetaPromptSelector(meta_prompt_dir)
+    matcher = loaded.matcher
+    print(f'Selector index: {built.index_path} ({built.index_path.stat().st_size // 1024} KB)')
+    print(f'  {len(loaded.meta_prompts)} meta-prompts, {len(matcher.automaton.keywords)} keywords and lead words, '
+          f'{len(matcher.patterns)} patterns')
+    print(f'  built in {built.load_ms:.1f} ms, loads in {loaded.load_ms:.1f} ms (index {loaded.index_status})')
+    return 0
+
+
+def score_corpus(meta_prompt_dir: str, config: Optional[Dict], corpus_path: str, output_path: Optional[str]) -> int:
+    """`--corpus`: score every record of a JSONL corpus with `score_batch`."""
+    try:
+        with open(corpus_path, 'r', encoding='utf-8') as f:
+            texts = [json.loads(line)['text'] for line in f if line.strip()]
+        selector = MetaPromptSelector(meta_prompt_dir, config)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(json.dumps({'error': f'Failed to read corpus: {e}'}), file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    try:
+        scores, ids = selector.score_batch(texts)
+    except ImportError:
+        print(json.dumps({'error': '--corpus requires NumPy (pip install numpy)'}), file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    
+    lines = []
+    auto = 0
+    for row, chosen in zip(scores.tolist(), ids):
+        ranked = sorted(row, reverse=True)
+        top_score = ranked[0] if ranked else 0.0
+        second_score = ranked[1] if len(ranked) > 1 else 0.0
+        auto_selected = (selector.auto_detect_enabled and top_score >= selector.confidence_threshold and
+                         (top_score - second_score) >= SCORE_GAP)
+        auto += auto_selected
+        lines.append(json.dumps({
+            'id': chosen,
+            'score': top_score,
+            'auto_selected': auto_selected,
+            'all_scores': {mp.id: score for mp, score in zip(selector.meta_prompts, row)},
+        }))
+    output = '\n'.join(lines) + ('\n' if lines else '')
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+    rate = len(texts) / elapsed if elapsed > 0 else 0.0
+    print(f'scored {len(texts)} texts in {elapsed * 1000:.0f} ms ({rate:.0f}/s); '
+          f'auto-selected {auto} at threshold {selector.confidence_threshold}', file=sys.stderr)
+    return 0
+
+
+def learn_command(meta_prompt_dir: str, config: Optional[Dict], train: bool) -> int:
+    """`--train` / `--learn-report` on the history at PROMPTOPT_SELECTOR_HISTORY."""
+    learner = SelectionLearner(history_path_from_env())
+    if train:
+        try:
+            selector = MetaPromptSelector(meta_prompt_dir, config)
+            model = learner.train([mp.id for mp in selector.meta_prompts])
+        except ImportError:
+            print('--train requires NumPy (pip install numpy)', file=sys.stderr)
+            return 1
+        except (OSError, ValueError, KeyError) as e:
+            print(f'Training failed: {e}', file=sys.stderr)
+            return 1
+        print(f'Trained on {model.stats["choices"]} choices in {model.stats["train_ms"]} ms: {learner.model_path}')
+    print(learner.report())
+    return 0
+
+
+def config_from_file(path: Optional[str]) -> Optional[Dict]:
+    """The `metaprompt_selector` section of a JSON config file, if one was given."""
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f).get('metaprompt_selector', {})
+    return None
+
+
 def main():
     parser = argparse.ArgumentParser(description='Meta-Prompt Selector for PromptOpt')
-    parser.add_argument('--input', required=True, help='Input text file path')
+    parser.add_argument('--input', help='Input text file path')
     parser.add_argument('--meta-prompt-dir', required=True, help='Directory containing meta-prompt files')
     parser.add_argument('--force-menu', action='store_true', help='Force menu display (low confidence)')
     parser.add_argument('--config', help='JSON config file path')
     parser.add_argument('--output', help='Output JSON file path (default: stdout)')
+    parser.add_argument('--build-index', action='store_true',
+                        help=f'Recompile {DEFINITIONS_FILE} into {INDEX_FILE} and report load times')
+    parser.add_argument('--corpus', help='Score a JSONL file of {"text": ...} records (requires NumPy); '
+                                         'writes one JSON result per line')
+    parser.add_argument('--record-choice', metavar='ID',
+                        help='Log that the user picked ID from the menu for --input (PROMPTOPT_SELECTOR_LEARN=1)')
+    parser.add_argument('--train', action='store_true', help='Train the learned selector on the logged choices (requires NumPy)')
+    parser.add_argument('--learn-report', action='store_true', help='Report logged selections and menus avoided')
     
     args = parser.parse_args()
     
-    # Load config if provided
-    config = None
-    if args.config and os.path.exists(args.config):
-        with open(args.config, 'r') as f:
-            config = json.load(f).get('metaprompt_selector', {})
+    if args.build_index:
+        sys.exit(build_index_report(args.meta_prompt_dir))
+    if args.train or args.learn_report:
+        sys.exit(learn_command(args.meta_prompt_dir, config_from_file(args.config), args.train))
+    if not args.input and not args.corpus:
+        parser.error('--input or --corpus is required unless --build-index, --train or --learn-report is given')
+    
+    config = config_from_file(args.config)
+    
+    if args.corpus:
+        sys.exit(score_corpus(args.meta_prompt_dir, config, args.corpus, args.output))
     
     # Read input text
     try:
@@ -526,14 +812,31 @@ def main():
         sys.exit(1)
     
     # Initialize selector
-    selector = MetaPromptSelector(args.meta_prompt_dir, config)
+    learner = open_learner()
+    try:
+        selector = MetaPromptSelector(args.meta_prompt_dir, config, learner=learner)
+    except (OSError, ValueError, KeyError) as e:
+        print(json.dumps({'error': f'Failed to load selector definitions: {e}'}), file=sys.stderr)
+        sys.exit(1)
+    
+    if args.record_choice:
+        if learner is not None:
+            learner.record_choice(text, selector.score_stream(text)[0], args.record_choice)
+        return
     
     # Select meta-prompt
+    start = time.perf_counter()
     result = selector.select(text, force_menu=args.force_menu)
+    if os.environ.get('PROMPTOPT_SELECTOR_TIMING', '').strip() == '1':
+        print(f'selector: index {selector.index_status}, load {selector.load_ms:.1f} ms, '
+              f'score {(time.perf_counter() - start) * 1000:.1f} ms, '
+              f'since import {(time.perf_counter() - _IMPORTED) * 1000:.1f} ms', file=sys.stderr)
     
     if not result:
         print(json.dumps({'error': 'Selection failed'}), file=sys.stderr)
         sys.exit(1)
+    if learner is not None:
+        learner.log_selection(result)
     
     # Output result
     output_json = json.dumps(result, indent=2)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Streaming preamble guard for standard-mode output.
+
+`validate_formatted_output` in dspy_prompt_opt.py rejects an answer that
+opens with "Here is..." or whitespace, but only once the whole answer
+exists. `PreambleGuard` checks the first tokens of a stream instead. It holds
+them back only until it can tell whether they open with a preamble, so no
+preamble text ever reaches the output file.
+
+A preamble has a definite shape: a line of at most HOLD_CHARS that opens
+with "Here is"/"Below are"/... followed by a space, or with "Sure",
+"Certainly", "Of course" or "Absolutely" followed directly by punctuation,
+ends with ":", "!" or ".", and is followed by a blank line or a `---` rule.
+Only such a line is acted on:
+
+  strip   drop the preamble line (and a `---` rule after it) and keep
+          streaming
+  retry   stop on the preamble (`abort` is set); the caller closes the stream
+          and asks again with PREAMBLE_CORRECTION added to the system prompt
+  off     no guard
+
+A first line that opens with one of those words without the rest of the
+shape ("Absolutely no network calls...", "Here is the list:" directly
+followed by content) is content: it is passed through and recorded in
+`flagged`.
+
+A guard built with `can_retry=False` (the retry itself, hedged races,
+non-streaming answers) strips what it can and passes the rest through.
+
+Environment:
+    PROMPTOPT_PREAMBLE_GUARD   strip|retry|off (default strip)
+"""
+import os
+import re
+from typing import Iterable, Optional
+
+from prompt_lint import PREAMBLES
+
+MODES = ("strip", "retry", "off")
+
+# validate_formatted_output's prefixes, and the usual chat openers
+PHRASES = PREAMBLES + ("Here's",)
+INTERJECTIONS = ("Sure", "Certainly", "Of course", "Absolutely")
+PREFIXES = PHRASES + INTERJECTIONS
+HOLD_CHARS = 200
+
+# "Here is the prompt", "Sure!", "Certainly, here": not "Heres", "Sure-footed" or "Absolutely no"
+_WORD_RE = re.compile("(?:" + "|".join(map(re.escape, PREFIXES)) + r")(?![\w'])")
+_OPENER_RE = re.compile("(?:" + "|".join(map(re.escape, PHRASES)) + r")[ \t]|(?:" + "|".join(map(re.escape, INTERJECTIONS)) + r")[,!.:]")
+
+PREAMBLE_CORRECTION = ("\n\nBegin your answer directly with the content itself. "
+                       "Do not open with a preamble such as \"Here is...\" or \"Sure\".")
+
+
+class PreambleGuard:
+    """Feed stream deltas; `feed()` and `finish()` return the text that is safe to write."""
+
+    def __init__(self, mode: str = "strip", can_retry: bool = True, hold_chars: int = HOLD_CHARS):
+        self.mode = mode
+        self.can_retry = can_retry
+        self.hold_chars = hold_chars
+        self.abort = False
+        self.stripped = ""
+        self.flagged = ""
+        self._buf = ""
+        self._passing = False
+        self._after_preamble = False
+
+    @property
+    def verdict(self) -> str:
+        """'retry' (aborted), 'stripped' (a preamble was removed), 'flagged' (kept, see `flagged`) or 'clean'."""
+        if self.abort:
+            return "retry"
+        if self.stripped.strip():
+            return "stripped"
+        return "flagged" if self.flagged else "clean"
+
+    def feed(self, text: str) -> str:
+        if self._passing:
+            return text
+        if self.abort:
+            return ""
+        self._buf += text
+        return self._scan(final=False)
+
+    def finish(self) -> str:
+        if self._passing or self.abort:
+            return ""
+        return self._scan(final=True)
+
+    def _pass(self, body: str, cut: int) -> str:
+        self._passing = True
+        self.stripped += self._buf[:cut]
+        self._buf = ""
+        return body
+
+    def _flag(self, body: str, cut: int) -> str:
+        # Opens like a preamble but lacks its shape: content, so it is kept
+        self.flagged = body.split("\n", 1)[0][:80]
+        return self._pass(body, cut)
+
+    def _scan(self, final: bool) -> str:
+        while True:
+            body = self._buf.lstrip()
+            lead = len(self._buf) - len(body)
+            if not body:
+                return ""
+            if self._after_preamble:
+                # A `---` rule between the preamble and the content goes with the preamble
+                if body.startswith("---\n") or (final and body.rstrip() == "---"):
+                    self.stripped += self._buf[:lead + 4]
+                    self._buf = body[4:]
+                    continue
+                if not final and "---\n".startswith(body):
+                    return ""
+            if not _OPENER_RE.match(body):
+                if not final and any(p.startswith(body) for p in PREFIXES):
+                    return ""  # could still turn into a preamble
+                if _WORD_RE.match(body):
+                    return self._flag(body, lead)
+                return self._pass(body, lead)
+            nl = body.find("\n")
+            if nl < 0:
+                if final or len(body) > self.hold_chars:
+                    # A one-line answer, or a first line too long to be an opener
+                    return self._flag(body, lead)
+                return ""
+            line = body[:nl].rstrip()
+            if len(line) > self.hold_chars or not line.endswith((":", "!", ".")):
+                return self._flag(body, lead)
+            gap = body[nl + 1:].lstrip(" \t\r")
+            if not final and (not gap or "---".startswith(gap)):
+                return ""  # the blank line or rule that would make it a preamble may still come
+            if not gap.startswith(("\n", "---")):
+                return self._flag(body, lead)
+            if self.can_retry and self.mode == "retry":
+                self.abort = True
+                return ""
+            self.stripped += self._buf[:lead + nl + 1]
+            self._buf = body[nl + 1:]
+            self._after_preamble = True
+
+
+def guard_mode() -> str:
+    mode = os.environ.get("PROMPTOPT_PREAMBLE_GUARD", "").strip().lower() or "strip"
+    return mode if mode in MODES else "strip"
+
+
+def open_guard(can_retry: bool = True) -> Optional[PreambleGuard]:
+    """Guard for one output stream, or None when PROMPTOPT_PREAMBLE_GUARD=off."""
+    mode = guard_mode()
+    return PreambleGuard(mode, can_retry=can_retry) if mode != "off" else None
+
+
+def write_guarded(pieces: Iterable[str], sink, guard: Optional[PreambleGuard]) -> bool:
+    """Write a stream through `guard` into `sink`; True if anything was written. Closes `pieces` on abort."""
+    wrote = False
+    for piece in pieces:
+        if guard is not None:
+            piece = guard.feed(piece)
+            if guard.abort:
+                close = getattr(pieces, "close", None)
+                if close is not None:
+                    # Cancels the HTTP stream instead of reading the rest of a bad answer
+                    close()
+                return False
+        if piece:
+            sink.write(piece)
+            wrote = True
+    tail = guard.finish() if guard is not None else ""
+    if tail:
+        sink.write(tail)
+        wrote = True
+    return wrote
+
+
+def strip_preamble(text: str) -> str:
+    """Whole-text version for non-streaming answers (strip only)."""
+    if guard_mode() == "off":
+        return text
+    guard = PreambleGuard(can_retry=False)
+    return guard.feed(text) + guard.finish()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Local rule-based pre-evaluator for the Agent Mode Stage 5 self-eval.
+
+`lint_prompt()` scores a Stage 4 prompt on the five STAGE5_PROMPT axes in
+well under a millisecond, from checks that do not need a model:
+
+  clarity               hedging / soft permissions ("if simpler", "when appropriate")
+  completeness          role, numbered requirements, output format, edge cases
+  actionability         no preamble or postamble, no leftover [PLACEHOLDER] markers
+  constraint_precision  numbered requirements, vague terms ("appropriate", "reasonable")
+  output_specification  output format section, examples, a concrete format
+
+`check_preamble()` holds the preamble rules for every generated prompt:
+`validate_formatted_output` in dspy_prompt_opt.py calls it for formatted
+prompts, and the lint calls it with a leading markdown heading also
+allowed. They live here because this module needs nothing outside the
+standard library.
+
+The result uses Stage 5's JSON schema, so it can stand in for the model's
+answer. `local_verdict()` says whether it is decisive: a clear pass skips the
+LLM evaluator, a clear fail goes straight to the rewrite with the local
+fixes, and only borderline scores are sent to the model.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Decisive bands of the local score; anything in between is borderline
+PASS_AT = 4.5
+FAIL_BELOW = 3.0
+
+HEDGES = ("if that makes things simpler", "if simpler", "when appropriate", "where appropriate", "if appropriate",
+          "as appropriate", "if possible", "if needed", "as needed", "feel free", "you may", "you might", "you could",
+          "try to", "ideally", "optionally", "perhaps", "maybe", "if you want", "prefer")
+VAGUE = ("appropriate", "reasonable", "minimal", "natural", "sufficient", "adequate", "suitable", "as much as possible",
+         "etc", "various", "good quality", "high quality")
+PREAMBLES = ("Below is", "Here is", "Here are", "Below are")
+POSTAMBLES = ("let me know", "i hope", "hope this", "feel free to", "this prompt ", "note: this prompt")
+
+# "you may not ..." is a prohibition, not a permission
+_HEDGE_RE = re.compile(r"\b(" + "|".join(re.escape(h) for h in HEDGES) + r")\b(?! not\b)", re.IGNORECASE)
+_VAGUE_RE = re.compile(r"\b(" + "|".join(re.escape(v) for v in VAGUE) + r")\b", re.IGNORECASE)
+# First character of structured content
+_START_RE = re.compile(r"^[\[{<\w]")
+_START_MD_RE = re.compile(r"^[\[{<\w#*]")
+_PLACEHOLDER_RE = re.compile(r"\[[A-Z][A-Z0-9_ \-]+\]")
+_NUMBERED_RE = re.compile(r"^\s*\d+[.)]\s+\S", re.MULTILINE)
+_HEADING_RE = re.compile(r"^\s*(?:#{1,6}\s+(.+?)\s*#*|\*\*(.+?)\*\*:?|<([a-z_]+)>)\s*$", re.IGNORECASE | re.MULTILINE)
+_ROLE_RE = re.compile(r"^\s*(?:you are|your role|act as|as an? \w+)", re.IGNORECASE | re.MULTILINE)
+_EDGE_RE = re.compile(r"edge case|corner case|\bif (?:the )?\w+ (?:is|are) (?:missing|empty|invalid|unclear|ambiguous)", re.IGNORECASE)
+_FORMAT_RE = re.compile(r"\b(json|markdown|yaml|xml|csv|table|bullet|numbered list|heading|code block)\b", re.IGNORECASE)
+
+
+def check_preamble(text: Optional[str], markdown: bool = True) -> Tuple[bool, str]:
+    """
+    (ok, reason) for output that must start immediately with its content.
+
+    Args:
+        text: Generated output
+        markdown: Also accept a leading markdown heading or bold marker
+    """
+    if text is None:
+        return False, "Output is None"
+    if text == "":
+        return False, "Output is empty"
+    if text[0].isspace():
+        return False, "Output starts with whitespace"
+    stripped = text.lstrip()
+    if any(stripped.startswith(pfx) for pfx in PREAMBLES):
+        return False, "Output starts with a preamble"
+    if not (_START_MD_RE if markdown else _START_RE).match(stripped):
+        return False, "Output does not start with structured content"
+    return True, ""
+
+
+def _headings(text: str) -> List[str]:
+    return [next(g for g in m.groups() if g).lower() for m in _HEADING_RE.finditer(text)]
+
+
+def _has_heading(headings: List[str], *words: str) -> bool:
+    return any(w in h for h in headings for w in words)
+
+
+def _distinct(matches: List[str]) -> List[str]:
+    # First spelling of each match, case-insensitively
+    seen: Dict[str, str] = {}
+    for m in matches:
+        seen.setdefault(m.lower(), m)
+    return list(seen.values())
+
+
+def lint_prompt(text: str) -> Dict[str, Any]:
+    """Score a prompt on the Stage 5 axes; returns Stage 5's JSON schema."""
+    text = text or ""
+    headings = _headings(text)
+    issues: Dict[str, List[str]] = {k: [] for k in ("clarity", "completeness", "actionability", "constraint_precision", "output_specification")}
+    fixes: Dict[str, List[str]] = {k: [] for k in issues}
+
+    hedges = _distinct(_HEDGE_RE.findall(text))
+    clarity = max(1, 5 - len(hedges))
+    if hedges:
+        issues["clarity"].append(f"Hedging / soft permissions: {', '.join(hedges)}")
+        fixes["clarity"].append(f"Replace {', '.join(repr(h) for h in hedges)} with definitive instructions")
+
+    numbered = len(_NUMBERED_RE.findall(text))
+    parts = {
+        "role definition": bool(_ROLE_RE.search(text)) or _has_heading(headings, "role", "identity"),
+        "numbered requirements": numbered >= 3 or _has_heading(headings, "requirement", "constraint", "rule"),
+        "output format section": _has_heading(headings, "output", "format", "response", "deliverable"),
+        "edge case handling": bool(_EDGE_RE.search(text)) or _has_heading(headings, "edge"),
+    }
+    missing = [name for name, ok in parts.items() if not ok]
+    completeness = 5 - len(missing)
+    if missing:
+        issues["completeness"].append(f"Missing: {', '.join(missing)}")
+        fixes["completeness"].append(f"Add {', '.join(missing)}")
+
+    actionability = 5
+    ok, why = check_preamble(text)
+    if not ok:
+        actionability -= 2
+        issues["actionability"].append(why)
+        fixes["actionability"].append("Start directly with the prompt content")
+    placeholders = _distinct(_PLACEHOLDER_RE.findall(text))
+    if placeholders:
+        actionability -= 2
+        issues["actionability"].append(f"Unfilled placeholders: {', '.join(placeholders[:5])}")
+        fixes["actionability"].append("Replace placeholder markers with concrete content or explicit instructions")
+    tail = text.rstrip().rsplit("\n\n", 1)[-1].lower()
+    if any(tail.startswith(p) for p in POSTAMBLES):
+        actionability -= 1
+        issues["actionability"].append("Ends with a postamble")
+        fixes["actionability"].append("Remove the closing commentary")
+    actionability = max(1, actionability)
+
+    vague = _distinct(_VAGUE_RE.findall(text))
+    precision = (5 if numbered >= 3 else 4 if numbered else 3) - min(3, len(vague))
+    precision = max(1, precision)
+    if not numbered:
+        issues["constraint_precision"].append("No numbered requirements")
+        fixes["constraint_precision"].append("State the hard requirements as a numbered list")
+    if vague:
+        issues["constraint_precision"].append(f"Vague terms: {', '.join(vague)}")
+        fixes["constraint_precision"].append(f"Replace {', '.join(repr(v) for v in vague)} with measurable limits")
+
+    has_output = parts["output format section"]
+    has_example = "example" in text.lower() or "```" in text
+    output_spec = 1 + (2 if has_output else 0) + (1 if has_example else 0) + (1 if _FORMAT_RE.search(text) else 0)
+    if not has_output:
+        issues["output_specification"].append("No output format section")
+        fixes["output_specification"].append("Add an output format section naming the exact structure")
+    if not has_example:
+        issues["output_specification"].append("No example output")
+        fixes["output_specification"].append("Add an example of the expected output")
+
+    scores = {"clarity": clarity, "completeness": completeness, "actionability": actionability,
+              "constraint_precision": precision, "output_specification": output_spec}
+    overall = round(sum(scores.values()) / len(scores), 2)
+    critical = [f"{axis} {score}: {'; '.join(issues[axis])}" for axis, score in scores.items() if score < 3]
+    suggested = [fix for axis, score in scores.items() if score < 3 for fix in fixes[axis]]
+    return {
+        "scores": scores,
+        "overall_score": overall,
+        "pass": overall >= 4.0,
+        "critical_issues": critical,
+        "suggested_fixes": suggested,
+    }
+
+
+def local_verdict(result: Dict[str, Any]) -> Optional[str]:
+    """'pass' or 'fail' when the local score is decisive, None when it is borderline and the model should judge."""
+    scores = result.get("scores") or {}
+    overall = result.get("overall_score", 0.0)
+    if overall >= PASS_AT and min(scores.values(), default=0) >= 4:
+        return "pass"
+    if overall < FAIL_BELOW and result.get("suggested_fixes"):
+        return "fail"
+    return None
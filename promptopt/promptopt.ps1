@@ -131,8 +131,13 @@ if ($ContextFilePath -and -not [string]::IsNullOrWhiteSpace($ContextFilePath)) {
   $userText = "Target File: $ContextFilePath`n`n" + $userText
 }
 
-# Context Scout: build and append a context bundle
-if ($ContextDir -and -not [string]::IsNullOrWhiteSpace($ContextDir) -and $ContextQuery -and -not [string]::IsNullOrWhiteSpace($ContextQuery)) {
+# Resident daemon: hand the job to `promptopt.py --serve` instead of paying interpreter start-up
+$useDaemon = ($env:PROMPTOPT_DAEMON -and ($env:PROMPTOPT_DAEMON -eq '1'))
+Write-Log "Daemon=$useDaemon"
+
+# Context Scout: build a context bundle and pass it as --context-file, apart from the selection (the Python backend does this in-process when using the daemon)
+$contextFile = $null
+if ((-not $useDaemon) -and $ContextDir -and -not [string]::IsNullOrWhiteSpace($ContextDir) -and $ContextQuery -and -not [string]::IsNullOrWhiteSpace($ContextQuery)) {
   try {
     $repoRoot = $ContextDir
     if (-not (Test-Path -LiteralPath $repoRoot)) {
@@ -166,7 +171,7 @@ if ($ContextDir -and -not [string]::IsNullOrWhiteSpace($ContextDir) -and $Contex
           $ctxContent = Get-Content -LiteralPath $ctxOut -Raw -Encoding UTF8
           if (-not [string]::IsNullOrWhiteSpace($ctxContent)) {
             Write-Log ("Context bundle length=" + $ctxContent.Length)
-            $userText = $userText + "`n`n---`n`n# Context`n" + $ctxContent
+            $contextFile = $ctxOut
           }
         } else {
           Write-Log "WARN: Context bundle not produced or empty."
@@ -276,6 +281,7 @@ if ($env:PROMPTOPT_DRYRUN -and $env:PROMPTOPT_DRYRUN.Trim()) {
   $offline += ''
   $offline += '# Task'
   $offline += $userText.Trim()
+  if ($contextFile) { $offline += "`n---`n`n# Context`n" + $ctxContent }
   $offline += ''
   $offline += '# Output Format'
   $offline += '- Return only the final prompt text.'
@@ -297,6 +303,7 @@ if ($env:PROMPTOPT_DRYRUN -and $env:PROMPTOPT_DRYRUN.Trim()) {
     Write-Log "Offline output written via dry-run."
     try { Remove-Item -LiteralPath $sysFile -Force } catch {}
     if ($effectiveSelectionFileCreated) { try { Remove-Item -LiteralPath $effectiveSelectionFile -Force } catch {} }
+    if ($contextFile) { try { Remove-Item -LiteralPath $contextFile -Force } catch {} }
     Write-Log "--- PromptOpt done (dry-run) ---"
     exit 0
   } catch {
@@ -375,11 +382,24 @@ if ($env:PROMPTOPT_STREAM -and $env:PROMPTOPT_STREAM.Trim()) {
   Write-Log 'Streaming enabled via PROMPTOPT_STREAM.'
 }
 
+if ($contextFile) {
+  $argsList += @('--context-file', $contextFile)
+}
+
 if ($AgentMode) {
   $argsList += @('--agent-mode')
   Write-Log 'Agent Mode enabled.'
 }
 
+if ($useDaemon) {
+  # The thin client takes the same arguments but only loads the standard library
+  $argsList[0] = Join-Path $scriptDir 'promptopt_client.py'
+  if ($ContextDir -and -not [string]::IsNullOrWhiteSpace($ContextDir) -and $ContextQuery -and -not [string]::IsNullOrWhiteSpace($ContextQuery)) {
+    $argsList += @('--context-dir', $ContextDir, '--context-query', $ContextQuery)
+  }
+  Write-Log 'Running job on PromptOpt daemon (falls back to in-process run if unreachable).'
+}
+
 Write-Log "Invoking Python backend..."
 $cmdline = ($argsList | ForEach-Object { '"' + ($_ -replace '"','\"') + '"' }) -join ' '
 Write-Log ("Python cmd: " + $python + ' ' + $cmdline)
@@ -408,4 +428,5 @@ try {
 
 try { Remove-Item -LiteralPath $sysFile -Force } catch {}
 if ($effectiveSelectionFileCreated) { try { Remove-Item -LiteralPath $effectiveSelectionFile -Force } catch {} }
+if ($contextFile) { try { Remove-Item -LiteralPath $contextFile -Force } catch {} }
 Write-Log "--- PromptOpt done ---"
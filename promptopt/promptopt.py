@@ -2,19 +2,32 @@
 import argparse
 import json
 import os
+import re
 import sys
-import urllib.request
+import threading
 import urllib.error
-from typing import Optional, Generator
+from typing import AsyncIterator, Callable, List, Optional, Generator
 import traceback
 import time
-
-# Import agent mode prompts
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+
+from async_client import CancelGroup, CancelToken, get_client, iter_sync, pool_stats, prewarm, prewarm_later, run_sync
+from hedging import HedgedRace
+from preamble_guard import PREAMBLE_CORRECTION, PreambleGuard, open_guard, strip_preamble, write_guarded
+from response_cache import ResponseCache, cache_key, open_cache
+from sse_parser import ChatEvent
+from stream_sink import StreamSink
+from stage_ir import estimate_tokens, join_context, minify_json, seed_context
+from stage_routing import StageRouter, open_latency_history, router_from_config
+from tracing import Span, child_span, open_tracer
+
+# Import agent mode prompts and stage graph
 try:
-    from agent_mode_prompts import (
-        STAGE1_PROMPT, STAGE2_PROMPT, STAGE3_PROMPT, STAGE4_PROMPT,
-        STAGE5_PROMPT, STAGE5_REWRITE_PROMPT, AGENT_MODE_SYSTEM
-    )
+    from agent_pipeline import (SectionWriter, StageGraphRunner, StageSpec, adaptive_from_env, adaptive_max_chars,
+                                agent_path, build_graph, candidates_from_env, compact_ir_from_env, graph_from_env,
+                                local_eval_from_env, profiles_from_env, scorer_from_env)
+    from agent_checkpoint import open_checkpoints, resume_from_env
     AGENT_MODE_AVAILABLE = True
 except ImportError:
     AGENT_MODE_AVAILABLE = False
@@ -81,159 +94,245 @@ def extract_output_text(obj: dict) -> str:
     return json.dumps(obj, ensure_ascii=False)
 
 
-def post_json(url: str, body: dict, api_key: str, extra_headers: Optional[dict] = None, timeout_sec: int = 20) -> dict:
-    data = json.dumps(body).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
-    req.add_header("Authorization", f"Bearer {api_key}")
-    req.add_header("User-Agent", "PromptOpt/1.0 (+https://localhost)")
-    req.add_header("Accept", "application/json")
+def request_headers(api_key: str, accept: str, extra_headers: Optional[dict] = None) -> dict:
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}",
+        "User-Agent": "PromptOpt/1.0 (+https://localhost)",
+        "Accept": accept,
+    }
     if extra_headers:
-        for k, v in extra_headers.items():
-            req.add_header(k, v)
+        headers.update(extra_headers)
+    return headers
+
+
+def http_error_to_value_error(e: urllib.error.HTTPError) -> ValueError:
+    """Map a provider HTTP error to the ValueError messages the CLI reports."""
+    error_body = ""
     try:
-        with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
-            raw = resp.read().decode("utf-8", errors="replace")
-            return json.loads(raw)
+        error_body = e.read().decode("utf-8", errors="replace")
+        error_obj = json.loads(error_body) if error_body else {}
+        error_msg = error_obj.get("error", {}).get("message", str(e))
+        dbg(f"HTTP {e.code}: {error_body}")
+        if e.code == 401:
+            return ValueError(f"Authentication failed (401): {error_msg}. Please verify your API key is valid and not expired. Check your .env file for OPENROUTER_API_KEY.")
+        return ValueError(f"HTTP {e.code}: {error_msg}")
+    except json.JSONDecodeError:
+        dbg(f"HTTP {e.code}: {error_body}")
+        if e.code == 401:
+            return ValueError(f"Authentication failed (401). Please verify your API key is valid and not expired. Check your .env file for OPENROUTER_API_KEY.")
+        return ValueError(f"HTTP {e.code}: {error_body}")
+
+
+async def apost_json(url: str, body: dict, api_key: str, extra_headers: Optional[dict] = None, timeout_sec: int = 20, deadline_sec: Optional[float] = None, span: Optional[Span] = None) -> dict:
+    headers = request_headers(api_key, "application/json", extra_headers)
+    try:
+        return await get_client().post_json(url, body, headers, timeout_sec, deadline_sec, span=span)
     except urllib.error.HTTPError as e:
-        error_body = ""
-        try:
-            error_body = e.read().decode("utf-8", errors="replace")
-            error_obj = json.loads(error_body) if error_body else {}
-            error_msg = error_obj.get("error", {}).get("message", str(e))
-            dbg(f"HTTP {e.code}: {error_body}")
-            if e.code == 401:
-                raise ValueError(f"Authentication failed (401): {error_msg}. Please verify your API key is valid and not expired. Check your .env file for OPENROUTER_API_KEY.")
-            raise ValueError(f"HTTP {e.code}: {error_msg}")
-        except json.JSONDecodeError:
-            dbg(f"HTTP {e.code}: {error_body}")
-            if e.code == 401:
-                raise ValueError(f"Authentication failed (401). Please verify your API key is valid and not expired. Check your .env file for OPENROUTER_API_KEY.")
-            raise ValueError(f"HTTP {e.code}: {error_body}")
-
-
-def stream_chat_completions(url: str, payload: dict, api_key: str, extra_headers: Optional[dict] = None, timeout_sec: int = 60) -> Generator[str, None, None]:
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Content-Type", "application/json")
-    req.add_header("Authorization", f"Bearer {api_key}")
-    req.add_header("User-Agent", "PromptOpt/1.0 (+https://localhost)")
-    req.add_header("Accept", "text/event-stream")
-    if extra_headers:
-        for k, v in extra_headers.items():
-            req.add_header(k, v)
+        raise http_error_to_value_error(e)
+
+
+async def astream_chat_completions(url: str, payload: dict, api_key: str, extra_headers: Optional[dict] = None, timeout_sec: int = 60, deadline_sec: Optional[float] = None, on_event: Optional[Callable[[ChatEvent], None]] = None, span: Optional[Span] = None) -> AsyncIterator[str]:
+    """Yield content deltas; non-content events (finish_reason, usage, errors) go to on_event."""
+    headers = request_headers(api_key, "text/event-stream", extra_headers)
     try:
-        with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
-            while True:
-                line = resp.readline()
-                if not line:
-                    break
-                try:
-                    s = line.decode("utf-8", errors="replace").strip()
-                except Exception:
-                    continue
-                if not s:
-                    continue
-                if not s.startswith("data:"):
-                    continue
-                d = s[5:].strip()
-                if d == "[DONE]":
-                    break
-                try:
-                    obj = json.loads(d)
-                except Exception:
-                    continue
-                choices = obj.get("choices")
-                if isinstance(choices, list) and choices:
-                    ch0 = choices[0] if isinstance(choices[0], dict) else None
-                    if not ch0:
-                        continue
-                    delta = ch0.get("delta", {})
-                    if isinstance(delta, dict):
-                        piece = delta.get("content")
-                        if isinstance(piece, str) and piece:
-                            yield piece
+        async for cev in get_client().stream_events(url, payload, headers, timeout_sec, deadline_sec, span=span):
+            if cev.kind == "content":
+                yield cev.text
+                continue
+            if cev.kind == "error":
+                dbg(f"stream error event: {cev.text}")
+            if on_event and cev.kind != "done":
+                on_event(cev)
     except urllib.error.HTTPError as e:
-        error_body = ""
-        try:
-            error_body = e.read().decode("utf-8", errors="replace")
-            error_obj = json.loads(error_body) if error_body else {}
-            error_msg = error_obj.get("error", {}).get("message", str(e))
-            dbg(f"HTTP {e.code}: {error_body}")
-            if e.code == 401:
-                raise ValueError(f"Authentication failed (401): {error_msg}. Please verify your API key is valid and not expired. Check your .env file for OPENROUTER_API_KEY.")
-            raise ValueError(f"HTTP {e.code}: {error_msg}")
-        except json.JSONDecodeError:
-            dbg(f"HTTP {e.code}: {error_body}")
-            if e.code == 401:
-                raise ValueError(f"Authentication failed (401). Please verify your API key is valid and not expired. Check your .env file for OPENROUTER_API_KEY.")
-            raise ValueError(f"HTTP {e.code}: {error_body}")
-
-
-def try_call(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, timeout_sec: int) -> dict:
-    lb = base_url.rstrip("/")
+        raise http_error_to_value_error(e)
+
+
+def post_json(url: str, body: dict, api_key: str, extra_headers: Optional[dict] = None, timeout_sec: int = 20, cancel: Optional[CancelToken] = None) -> dict:
+    return run_sync(apost_json(url, body, api_key, extra_headers, timeout_sec), cancel=cancel)
+
+
+def stream_chat_completions(url: str, payload: dict, api_key: str, extra_headers: Optional[dict] = None, timeout_sec: int = 60, cancel: Optional[CancelToken] = None, on_event: Optional[Callable[[ChatEvent], None]] = None) -> Generator[str, None, None]:
+    yield from iter_sync(astream_chat_completions(url, payload, api_key, extra_headers, timeout_sec, on_event=on_event), cancel=cancel)
+
+
+def is_openrouter(base_url: str, api_key: str) -> bool:
+    return ("openrouter.ai" in base_url.lower()) or api_key.startswith("sk-or-")
+
+
+def chat_completions_url(base_url: str, api_key: str) -> str:
+    """Endpoint calls go to; OpenRouter URLs and keys always use the canonical OpenRouter base."""
+    lb = "https://openrouter.ai/api/v1" if is_openrouter(base_url, api_key) else base_url.rstrip("/")
+    return f"{lb}/chat/completions"
+
+
+def build_chat_request(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, stream: bool = False, provider_only: Optional[List[str]] = None, params: Optional[dict] = None) -> tuple:
+    """
+    Resolve the Chat Completions endpoint and build (url, payload, extra_headers) for a call.
+
+    `provider_only` pins OpenRouter providers for this call, overriding PROMPTOPT_PROVIDER_ONLY.
+    `params` adds generation parameters (max_tokens, stop, response_format) to the payload.
+    """
+    url = chat_completions_url(base_url, api_key)
+    suffix = " (stream)" if stream else ""
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": user_input},
+        ],
+        "temperature": 0.2,
+    }
+    if params:
+        payload.update(params)
+    if stream:
+        payload["stream"] = True
     # Detect OpenRouter and use chat/completions compatibility
-    is_openrouter = ("openrouter.ai" in lb) or api_key.startswith("sk-or-")
-    if is_openrouter:
-        # Force correct base for OpenRouter regardless of provided base_url
-        lb = "https://openrouter.ai/api/v1"
-        dbg(f"using OpenRouter endpoint: {lb}")
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_input},
-            ],
-            "temperature": 0.2,
-        }
+    if is_openrouter(base_url, api_key):
+        # chat_completions_url forces the correct base for OpenRouter regardless of provided base_url
+        dbg(f"using OpenRouter endpoint{suffix}: {url}")
         # Support provider routing via environment variable
         # PROMPTOPT_PROVIDER_ONLY can be a comma-separated list like "cerebras" or "cerebras,deepinfra"
-        provider_only = os.environ.get("PROMPTOPT_PROVIDER_ONLY")
+        if provider_only is None:
+            provider_only = [p.strip() for p in os.environ.get("PROMPTOPT_PROVIDER_ONLY", "").split(",") if p.strip()]
         if provider_only:
-            providers = [p.strip() for p in provider_only.split(",") if p.strip()]
-            if providers:
-                payload["provider"] = {"only": providers}
-                dbg(f"provider routing: only={providers}")
+            payload["provider"] = {"only": list(provider_only)}
+            dbg(f"provider routing: only={list(provider_only)}")
         # Optional headers OpenRouter recognizes; configurable via env
         title = os.environ.get("PROMPTOPT_TITLE", "PromptOpt")
         referer = os.environ.get("PROMPTOPT_REFERER") or os.environ.get("OPENROUTER_SITE_URL") or "https://localhost/"
         extra = {"X-Title": title, "HTTP-Referer": referer}
-        return post_json(f"{lb}/chat/completions", payload, api_key, extra_headers=extra, timeout_sec=timeout_sec)
-    else:
-        # Prefer Chat Completions for broad compatibility
-        dbg(f"using OpenAI Chat Completions endpoint: {lb}/chat/completions")
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_input},
-            ],
-            "temperature": 0.2,
-        }
-        return post_json(f"{lb}/chat/completions", payload, api_key, timeout_sec=timeout_sec)
-
-
-def call_api_simple(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, timeout_sec: int = 60) -> str:
+        return url, payload, extra
+    # Prefer Chat Completions for broad compatibility
+    dbg(f"using OpenAI Chat Completions endpoint{suffix}: {url}")
+    return url, payload, None
+
+
+# How provider errors name a generation parameter they do not support
+PARAM_ERRORS = {
+    "max_tokens": re.compile(r"\bmax_tokens\b"),
+    "stop": re.compile(r"\bstop\b", re.IGNORECASE),
+    "response_format": re.compile(r"response_format|json_object|json mode", re.IGNORECASE),
+}
+
+
+def rejected_params(e: Exception, params: dict) -> List[str]:
+    """
+    Keys of `params` that a 400/422 error names as unsupported.
+
+    Other client errors (context length, bad input, a gateway's transient
+    400) name none, so they are not taken for a missing feature.
+    """
+    msg = str(e)
+    if not msg.startswith(("HTTP 400", "HTTP 422")):
+        return []
+    return [k for k in params if k in PARAM_ERRORS and PARAM_ERRORS[k].search(msg)]
+
+
+def drop_params(params: Optional[dict], names) -> Optional[dict]:
+    """`params` without `names` (None when nothing is left)."""
+    if not params or not names:
+        return params
+    return {k: v for k, v in params.items() if k not in names} or None
+
+
+def http_span(parent: Optional[Span], model: str, attempt: int = 0, stream: bool = False) -> Optional[Span]:
+    """Span for one provider call under `parent` (None when tracing is off)."""
+    return child_span(parent, "http", "chat", model=model, attempt=attempt, stream=stream)
+
+
+def trace_usage(span: Span, usage: Optional[dict]) -> None:
+    """Token counts and generation rate (completion tokens per second after the first delta)."""
+    if not isinstance(usage, dict):
+        return
+    span.set(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+    completion = usage.get("completion_tokens")
+    gen_ms = span.elapsed_ms() - span.attrs.get("first_delta_ms", span.attrs.get("ttfb_ms", 0.0))
+    if isinstance(completion, (int, float)) and gen_ms > 0:
+        span.set(tokens_per_sec=round(completion * 1000.0 / gen_ms, 1))
+
+
+def trace_guard(span: Optional[Span], guard: Optional[PreambleGuard]) -> None:
+    """Record what the preamble guard did ('retry' wins over a later 'stripped')."""
+    if guard is None or guard.verdict == "clean":
+        return
+    if guard.stripped.strip():
+        dbg(f"preamble guard: stripped {guard.stripped.strip()[:80]!r}")
+    if guard.flagged:
+        dbg(f"preamble guard: kept {guard.flagged!r} (opens like a preamble but is not one)")
+    if span is not None and span.attrs.get("preamble") != "retry":
+        span.set(preamble=guard.verdict)
+
+
+def trace_sink(span: Optional[Span], sink: StreamSink) -> None:
+    """Add time spent writing the output file to the run span."""
+    if span is not None:
+        s = sink.stats()
+        span.set(output_write_ms=round(span.attrs.get("output_write_ms", 0.0) + s["write_ms"], 2), output_flushes=span.attrs.get("output_flushes", 0) + s["flushes"])
+
+
+async def acall(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, timeout_sec: int = 60, cache: Optional[ResponseCache] = None, deadline_sec: Optional[float] = None, span: Optional[Span] = None, provider_only: Optional[List[str]] = None, params: Optional[dict] = None, finish: Optional[dict] = None) -> dict:
+    """
+    Non-streaming Chat Completions call on the running event loop.
+
+    Cancel by cancelling the awaiting task; deadline_sec bounds the whole request.
+    If `span` is given it is filled in and ended here. If `finish` is given,
+    the answer's finish_reason is stored in it as "reason".
+    """
+    url, payload, extra = build_chat_request(base_url, model, sys_prompt, user_input, api_key, provider_only=provider_only, params=params)
+    key = cache_key(url, payload) if cache else None
+    with span or nullcontext():
+        if cache:
+            chunks = cache.get(key)
+            if chunks is not None:
+                dbg(f"cache hit: {key[:12]}")
+                if span is not None:
+                    span.set(cache="hit", bytes=sum(len(c.encode("utf-8")) for c in chunks))
+                return {"choices": [{"message": {"role": "assistant", "content": "".join(chunks)}}]}
+        resp = await apost_json(url, payload, api_key, extra_headers=extra, timeout_sec=timeout_sec, deadline_sec=deadline_sec, span=span)
+        text = extract_output_text(resp) if (cache or span is not None) else ""
+        choices = resp.get("choices")
+        reason = choices[0].get("finish_reason") if isinstance(choices, list) and choices and isinstance(choices[0], dict) else None
+        if finish is not None:
+            finish["reason"] = reason
+        if span is not None:
+            span.set(provider=resp.get("provider") or urlsplit(url).hostname, bytes=len(text.encode("utf-8")))
+            trace_usage(span, resp.get("usage"))
+        # A truncated answer is not cached: replayed, it could no longer be told apart
+        if cache and text and choices and reason != "length":
+            cache.put(key, [text], model)
+        return resp
+
+
+def try_call(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, timeout_sec: int, cache: Optional[ResponseCache] = None, cancel: Optional[CancelToken] = None, span: Optional[Span] = None, provider_only: Optional[List[str]] = None, params: Optional[dict] = None, finish: Optional[dict] = None, deadline_sec: Optional[float] = None) -> dict:
+    return run_sync(acall(base_url, model, sys_prompt, user_input, api_key, timeout_sec, cache=cache, deadline_sec=deadline_sec, span=span, provider_only=provider_only, params=params, finish=finish), cancel=cancel)
+
+
+def call_api_simple(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, timeout_sec: int = 60, cache: Optional[ResponseCache] = None, span: Optional[Span] = None, provider_only: Optional[List[str]] = None, params: Optional[dict] = None, finish: Optional[dict] = None, deadline_sec: Optional[float] = None, cancel: Optional[CancelToken] = None) -> str:
     """Simple API call that returns the response text. Used for agent mode stages."""
-    resp = try_call(base_url, model, sys_prompt, user_input, api_key, timeout_sec)
+    resp = try_call(base_url, model, sys_prompt, user_input, api_key, timeout_sec, cache=cache, cancel=cancel, span=span, provider_only=provider_only, params=params, finish=finish, deadline_sec=deadline_sec)
     return extract_output_text(resp)
 
 
-def call_api_streaming(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, output_file: str, timeout_sec: int = 60) -> str:
+def call_api_streaming(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, output_file: str, timeout_sec: int = 60, cache: Optional[ResponseCache] = None, sink: Optional[StreamSink] = None, span: Optional[Span] = None, provider_only: Optional[List[str]] = None, deadline_sec: Optional[float] = None) -> str:
     """Streaming API call that writes chunks to file and returns full response. Used for agent mode streaming."""
     full_response = []
-    for piece in try_stream(base_url, model, sys_prompt, user_input, api_key, timeout_sec):
-        full_response.append(piece)
-        # Append each chunk to the output file for live preview
-        try:
-            with open(output_file, 'a', encoding='utf-8', newline='') as f:
-                f.write(piece)
-        except Exception:
-            pass
+    out = sink or StreamSink(output_file)
+    try:
+        for piece in try_stream(base_url, model, sys_prompt, user_input, api_key, timeout_sec, cache=cache, span=span, provider_only=provider_only, deadline_sec=deadline_sec):
+            full_response.append(piece)
+            # Coalesced append to the output file for live preview
+            out.write(piece)
+    finally:
+        if sink is None:
+            try:
+                out.close()
+            except Exception:
+                pass
     return ''.join(full_response)
 
 
-def run_agent_mode(user_input: str, model: str, base_url: str, api_key: str, output_file: str, timeout_sec: int = 60, streaming: bool = False, enable_eval: bool = False) -> int:
+def run_agent_mode(user_input: str, model: str, base_url: str, api_key: str, output_file: str, timeout_sec: int = 60, streaming: bool = False, enable_eval: bool = False, cache: Optional[ResponseCache] = None, graph: Optional[str] = None, trace: Optional[Span] = None, resume: bool = False, adaptive: bool = False, result: Optional[dict] = None, router: Optional[StageRouter] = None, candidates: Optional[int] = None, deadline_sec: Optional[float] = None, context: str = "") -> int:
     """
     Execute 5-stage Agent Mode pipeline with GPT-5.1 best practices.
     Writes progress to output_file for live streaming display.
@@ -247,6 +346,18 @@ def run_agent_mode(user_input: str, model: str, base_url: str, api_key: str, out
         timeout_sec: Timeout per API call
         streaming: If True, stream each stage's output live to file
         enable_eval: If True, run Stage 5 self-eval pass
+        cache: Optional response cache shared by every stage call
+        graph: Stage graph name (see agent_pipeline.GRAPHS; default from PROMPTOPT_AGENT_GRAPH)
+        trace: Optional run span; each stage gets a child span with its HTTP call nested below
+        resume: Replay stages saved by an earlier failed run of the same input (see agent_checkpoint)
+        adaptive: Let Stage 1 choose a shorter path for short, unambiguous inputs (also PROMPTOPT_AGENT_ADAPTIVE=1)
+        result: Optional dict; with Stage 5 enabled, `eval` is set to "local" or "model" (who answered it)
+        router: Per-stage model chains (see stage_routing); default: every stage on `model` only
+        candidates: Best-of-N Final Assembly candidates (default from PROMPTOPT_AGENT_CANDIDATES, 1 = off);
+                    `candidate` in `result` is the winner's number
+        deadline_sec: Optional bound on each stage call as a whole (connect, wait and every read)
+        context: Context Scout bundle for the request; kept apart from `user_input` so compact IR can
+                 show it to Stage 1 only (stage_ir.seed_context)
 
     Returns: 0 on success, 1 on error
     """
@@ -254,200 +365,323 @@ def run_agent_mode(user_input: str, model: str, base_url: str, api_key: str, out
         dbg("Agent mode prompts not available")
         return 1
 
-    total_stages = 5 if enable_eval else 4
+    candidates = candidates_from_env(candidates)
+    total_stages = 5 if enable_eval or candidates > 1 else 4
     dbg(f"Starting Agent Mode pipeline ({total_stages} stages, streaming={streaming})")
 
-    # Clear output file
+    # Clear output file; every later write goes through one coalescing sink so ordering is preserved
     try:
-        with open(output_file, 'w', encoding='utf-8', newline='') as f:
-            f.write(f"Agent Mode: Starting {total_stages}-stage optimization...\n\n")
+        sink = StreamSink(output_file, truncate=True)
+        sink.write(f"Agent Mode: Starting {total_stages}-stage optimization...\n\n")
     except Exception as e:
         dbg(f"Failed to clear output file: {e}")
         return 1
 
-    def write_stage_header(stage_name: str):
-        """Write stage header for streaming mode."""
-        try:
-            with open(output_file, 'a', encoding='utf-8', newline='') as f:
-                f.write(f'<STAGE name="{stage_name}">\n')
-        except Exception as e:
-            dbg(f"Failed to write stage header: {e}")
-
-    def write_stage_footer():
-        """Write stage footer for streaming mode."""
-        try:
-            with open(output_file, 'a', encoding='utf-8', newline='') as f:
-                f.write('\n</STAGE>\n\n')
-        except Exception as e:
-            dbg(f"Failed to write stage footer: {e}")
-
-    def write_progress(stage_name: str, content: str):
-        """Append stage output to file for non-streaming display."""
-        try:
-            with open(output_file, 'a', encoding='utf-8', newline='') as f:
-                f.write(f'<STAGE name="{stage_name}">\n{content}\n</STAGE>\n\n')
-        except Exception as e:
-            dbg(f"Failed to write progress: {e}")
-
-    def update_status(msg: str):
-        """Update status in output file."""
-        try:
-            with open(output_file, 'a', encoding='utf-8', newline='') as f:
-                f.write(f"[STATUS] {msg}\n")
-        except Exception:
-            pass
-
-    def call_stage(sys_prompt: str, user_prompt: str, stage_name: str) -> str:
-        """Call API for a stage, with optional streaming."""
-        if streaming:
-            write_stage_header(stage_name)
-            result = call_api_streaming(base_url, model, sys_prompt, user_prompt, api_key, output_file, timeout_sec)
-            write_stage_footer()
-            return result
-        else:
-            result = call_api_simple(base_url, model, sys_prompt, user_prompt, api_key, timeout_sec)
-            write_progress(stage_name, result)
+    writer = SectionWriter(sink)
+
+    router = router or StageRouter(model)
+    url = chat_completions_url(base_url, api_key)
+    history = open_latency_history() if trace is not None else None
+    saved_ms: dict = {}
+    # (chat completions URL, model) -> generation params it refused in this run; later stages leave them out
+    refused: dict = {}
+    # Aborts every stage request still in flight once the graph has failed
+    cancels = CancelGroup()
+
+    def record_stage_latency(stage: StageSpec, m: str, stage_span: Optional[Span], t_stage: float) -> None:
+        # Compare a routed stage with its moving average on the job's model (kept only while tracing)
+        if stage_span is None or history is None:
+            return
+        ms = (time.monotonic() - t_stage) * 1000.0
+        stage_span.set(model=m)
+        history.record(stage.key, m, ms)
+        baseline = history.average_ms(stage.key, model) if m != model else None
+        if baseline is not None:
+            saved_ms[stage.key] = (m, round(baseline - ms, 1))
+            stage_span.set(baseline_model=model, baseline_ms=baseline, saved_ms=saved_ms[stage.key][1])
+
+    def stage_params(stage: StageSpec) -> Optional[dict]:
+        """Generation params a stage is sent with, before any its model refuses."""
+        profile = stage.profile.params() if stage.profile else None
+        if profile and streaming:
+            # A live stage cut off at its cap could not be retried without showing its text twice
+            profile = drop_params(profile, ["max_tokens"])
+        return profile
+
+    def call_stage(stage: StageSpec, prompt: str, section) -> str:
+        """Call API for a stage on its routed model chain, streaming into its section or writing the whole result at once."""
+        route = router.route(stage.key)
+        stage_span = child_span(trace, "stage", stage.key, title=stage.title, input_tokens_est=estimate_tokens(prompt))
+        t_stage = time.monotonic()
+        with stage_span or nullcontext():
+            tapped = section.tap is not None
+            # Text already on screen (or fed to the tap) cannot be taken back, so no fallback after it
+            emitted: list = []
+            result = ""
+            profile = stage_params(stage)
+            # (model, generation params); a model that refuses a param is retried without it
+            chain = [(m, drop_params(profile, refused.get((url, m)))) for m in route.models]
+            for attempt, (m, params) in enumerate(chain):
+                last = attempt == len(chain) - 1
+                span = http_span(stage_span, m, attempt=attempt, stream=streaming or tapped)
+                finish: dict = {}
+                token = cancels.token()
+                try:
+                    if streaming or tapped:
+                        # Tapped stages stream anyway so early values (Stage 1 task_type) reach the scheduler
+                        # mid-response; their section still receives the whole text at once
+                        for piece in try_stream(base_url, m, stage.system, prompt, api_key, timeout_sec, cache=cache, cancel=token, span=span, provider_only=route.provider_only, params=params, finish=finish, deadline_sec=deadline_sec):
+                            emitted.append(piece)
+                            if streaming:
+                                section.write(piece)
+                            else:
+                                section.observe(piece)
+                        result = "".join(emitted)
+                        if not result and not streaming:
+                            result = call_api_simple(base_url, m, stage.system, prompt, api_key, timeout_sec, cache=cache, span=http_span(stage_span, m, attempt=attempt), provider_only=route.provider_only, params=params, finish=finish, deadline_sec=deadline_sec, cancel=token)
+                            section.observe(result)
+                    else:
+                        result = call_api_simple(base_url, m, stage.system, prompt, api_key, timeout_sec, cache=cache, span=span, provider_only=route.provider_only, params=params, finish=finish, deadline_sec=deadline_sec, cancel=token)
+                except Exception as e:
+                    if token.cancelled:
+                        raise RuntimeError(f"stage {stage.key} cancelled: the run failed") from e
+                    names = rejected_params(e, params) if params and not emitted else []
+                    if names:
+                        dbg(f"stage {stage.key}: {m} does not support {', '.join(names)} ({e}); retrying without")
+                        refused.setdefault((url, m), set()).update(names)
+                        chain.insert(attempt + 1, (m, drop_params(params, names)))
+                        continue
+                    if last or emitted:
+                        raise
+                    dbg(f"stage {stage.key}: {m} failed ({e}); trying {chain[attempt + 1][0]}")
+                    continue
+                if token.cancelled:
+                    # A cancelled stream ends quietly; its partial text is not a result
+                    raise RuntimeError(f"stage {stage.key} cancelled: the run failed")
+                if finish.get("reason") == "length" and params and params.get("max_tokens") and not (streaming or tapped):
+                    # Reasoning models spend part of the cap on hidden reasoning; a cut-off stage is not kept
+                    dbg(f"stage {stage.key}: {m} stopped at max_tokens={params['max_tokens']}; retrying without the cap")
+                    chain.insert(attempt + 1, (m, drop_params(params, ["max_tokens"])))
+                    continue
+                if result or last:
+                    break
+                dbg(f"stage {stage.key}: {m} returned no text; trying {chain[attempt + 1][0]}")
+            if not streaming:
+                section.write(result, tap=False)
+            record_stage_latency(stage, m, stage_span, t_stage)
             return result
 
+    def prewarm_stages(n: int) -> None:
+        # Stages that can start from Stage 1's early output need connections of their own
+        prewarm_later(url, n)
+
+    graph_name = graph_from_env(graph)
+    adaptive = adaptive_from_env(adaptive)
+    if adaptive and len(join_context(user_input, context).strip()) > adaptive_max_chars():
+        dbg(f"Adaptive path: input longer than {adaptive_max_chars()} chars, running the full pipeline")
+        adaptive = False
+    stages = build_graph(graph_name, enable_eval, adaptive=adaptive, local_eval=local_eval_from_env(), profiles=profiles_from_env(), compact=compact_ir_from_env(),
+                         candidates=candidates, scorer=scorer_from_env())
+    by_key = {stage.key: stage for stage in stages}
+
+    def stage_variant(key: str) -> str:
+        # A stage saved on one routed model or profile is not replayed for another
+        stage = by_key.get(key)
+        return minify_json({"models": router.route(key).models, "params": stage_params(stage) if stage else None})
+
+    store = open_checkpoints()
+    checkpoint = store.run(base_url, model, join_context(user_input, context), resume=resume_from_env(resume), variant=stage_variant) if store else None
+    if checkpoint and checkpoint.resume:
+        dbg(f"Agent checkpoints: resuming from {checkpoint.path}")
+    runner = StageGraphRunner(stages, call_stage, writer, total_stages, dbg=dbg, checkpoint=checkpoint, prewarm=prewarm_stages, abort=cancels.cancel)
+    dbg(f"Agent graph: {graph_name}{' (adaptive)' if adaptive else ''}{f', best of {candidates}' if candidates > 1 else ''}")
+
     try:
-        # Stage 1: Goal Extraction (outputs JSON with task_type)
-        update_status(f"Stage 1/{total_stages}: Extracting goals and intent...")
-        stage1_prompt = STAGE1_PROMPT.format(input=user_input)
-        dbg("Stage 1: Goal Extraction")
-        stage1_raw = call_stage(AGENT_MODE_SYSTEM, stage1_prompt, "Goal Extraction")
-
-        # Parse task_type from Stage 1 JSON for use in Stage 3
-        task_type = "other"
         try:
-            # Try to find JSON in the response (may be wrapped in markdown code blocks)
-            json_str = stage1_raw
-            if "```json" in json_str:
-                json_str = json_str.split("```json")[1].split("```")[0]
-            elif "```" in json_str:
-                json_str = json_str.split("```")[1].split("```")[0]
-            stage1_json = json.loads(json_str.strip())
-            task_type = stage1_json.get("task_type", "other")
-            dbg(f"Detected task_type: {task_type}")
-        except json.JSONDecodeError as e:
-            dbg(f"Could not parse Stage 1 JSON: {e}")
-            task_type = "other"
-
-        # Stage 2: Redundancy Removal & Clarification
-        update_status(f"Stage 2/{total_stages}: Removing ambiguity and redundancy...")
-        stage2_prompt = STAGE2_PROMPT.format(input=user_input, analysis=stage1_raw)
-        dbg("Stage 2: Clarification")
-        stage2_raw = call_stage(AGENT_MODE_SYSTEM, stage2_prompt, "Clarification")
-
-        # Stage 3: Structure Optimization (uses task_type for scaffolding)
-        update_status(f"Stage 3/{total_stages}: Optimizing structure...")
-        stage3_prompt = STAGE3_PROMPT.format(clarified=stage2_raw, task_type=task_type)
-        dbg("Stage 3: Structure")
-        stage3_raw = call_stage(AGENT_MODE_SYSTEM, stage3_prompt, "Structure")
-
-        # Stage 4: Final Assembly with GPT-5.1 enhancements
-        update_status(f"Stage 4/{total_stages}: Final assembly and polish...")
-        stage4_prompt = STAGE4_PROMPT.format(skeleton=stage3_raw, intent=stage1_raw)
-        dbg("Stage 4: Final Assembly")
-        stage4_raw = call_stage(AGENT_MODE_SYSTEM, stage4_prompt, "Final Assembly")
-
-        final_prompt = stage4_raw
-
-        # Stage 5: Self-Eval (optional)
-        if enable_eval:
-            update_status(f"Stage 5/{total_stages}: Self-evaluation and refinement...")
-            stage5_prompt = STAGE5_PROMPT.format(prompt=stage4_raw, intent=stage1_raw)
-            dbg("Stage 5: Self-Eval")
-            stage5_raw = call_stage(AGENT_MODE_SYSTEM, stage5_prompt, "Self-Eval")
-
-            # Parse eval result
-            eval_passed = True
-            try:
-                eval_json_str = stage5_raw
-                if "```json" in eval_json_str:
-                    eval_json_str = eval_json_str.split("```json")[1].split("```")[0]
-                elif "```" in eval_json_str:
-                    eval_json_str = eval_json_str.split("```")[1].split("```")[0]
-                eval_result = json.loads(eval_json_str.strip())
-                eval_passed = eval_result.get("pass", True)
-                overall_score = eval_result.get("overall_score", 5.0)
-                dbg(f"Eval score: {overall_score}, pass: {eval_passed}")
-
-                # If eval failed, apply fixes
-                if not eval_passed and eval_result.get("suggested_fixes"):
-                    update_status("Stage 5b: Applying evaluation fixes...")
-                    rewrite_prompt = STAGE5_REWRITE_PROMPT.format(
-                        prompt=stage4_raw,
-                        feedback=json.dumps(eval_result, indent=2)
-                    )
-                    dbg("Stage 5b: Rewrite")
-                    final_prompt = call_stage(AGENT_MODE_SYSTEM, rewrite_prompt, "Rewrite")
-            except json.JSONDecodeError as e:
-                dbg(f"Could not parse Stage 5 JSON: {e}")
-                # Keep stage4 output as final
+            ctx = runner.run(seed_context(user_input, context))
+        finally:
+            if history is not None:
+                history.save()
+        for line in runner.report().splitlines():
+            dbg(line)
+        for key, (m, ms) in saved_ms.items():
+            dbg(f"stage route: {key} on {m} saved {ms / 1000.0:.2f}s vs {model}")
+        if saved_ms and trace is not None:
+            trace.set(routing_saved_ms=round(sum(ms for _, ms in saved_ms.values()), 1))
+        if runner.repaired and trace is not None:
+            trace.set(json_repaired=runner.repaired)
+        if runner.tokens and trace is not None:
+            trace.set(input_tokens_est=sum(c for c, _ in runner.tokens.values()), input_tokens_raw_est=sum(r for _, r in runner.tokens.values()))
+        for outcome, keys in (("skipped", runner.skipped), ("resumed", runner.resumed), ("local", runner.local)):
+            for key in keys:
+                span = child_span(trace, "stage", key)
+                if span is not None:
+                    span.end(outcome)
+        final_prompt = ctx.get("rewrite") or ctx["final"]
+        if "eval" in runner.timings and result is not None:
+            result["eval"] = "local" if "eval" in runner.local else "model"
+        if "tournament" in runner.timings:
+            winner = next(i for i in range(1, candidates + 1) if ctx.get(f"final#{i}") == ctx["final"])
+            if result is not None:
+                result["candidate"] = winner
+            if trace is not None:
+                trace.set(candidates=candidates, candidate_winner=winner)
+        if adaptive:
+            path = agent_path(ctx)
+            called = len(runner.timings)
+            sink.write(f"[STATUS] Agent path: {path} ({called} stage call{'s' if called != 1 else ''}"
+                       f"{'; skipped ' + ', '.join(runner.skipped) if runner.skipped else ''})\n")
+            if trace is not None:
+                trace.set(agent_path=path)
 
         # Write final result with separator
-        with open(output_file, 'a', encoding='utf-8', newline='') as f:
-            f.write(f"---FINAL---\n{final_prompt}")
+        sink.write(f"---FINAL---\n{final_prompt}")
+        sink.close()
+        dbg(sink.report())
+        trace_sink(trace, sink)
+        if checkpoint:
+            # Completed: nothing left to resume
+            checkpoint.discard()
 
         dbg("Agent Mode pipeline complete")
         return 0
 
     except Exception as e:
         dbg(f"Agent Mode error: {e}")
+        if checkpoint and checkpoint.saved:
+            dbg(f"Agent checkpoints: {len(checkpoint.saved)} stage(s) saved; rerun with --resume to skip them")
         try:
-            with open(output_file, 'a', encoding='utf-8', newline='') as f:
-                f.write(f"\n[ERROR] Agent Mode failed: {e}\n")
+            sink.write(f"\n[ERROR] Agent Mode failed: {e}\n")
+            sink.close()
+            trace_sink(trace, sink)
         except Exception:
             pass
         return 1
 
 
-def try_stream(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, timeout_sec: int) -> Generator[str, None, None]:
-    lb = base_url.rstrip("/")
-    is_openrouter = ("openrouter.ai" in lb) or api_key.startswith("sk-or-")
-    if is_openrouter:
-        lb = "https://openrouter.ai/api/v1"
-        dbg(f"using OpenRouter endpoint (stream): {lb}")
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_input},
-            ],
-            "temperature": 0.2,
-            "stream": True,
-        }
-        # Support provider routing via environment variable
-        # PROMPTOPT_PROVIDER_ONLY can be a comma-separated list like "cerebras" or "cerebras,deepinfra"
-        provider_only = os.environ.get("PROMPTOPT_PROVIDER_ONLY")
-        if provider_only:
-            providers = [p.strip() for p in provider_only.split(",") if p.strip()]
-            if providers:
-                payload["provider"] = {"only": providers}
-                dbg(f"provider routing: only={providers}")
-        title = os.environ.get("PROMPTOPT_TITLE", "PromptOpt")
-        referer = os.environ.get("PROMPTOPT_REFERER") or os.environ.get("OPENROUTER_SITE_URL") or "https://localhost/"
-        extra = {"X-Title": title, "HTTP-Referer": referer}
-        yield from stream_chat_completions(f"{lb}/chat/completions", payload, api_key, extra_headers=extra, timeout_sec=timeout_sec)
+def log_stream_event(ev: ChatEvent) -> None:
+    if ev.kind == "finish":
+        dbg(f"stream finish_reason: {ev.text}")
+    elif ev.kind == "usage":
+        u = ev.value
+        dbg(f"stream usage: prompt={u.get('prompt_tokens')} completion={u.get('completion_tokens')} total={u.get('total_tokens')}")
+
+
+def traced_stream_events(span: Optional[Span], finish: Optional[dict] = None) -> Callable[[ChatEvent], None]:
+    """on_event handler that logs stream metadata, stores the finish_reason in `finish` and, when tracing, records both on the span."""
+    if span is None and finish is None:
+        return log_stream_event
+
+    def on_event(ev: ChatEvent) -> None:
+        log_stream_event(ev)
+        if ev.kind == "finish":
+            if finish is not None:
+                finish["reason"] = ev.text
+            if span is not None:
+                span.set(finish_reason=ev.text)
+                if ev.value:
+                    span.set(provider=ev.value)
+        elif ev.kind == "usage" and span is not None:
+            trace_usage(span, ev.value)
+    return on_event
+
+
+async def astream(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, timeout_sec: int = 60, cache: Optional[ResponseCache] = None, deadline_sec: Optional[float] = None, span: Optional[Span] = None, provider_only: Optional[List[str]] = None, params: Optional[dict] = None, finish: Optional[dict] = None) -> AsyncIterator[str]:
+    """Streaming Chat Completions call yielding content deltas; see acall for cancellation, deadlines, spans and `finish`."""
+    url, payload, extra = build_chat_request(base_url, model, sys_prompt, user_input, api_key, stream=True, provider_only=provider_only, params=params)
+    key = cache_key(url, payload) if cache else None
+    with span or nullcontext():
+        if cache:
+            chunks = cache.get(key)
+            if chunks is not None:
+                # Replay at the recorded chunk granularity so the live preview behaves as before
+                dbg(f"cache hit (stream replay, {len(chunks)} chunks): {key[:12]}")
+                if span is not None:
+                    span.set(cache="hit", deltas=len(chunks), bytes=sum(len(c.encode("utf-8")) for c in chunks))
+                for chunk in chunks:
+                    yield chunk
+                return
+        if span is not None:
+            span.set(provider=urlsplit(url).hostname, deltas=0, bytes=0)
+        pieces = []
+        finish = {} if finish is None else finish
+        async for piece in astream_chat_completions(url, payload, api_key, extra_headers=extra, timeout_sec=timeout_sec, deadline_sec=deadline_sec, on_event=traced_stream_events(span, finish), span=span):
+            pieces.append(piece)
+            if span is not None:
+                span.mark("first_delta")
+                span.attrs["deltas"] += 1
+                span.attrs["bytes"] += len(piece.encode("utf-8"))
+            yield piece
+        # Only completed streams get here; cancelled or closed streams never reach the store
+        if cache and finish.get("reason") != "length":
+            cache.put(key, pieces, model)
+
+
+def try_stream(base_url: str, model: str, sys_prompt: str, user_input: str, api_key: str, timeout_sec: int, cache: Optional[ResponseCache] = None, cancel: Optional[CancelToken] = None, span: Optional[Span] = None, provider_only: Optional[List[str]] = None, params: Optional[dict] = None, finish: Optional[dict] = None, deadline_sec: Optional[float] = None) -> Generator[str, None, None]:
+    yield from iter_sync(astream(base_url, model, sys_prompt, user_input, api_key, timeout_sec, cache=cache, deadline_sec=deadline_sec, span=span, provider_only=provider_only, params=params, finish=finish), cancel=cancel)
+
+
+def hedge_settings(args: argparse.Namespace) -> tuple:
+    """Resolve (hedge_delay, hedge_count) from CLI flags, falling back to env."""
+    delay = args.hedge_delay
+    if delay is None and os.environ.get("PROMPTOPT_HEDGE_DELAY", "").strip():
+        try:
+            delay = float(os.environ["PROMPTOPT_HEDGE_DELAY"])
+        except ValueError:
+            delay = None
+    count = args.hedge
+    if count is None:
+        try:
+            count = int(os.environ.get("PROMPTOPT_HEDGE_COUNT", "1"))
+        except ValueError:
+            count = 1
+    return delay, max(1, count)
+
+
+def deadline_setting(args: argparse.Namespace) -> Optional[float]:
+    """Per-call deadline in seconds from --deadline, falling back to PROMPTOPT_DEADLINE (None = only PROMPTOPT_TIMEOUT per wait)."""
+    deadline = args.deadline
+    if deadline is None and os.environ.get("PROMPTOPT_DEADLINE", "").strip():
+        try:
+            deadline = float(os.environ["PROMPTOPT_DEADLINE"])
+        except ValueError:
+            deadline = None
+    return deadline if deadline is not None and deadline > 0 else None
+
+
+def run_hedged(args: argparse.Namespace, models_to_try: list, base_url: str, sys_prompt: str, user_input: str, api_key: str, timeout_sec: int, cache: Optional[ResponseCache], hedge_delay: Optional[float], hedge_count: int, result: Optional[dict] = None, trace: Optional[Span] = None, deadline_sec: Optional[float] = None) -> int:
+    """Race models_to_try (see hedging.HedgedRace); only the winning model writes the output file."""
+    def contender(attempt: int, m: str):
+        # Spans are created at launch so their timings start when the contender does
+        if args.stream:
+            return lambda tok: try_stream(base_url, m, sys_prompt, user_input, api_key, timeout_sec, cache=cache, cancel=tok, span=http_span(trace, m, attempt, stream=True), deadline_sec=deadline_sec)
+        return lambda tok: [extract_output_text(try_call(base_url, m, sys_prompt, user_input, api_key, timeout_sec, cache=cache, cancel=tok, span=http_span(trace, m, attempt), deadline_sec=deadline_sec))]
+
+    dbg(f"hedged fallback: delay={hedge_delay} launch_now={hedge_count} models={models_to_try}")
+    race = HedgedRace([(m, contender(i, m)) for i, m in enumerate(models_to_try)], hedge_delay=hedge_delay, launch_now=hedge_count, dbg=dbg)
+    if args.stream:
+        # The race has already picked its answer, so a preamble is stripped, never retried
+        guard = open_guard(can_retry=False)
+        with StreamSink(args.output_file, truncate=True) as sink:
+            write_guarded(race, sink, guard)
+        dbg(sink.report())
+        trace_sink(trace, sink)
+        trace_guard(trace, guard)
     else:
-        dbg(f"using OpenAI Chat Completions endpoint (stream): {lb}/chat/completions")
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_input},
-            ],
-            "temperature": 0.2,
-            "stream": True,
-        }
-        yield from stream_chat_completions(f"{lb}/chat/completions", payload, api_key, timeout_sec=timeout_sec)
-
-
-def main() -> int:
+        text = strip_preamble("".join(race))
+        with child_span(trace, "write", "output") or nullcontext():
+            write_text(args.output_file, text)
+    dbg(f"hedged run complete: model={race.winner.label}")
+    if result is not None:
+        result["model"] = race.winner.label
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(description="PromptOpt backend: call Responses API and emit text")
-    p.add_argument("--system-prompt-file", required=True)
-    p.add_argument("--user-input-file", required=True)
-    p.add_argument("--output-file", required=True)
+    p.add_argument("--system-prompt-file")
+    p.add_argument("--user-input-file")
+    p.add_argument("--output-file")
     p.add_argument("--api-key", required=False)
     p.add_argument("--model", default="openai/gpt-oss-120b")
     p.add_argument("--base-url", default="https://openrouter.ai/api/v1")
@@ -455,22 +689,111 @@ def main() -> int:
     p.add_argument("--agent-mode", action="store_true", help="Enable Agent Mode: 4-stage iterative prompt optimization")
     p.add_argument("--agent-mode-streaming", action="store_true", help="Enable Agent Mode with streaming: live output per stage")
     p.add_argument("--agent-mode-eval", action="store_true", help="Enable Agent Mode Stage 5: self-evaluation and refinement")
-    args = p.parse_args()
+    p.add_argument("--agent-graph", choices=("sequential", "parallel"), help="Agent Mode stage graph (default: PROMPTOPT_AGENT_GRAPH or sequential)")
+    p.add_argument("--agent-candidates", type=int, default=None, metavar="N", help="Agent Mode: generate N Final Assembly candidates concurrently and keep the best-scoring one (also PROMPTOPT_AGENT_CANDIDATES)")
+    p.add_argument("--agent-adaptive", action="store_true", help="Agent Mode: skip Clarification and fuse Structure + Final Assembly when Stage 1 finds a short input unambiguous (also PROMPTOPT_AGENT_ADAPTIVE=1)")
+    p.add_argument("--stage-model", action="append", default=[], metavar="STAGE=MODEL[,MODEL...][@PROVIDER,...]", help="Agent Mode: route a stage (analysis|clarified|skeleton|final|fused|eval|rewrite, 1-5, 5b or *) to its own model chain, optionally pinned to OpenRouter providers (repeatable; also PROMPTOPT_STAGE_MODELS)")
+    p.add_argument("--stage-routes", default=None, metavar="FILE", help="Agent Mode: JSON file of per-stage routes (also PROMPTOPT_STAGE_ROUTES)")
+    p.add_argument("--resume", action="store_true", help="Agent Mode: replay stages completed by an earlier failed run of the same input (also PROMPTOPT_AGENT_RESUME=1)")
+    p.add_argument("--cache", action="store_true", help="Serve repeated requests from the on-disk response cache (also PROMPTOPT_CACHE=1)")
+    p.add_argument("--no-cache", action="store_true", help="Bypass the response cache even if PROMPTOPT_CACHE=1")
+    p.add_argument("--hedge-delay", type=float, default=None, help="Hedged fallback: launch the next model if no content arrives within this many seconds (also PROMPTOPT_HEDGE_DELAY)")
+    p.add_argument("--hedge", type=int, default=None, metavar="N", help="Hedged fallback: race the top N models immediately (also PROMPTOPT_HEDGE_COUNT)")
+    p.add_argument("--deadline", type=float, default=None, metavar="SECONDS", help="Give up on a model call that has not finished within this many seconds in total (also PROMPTOPT_DEADLINE)")
+    p.add_argument("--trace", metavar="FILE", help="Append JSONL latency spans for this run to FILE (also PROMPTOPT_TRACE)")
+    p.add_argument("--context-dir", help="Context Scout: repository to search for a context bundle")
+    p.add_argument("--context-query", help="Context Scout: query used to build the context bundle")
+    p.add_argument("--context-file", help="Context Scout bundle built by the caller (used instead of --context-dir)")
+    p.add_argument("--serve", action="store_true", help="Run as a resident daemon that accepts jobs on a loopback port")
+    p.add_argument("--port", type=int, default=None, help="Daemon port for --serve (default: PROMPTOPT_SERVE_PORT or 8765)")
+    p.add_argument("--submit", action="store_true", help="Run this job on a running daemon and wait for it; runs in-process if none is reachable (promptopt_client.py does the same without loading the backend)")
+    return p
+
+
+def resolve_api_key(explicit: Optional[str]) -> str:
+    api_key = explicit or os.environ.get("PROMPTOPT_API_KEY") or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("API key not provided. Set PROMPTOPT_API_KEY or OPENAI_API_KEY.")
+    # Strip whitespace that might have been introduced from .env file
+    api_key = api_key.strip()
+    if not api_key:
+        raise ValueError("API key is empty after stripping whitespace. Check your .env file.")
+    return api_key
+
+
+def load_context_grepper():
+    """Import tools/context_grepper.py so Context Scout runs without a second interpreter."""
+    tools_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools")
+    if tools_dir not in sys.path:
+        sys.path.append(tools_dir)
+    import context_grepper
+    return context_grepper
+
+
+def build_context_bundle(context_dir: str, context_query: str) -> str:
+    """Run Context Scout in-process and return the rendered bundle (same shape the bridge appends)."""
+    from pathlib import Path
+    context_grepper = load_context_grepper()
+
+    repo_root = Path(context_dir).expanduser().resolve()
+    if not repo_root.is_dir():
+        dbg(f"context dir not found: {repo_root}")
+        return ""
+    query = context_query.strip()
+    files = []
+    try:
+        files = context_grepper.run_warpgrep(query, repo_root)
+    except Exception as e:
+        dbg(f"WarpGrep unavailable; falling back. ({e})")
+    if not files:
+        files = context_grepper.local_fallback_collect(repo_root, query, 12)
+    return context_grepper.render_context(files, repo_root, 40000)
+
+
+def run(args: argparse.Namespace, sys_prompt: Optional[str] = None, user_input: Optional[str] = None, result: Optional[dict] = None) -> int:
+    """
+    Execute one PromptOpt job. Inline prompt/input text (from the daemon or batch) takes precedence over the files.
 
+    If `result` is given, the model that answered and any error message are recorded in it.
+    With `--trace`/PROMPTOPT_TRACE the run and every call in it are written as spans (see tracing.py).
+    """
+    cache = None
+    trace = None
+    if result is None:
+        result = {}
+
+    def fail(msg: str, code: int = 1) -> int:
+        result["error"] = msg
+        print(msg, file=sys.stderr)
+        return code
     try:
         dbg("start main")
-        sys_prompt = read_text(args.system_prompt_file).strip()
-        user_input = read_text(args.user_input_file).strip()
+        tracer = open_tracer(args.trace)
+        if tracer:
+            mode = "agent" if (args.agent_mode or args.agent_mode_streaming) else ("stream" if args.stream else "call")
+            trace = tracer.start_run(mode=mode, model_req=args.model)
+            dbg(f"trace: run_id={tracer.run_id} -> {tracer.path}")
+        if sys_prompt is None:
+            sys_prompt = read_text(args.system_prompt_file)
+        if user_input is None:
+            user_input = read_text(args.user_input_file)
+        sys_prompt = sys_prompt.strip()
+        user_input = user_input.strip()
         if not user_input:
             raise ValueError("Empty user input")
 
-        api_key = args.api_key or os.environ.get("PROMPTOPT_API_KEY") or os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("API key not provided. Set PROMPTOPT_API_KEY or OPENAI_API_KEY.")
-        # Strip whitespace that might have been introduced from .env file
-        api_key = api_key.strip()
-        if not api_key:
-            raise ValueError("API key is empty after stripping whitespace. Check your .env file.")
+        # The bundle is kept apart from the request; standard mode sends them joined
+        bundle = ""
+        if args.context_file:
+            bundle = read_text(args.context_file)
+        elif args.context_dir and args.context_query:
+            with child_span(trace, "context", "context_scout") or nullcontext():
+                bundle = build_context_bundle(args.context_dir, args.context_query)
+        if bundle.strip():
+            dbg(f"context bundle length={len(bundle)}")
+        request, user_input = user_input, join_context(user_input, bundle)
+
+        api_key = resolve_api_key(args.api_key)
         # Log key prefix for debugging (without exposing full key)
         if api_key and len(api_key) > 4:
             dbg(f"api_key prefix: {api_key[:7]}... (length: {len(api_key)})")
@@ -487,6 +810,13 @@ def main() -> int:
             timeout_sec = int(os.environ.get("PROMPTOPT_TIMEOUT", "60"))
         except Exception:
             timeout_sec = 60
+        deadline_sec = deadline_setting(args)
+        if deadline_sec is not None:
+            dbg(f"deadline={deadline_sec}s per call")
+
+        cache = open_cache(False if args.no_cache else (True if args.cache else None))
+        if cache:
+            dbg(f"response cache: {cache.cache_dir}")
 
         # Agent Mode: 4/5-stage iterative optimization
         if args.agent_mode or args.agent_mode_streaming:
@@ -494,47 +824,63 @@ def main() -> int:
             enable_eval = args.agent_mode_eval
             dbg(f"Agent Mode enabled (streaming={streaming}, eval={enable_eval})")
             if not AGENT_MODE_AVAILABLE:
-                print("Error: Agent mode prompts not available. Ensure agent_mode_prompts.py exists.", file=sys.stderr)
-                return 1
-            return run_agent_mode(user_input, args.model, base_url, api_key, args.output_file, timeout_sec, streaming=streaming, enable_eval=enable_eval)
+                return fail("Error: Agent mode prompts not available. Ensure agent_mode_prompts.py exists.")
+            try:
+                router = router_from_config(args.model, args.stage_model, args.stage_routes)
+            except (OSError, ValueError) as e:
+                return fail(f"Error: invalid stage routing: {e}", 2)
+            for line in router.describe():
+                dbg(line)
+            code = run_agent_mode(request, args.model, base_url, api_key, args.output_file, timeout_sec, streaming=streaming, enable_eval=enable_eval, cache=cache, graph=args.agent_graph, trace=trace, resume=args.resume, adaptive=args.agent_adaptive, result=result, router=router, candidates=args.agent_candidates, deadline_sec=deadline_sec, context=bundle)
+            if code == 0:
+                result["model"] = args.model
+            return code
 
         # Standard mode: Try requested model, then fallbacks
-        is_openrouter = ("openrouter.ai" in base_url.lower()) or (api_key.startswith("sk-or-"))
-        if is_openrouter:
+        if is_openrouter(base_url, api_key):
             models_to_try = [args.model, "moonshotai/kimi-k2-0905", "z-ai/glm-4.5v", "deepseek/deepseek-chat-v3.1:free", "qwen/qwen3-next-80b-a3b-thinking", "openai/gpt-5-mini"]
         else:
             models_to_try = [args.model, "gpt-4o-mini", "gpt-4o"]
+        hedge_delay, hedge_count = hedge_settings(args)
+        if hedge_delay is not None or hedge_count > 1:
+            return run_hedged(args, models_to_try, base_url, sys_prompt, user_input, api_key, timeout_sec, cache, hedge_delay, hedge_count, result=result, trace=trace, deadline_sec=deadline_sec)
+
         last_err = None
-        for m in models_to_try:
+        for attempt, m in enumerate(models_to_try):
             try:
                 dbg(f"trying model: {m}")
                 if args.stream:
-                    # Truncate output file and stream content
-                    try:
-                        with open(args.output_file, 'w', encoding='utf-8', newline='') as outf:
-                            pass
-                    except Exception:
-                        pass
-                    wrote_any = False
-                    for piece in try_stream(base_url, m, sys_prompt, user_input, api_key, timeout_sec):
-                        # Open/close for every chunk to avoid file locking issues on Windows
-                        # so the frontend can read it in real-time
-                        with open(args.output_file, 'a', encoding='utf-8', newline='') as outf:
-                            outf.write(piece)
-                        wrote_any = True
-                    
+                    # Truncate output file and stream content. The sink coalesces deltas but still
+                    # opens/closes per flush to avoid file locking issues on Windows, so the
+                    # frontend can read it in real-time. The preamble guard holds back the first
+                    # tokens until it knows they are not a preamble
+                    guard = open_guard()
+                    with StreamSink(args.output_file, truncate=True) as sink:
+                        wrote_any = write_guarded(try_stream(base_url, m, sys_prompt, user_input, api_key, timeout_sec, cache=cache, span=http_span(trace, m, attempt, stream=True), deadline_sec=deadline_sec), sink, guard)
+                        if guard is not None and guard.abort:
+                            dbg(f"preamble guard: {m} opened with a preamble; stream cancelled, retrying with a corrected instruction")
+                            trace_guard(trace, guard)
+                            guard = PreambleGuard(can_retry=False)
+                            wrote_any = write_guarded(try_stream(base_url, m, sys_prompt + PREAMBLE_CORRECTION, user_input, api_key, timeout_sec, cache=cache, span=http_span(trace, m, attempt, stream=True), deadline_sec=deadline_sec), sink, guard)
+                    dbg(sink.report())
+                    trace_sink(trace, sink)
+                    trace_guard(trace, guard)
+
                     if wrote_any:
                         dbg("stream complete with content")
+                        result["model"] = m
                         return 0
                     else:
                         dbg("stream produced no content; attempting non-stream")
                         # fall through to non-stream
                 # Non-streaming path
-                resp = try_call(base_url, m, sys_prompt, user_input, api_key, timeout_sec)
-                out_text = extract_output_text(resp)
+                resp = try_call(base_url, m, sys_prompt, user_input, api_key, timeout_sec, cache=cache, span=http_span(trace, m, attempt), deadline_sec=deadline_sec)
+                out_text = strip_preamble(extract_output_text(resp))
                 if out_text:
                     dbg("received output text")
-                    write_text(args.output_file, out_text)
+                    with child_span(trace, "write", "output") or nullcontext():
+                        write_text(args.output_file, out_text)
+                    result["model"] = m
                     return 0
             except urllib.error.HTTPError as e:
                 try:
@@ -547,8 +893,7 @@ def main() -> int:
                 # Retry with next model on common client-side issues and rate limits
                 if ("model" in details.lower()) or (e.code in (400, 404, 429)):
                     continue
-                print(msg, file=sys.stderr)
-                return 2
+                return fail(msg, 2)
             except urllib.error.URLError as e:
                 last_err = f"URL error: {e.reason}"
                 dbg(last_err)
@@ -559,18 +904,62 @@ def main() -> int:
                 break
 
         if last_err:
-            print(f"Error: {last_err}", file=sys.stderr)
-            return 1
+            return fail(f"Error: {last_err}")
         # Unexpected path
-        print("Error: Unknown failure without details", file=sys.stderr)
-        return 1
+        return fail("Error: Unknown failure without details")
     except Exception as e:
-        print(f"Error: {e}", file=sys.stderr)
+        fail(f"Error: {e}")
         try:
             traceback.print_exc()
         except Exception:
             pass
         return 1
+    finally:
+        dbg(f"http pool: {pool_stats()}")
+        if trace is not None:
+            # Every successful path records the answering model
+            trace.set(model=result.get("model"))
+            trace.end("ok" if result.get("model") else "error", result.get("error"))
+        if cache:
+            dbg(f"response cache: {cache.stats()} totals={cache.flush_stats()}")
+
+
+
+
+def main(argv: Optional[list] = None) -> int:
+    raw_argv = list(sys.argv[1:] if argv is None else argv)
+    if raw_argv[:1] == ["batch"]:
+        from promptopt_batch import batch_main
+        return batch_main(raw_argv[1:], run, build_parser)
+
+    p = build_parser()
+    args = p.parse_args(argv)
+
+    if args.serve:
+        from promptopt_daemon import serve
+        try:
+            load_context_grepper()
+        except Exception as e:
+            dbg(f"Context Scout preload failed: {e}")
+        warm_url = os.environ.get("OPENAI_BASE_URL") or args.base_url
+        threading.Thread(target=prewarm, args=(warm_url,), daemon=True).start()
+        return serve(run, build_parser, port=args.port)
+
+    missing = [f"--{n.replace('_', '-')}" for n in ("system_prompt_file", "user_input_file", "output_file") if not getattr(args, n)]
+    if missing:
+        p.error(f"the following arguments are required: {', '.join(missing)}")
+
+    if args.submit:
+        from promptopt_client import submit
+        try:
+            code = submit(raw_argv, read_text(args.system_prompt_file), read_text(args.user_input_file), resolve_api_key(args.api_key))
+            if code is not None:
+                return code
+        except Exception as e:
+            dbg(f"daemon submit failed: {e}")
+        dbg("no daemon reachable; running in-process")
+
+    return run(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Batch mode for PromptOpt: `promptopt.py batch INPUT --out results.jsonl`.
+
+Re-optimises a whole prompt library in one process. INPUT is a JSONL file
+(one item per line) or a directory (every .txt/.md file is one item's
+input). Items run through the same `promptopt.run()` as a hotkey job, on a
+bounded worker pool that shares the process-wide connection pool, and each
+result is appended to the output JSONL as soon as it finishes.
+
+JSONL item fields (all optional except `input`):
+    id             stable identifier (default: line-N)
+    input          text to optimise
+    system_prompt  inline system prompt
+    meta_prompt    path to a meta-prompt file
+    profile, mode  resolve meta-prompts/Meta_Prompt[_Edits].<profile>.md like promptopt.ps1
+    model          model override
+    agent_mode     run the Agent Mode pipeline for this item
+    agent_mode_eval  also run Stage 5 self-eval
+
+Resuming: ids already recorded with status "ok" in the output file are
+skipped, so a crashed or interrupted batch continues where it stopped.
+Failed items are retried on the next run.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+META_PROMPT_DIR = Path(__file__).resolve().parents[1] / "meta-prompts"
+DIR_SUFFIXES = (".txt", ".md")
+FALLBACK_PROMPTS = {
+    "optimize": "Given a task or existing prompt, output a clear, effective system prompt to guide the model. Output only the final prompt text.",
+    "edit": "Given a current prompt and change description, output a corrected, improved system prompt optimized for accurate results. Start with a <reasoning> section, then output the final prompt only.",
+}
+
+
+def _dbg(msg: str) -> None:
+    try:
+        print(f"DBG: {msg}", file=sys.stderr)
+    except Exception:
+        pass
+
+
+def build_batch_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog="promptopt.py batch", description="Optimize many prompts from a JSONL file or directory")
+    p.add_argument("input", help="JSONL file (one item per line) or directory of .txt/.md inputs")
+    p.add_argument("--out", required=True, help="Results JSONL; existing ok results are skipped (resume)")
+    p.add_argument("--concurrency", type=int, default=None, help="Items in flight (default: PROMPTOPT_BATCH_CONCURRENCY or 4)")
+    p.add_argument("--system-prompt-file", help="Default system prompt for items without their own")
+    p.add_argument("--profile", default="", help="Default meta-prompt profile (e.g. coding, writing)")
+    p.add_argument("--mode", choices=("optimize", "edit"), default="optimize", help="Default meta-prompt family")
+    p.add_argument("--model", default=None, help="Default model for items without their own")
+    p.add_argument("--agent-mode", action="store_true", help="Run every item through Agent Mode")
+    p.add_argument("--agent-mode-eval", action="store_true", help="Enable Agent Mode Stage 5 for every Agent Mode item")
+    p.add_argument("--limit", type=int, default=None, help="Stop after this many items (for trial runs)")
+    return p
+
+
+def iter_items(source: str) -> Iterator[dict]:
+    """Yield raw items from a JSONL file or a directory of text files."""
+    path = Path(source)
+    if path.is_dir():
+        for f in sorted(p for p in path.rglob("*") if p.is_file() and p.suffix.lower() in DIR_SUFFIXES):
+            yield {"id": f.relative_to(path).as_posix(), "input": f.read_text(encoding="utf-8")}
+        return
+    with open(path, 'r', encoding='utf-8') as fh:
+        for n, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                yield {"id": f"line-{n}", "_invalid": f"invalid JSON: {e}"}
+                continue
+            if isinstance(item, str):
+                item = {"input": item}
+            if not isinstance(item, dict):
+                yield {"id": f"line-{n}", "_invalid": "item must be an object or string"}
+                continue
+            item.setdefault("id", f"line-{n}")
+            item["id"] = str(item["id"])
+            yield item
+
+
+def load_done(out_path: str) -> set:
+    """Ids already completed successfully in a previous run."""
+    done = set()
+    try:
+        with open(out_path, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # partial line from a crash mid-write
+                if isinstance(rec, dict) and rec.get("status") == "ok":
+                    done.add(str(rec.get("id")))
+    except OSError:
+        pass
+    return done
+
+
+class MetaPrompts:
+    """Resolves and caches system prompts the same way promptopt.ps1 does."""
+
+    def __init__(self, meta_dir: Path = META_PROMPT_DIR):
+        self.meta_dir = meta_dir
+        self._cache: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _read(self, path: str) -> str:
+        with self._lock:
+            if path not in self._cache:
+                try:
+                    self._cache[path] = Path(path).read_text(encoding="utf-8")
+                except OSError:
+                    self._cache[path] = ""
+            return self._cache[path]
+
+    def resolve(self, item: dict, default_file: Optional[str], profile: str, mode: str) -> str:
+        if item.get("system_prompt"):
+            return str(item["system_prompt"])
+        # An item's own meta_prompt/profile/mode beats the batch-wide --system-prompt-file
+        explicit = item.get("meta_prompt")
+        if not explicit and not (item.get("profile") or item.get("mode")):
+            explicit = default_file
+        if explicit:
+            text = self._read(str(explicit))
+            if text.strip():
+                return text
+        mode = item.get("mode") or mode
+        base = "Meta_Prompt_Edits" if mode == "edit" else "Meta_Prompt"
+        prof = str(item.get("profile") or profile or "").strip().lower()
+        candidates = ([self.meta_dir / f"{base}.{prof}.md"] if prof else []) + [self.meta_dir / f"{base}.md"]
+        for cand in candidates:
+            if cand.is_file():
+                text = self._read(str(cand))
+                if text.strip():
+                    return text
+        return FALLBACK_PROMPTS["edit" if mode == "edit" else "optimize"]
+
+
+def percentile(sorted_vals: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(pct / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+
+def final_text(output: str, agent_mode: bool) -> str:
+    """The optimized prompt from a job's output file (Agent Mode keeps only the ---FINAL--- part)."""
+    if agent_mode and "---FINAL---" in output:
+        return output.split("---FINAL---", 1)[1].lstrip("\n")
+    return output
+
+
+def batch_main(argv: List[str], run_job: Callable, build_parser: Callable) -> int:
+    """
+    Run a batch.
+
+    Args:
+        argv: Arguments after `batch`; unknown flags (--base-url, --cache,
+              --agent-graph, ...) are passed to every job unchanged
+        run_job: promptopt.run(args, sys_prompt, user_input, result) -> exit code
+        build_parser: promptopt.build_parser, used to build each job's args
+    """
+    bp = build_batch_parser()
+    bargs, passthrough = bp.parse_known_args(argv)
+    concurrency = bargs.concurrency
+    if concurrency is None:
+        try:
+            concurrency = int(os.environ.get("PROMPTOPT_BATCH_CONCURRENCY", "4"))
+        except ValueError:
+            concurrency = 4
+    concurrency = max(1, concurrency)
+    # Keep one idle keep-alive connection per worker instead of discarding the extras
+    os.environ.setdefault("PROMPTOPT_POOL_SIZE", str(concurrency))
+    os.environ.setdefault("PROMPTOPT_MAX_INFLIGHT", str(max(32, concurrency * 2)))
+
+    try:
+        build_parser().parse_args(passthrough + ["--output-file", os.devnull])
+    except SystemExit:
+        return 2
+
+    done = load_done(bargs.out)
+    if done:
+        _dbg(f"batch: resuming, {len(done)} items already done")
+    metas = MetaPrompts()
+    out_lock = threading.Lock()
+    out_parent = os.path.dirname(os.path.abspath(bargs.out))
+    os.makedirs(out_parent, exist_ok=True)
+    out_fh = open(bargs.out, 'a', encoding='utf-8')
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    evals = {"local": 0, "model": 0}
+
+    def emit(rec: dict) -> None:
+        line = json.dumps(rec, ensure_ascii=False)
+        with out_lock:
+            out_fh.write(line + "\n")
+            out_fh.flush()
+            counts[rec["status"]] += 1
+            if rec["status"] == "ok":
+                latencies.append(rec["latency_ms"])
+                if rec.get("eval") in evals:
+                    evals[rec["eval"]] += 1
+            else:
+                msg = rec.get("error", "")
+                if msg.startswith("Error: "):
+                    msg = msg[len("Error: "):]
+                kind = msg.split(":", 1)[0][:40] or "error"
+                errors[kind] = errors.get(kind, 0) + 1
+            n = counts["ok"] + counts["error"]
+            if n % 25 == 0:
+                _dbg(f"batch: {n} done ({counts['error']} errors)")
+
+    def process(item: dict) -> None:
+        item_id = item["id"]
+        if item.get("_invalid"):
+            emit({"id": item_id, "status": "error", "error": item["_invalid"], "latency_ms": 0})
+            return
+        user_input = str(item.get("input") or "")
+        agent = bool(item.get("agent_mode", bargs.agent_mode))
+        job_argv = list(passthrough)
+        model = item.get("model") or bargs.model
+        if model:
+            job_argv += ["--model", str(model)]
+        if agent:
+            job_argv.append("--agent-mode")
+            if item.get("agent_mode_eval", bargs.agent_mode_eval):
+                job_argv.append("--agent-mode-eval")
+        fd, out_file = tempfile.mkstemp(prefix="promptopt_batch_", suffix=".txt")
+        os.close(fd)
+        result: dict = {}
+        t0 = time.monotonic()
+        try:
+            args = build_parser().parse_args(job_argv + ["--output-file", out_file])
+            sys_prompt = metas.resolve(item, bargs.system_prompt_file, bargs.profile, bargs.mode)
+            code = run_job(args, sys_prompt=sys_prompt, user_input=user_input, result=result)
+            output = Path(out_file).read_text(encoding="utf-8") if os.path.exists(out_file) else ""
+        except Exception as e:
+            code, output = 1, ""
+            result.setdefault("error", f"Error: {e}")
+        finally:
+            try:
+                os.remove(out_file)
+            except OSError:
+                pass
+        latency_ms = round((time.monotonic() - t0) * 1000.0, 1)
+        text = final_text(output, agent)
+        if code == 0 and text.strip():
+            rec = {"id": item_id, "status": "ok", "output": text, "model": result.get("model"), "agent_mode": agent, "latency_ms": latency_ms}
+            if "eval" in result:
+                rec["eval"] = result["eval"]
+            emit(rec)
+            return
+        err = result.get("error")
+        if not err and "[ERROR]" in output:
+            err = output.split("[ERROR]", 1)[1].strip().splitlines()[0]
+        emit({"id": item_id, "status": "error", "error": err or f"exit {code} without output", "agent_mode": agent, "latency_ms": latency_ms})
+
+    t_start = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="promptopt-batch")
+    in_flight = set()
+    submitted = 0
+    try:
+        for item in iter_items(bargs.input):
+            if item["id"] in done:
+                counts["skipped"] += 1
+                continue
+            if bargs.limit is not None and submitted >= bargs.limit:
+                break
+            # Bounded submission keeps memory flat for very large inputs
+            while len(in_flight) >= concurrency * 2:
+                _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight.add(pool.submit(process, item))
+            submitted += 1
+        wait(in_flight)
+    except KeyboardInterrupt:
+        _dbg("batch: interrupted; waiting for running items, rerun to resume")
+        # Queued items are dropped; the finally block waits for running ones before closing the output
+        pool.shutdown(wait=False, cancel_futures=True)
+        return 130
+    finally:
+        pool.shutdown(wait=True)
+        out_fh.close()
+
+    elapsed = max(time.monotonic() - t_start, 1e-9)
+    lat = sorted(latencies)
+    finished = counts["ok"] + counts["error"]
+    print(f"batch: {finished} items in {elapsed:.1f}s ({finished / elapsed:.2f} items/s, concurrency {concurrency}); "
+          f"ok {counts['ok']}, errors {counts['error']}, skipped (already done) {counts['skipped']}")
+    if lat:
+        print(f"batch: latency ms p50 {percentile(lat, 50):.0f}  p90 {percentile(lat, 90):.0f}  "
+              f"p99 {percentile(lat, 99):.0f}  max {lat[-1]:.0f}")
+    if evals["local"] or evals["model"]:
+        n_eval = evals["local"] + evals["model"]
+        print(f"batch: self-eval answered locally {evals['local']}/{n_eval} ({evals['local'] / n_eval * 100:.0f}% of Stage 5 model calls avoided)")
+    if errors:
+        print("batch: errors " + ", ".join(f"{k} x{v}" for k, v in sorted(errors.items(), key=lambda kv: -kv[1])))
+    return 0 if counts["error"] == 0 else 1
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Thin client for the resident PromptOpt daemon (`promptopt.py --serve`).
+
+With PROMPTOPT_DAEMON=1 the bridge runs this script with the argv it would
+give promptopt.py. It only imports what it needs to post one job over a
+loopback socket, so a hotkey press costs interpreter start-up and not the
+backend's imports. The call blocks until the daemon has finished the job and
+exits with the job's exit code (its error goes to stderr), so the bridge's
+clipboard and "done" handling run exactly as for an in-process run. The
+daemon gives up waiting on a job after the client's wait budget and
+replies 504, which fails the run.
+
+If no daemon is reachable, or it refuses the job, the job runs in-process
+through promptopt.main().
+"""
+import json
+import os
+import socket
+import sys
+from typing import List, Optional, Tuple
+
+CONNECT_TIMEOUT = 2.0
+WAIT_TIMEOUT = 1800.0  # a job that outlives this is reported as failed (the daemon replies 504)
+
+
+def _temp_dir() -> str:
+    # Like tempfile.gettempdir(), without importing tempfile; the daemon imports STATE_FILE from here
+    for name in ("TMPDIR", "TEMP", "TMP"):
+        value = os.environ.get(name)
+        if value:
+            return os.path.abspath(value)
+    return os.path.join(os.environ.get("SystemRoot", "C:\\Windows"), "Temp") if os.name == "nt" else "/tmp"
+
+
+STATE_FILE = os.path.join(_temp_dir(), "promptopt_daemon.json")
+
+
+def _dbg(msg: str) -> None:
+    try:
+        print(f"DBG: {msg}", file=sys.stderr)
+    except Exception:
+        pass
+
+
+def read_state() -> Optional[dict]:
+    """Return the running daemon's {port, token, pid}, or None if not advertised."""
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if isinstance(state, dict) and state.get("port") and state.get("token"):
+            return state
+    except Exception:
+        pass
+    return None
+
+
+def _flag(argv: List[str], name: str) -> Optional[str]:
+    """Value of `--name VALUE` or `--name=VALUE` in argv."""
+    for i, arg in enumerate(argv):
+        if arg == name and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith(name + "="):
+            return arg[len(name) + 1:]
+    return None
+
+
+def _post_job(sock: socket.socket, port: int, token: str, body: bytes, wait_sec: float) -> Tuple[int, dict]:
+    """POST /jobs on a connected socket and read the (status, JSON) reply once the job is done."""
+    head = (f"POST /jobs HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nX-PromptOpt-Token: {token}\r\nConnection: close\r\n\r\n")
+    sock.sendall(head.encode("ascii") + body)
+    # The daemon answers within wait_sec (with a 504 if the job is still running)
+    sock.settimeout(wait_sec + CONNECT_TIMEOUT)
+    chunks = []
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            break
+        chunks.append(data)
+    status_line, _, rest = b"".join(chunks).partition(b"\r\n")
+    _, _, payload = rest.partition(b"\r\n\r\n")
+    status = int(status_line.split(b" ", 2)[1])
+    return status, json.loads(payload.decode("utf-8", errors="replace") or "{}")
+
+
+def submit(argv: List[str], sys_prompt: str, user_input: str, api_key: str, wait_sec: float = WAIT_TIMEOUT) -> Optional[int]:
+    """
+    Run a job on the daemon and wait for it.
+
+    Returns the job's exit code, or None if no daemon took the job (the
+    caller then runs it in-process).
+    """
+    state = read_state()
+    if not state:
+        return None
+    body = json.dumps({
+        "argv": [a for a in argv if a != "--submit"],
+        "system_prompt": sys_prompt,
+        "user_input": user_input,
+        "api_key": api_key,
+        "wait_sec": wait_sec,
+    }).encode("utf-8")
+    try:
+        port = int(state["port"])
+        sock = socket.create_connection(("127.0.0.1", port), timeout=CONNECT_TIMEOUT)
+    except (OSError, ValueError) as e:
+        _dbg(f"daemon unreachable: {e}")
+        return None
+    try:
+        with sock:
+            status, reply = _post_job(sock, port, str(state["token"]), body, wait_sec)
+    except (OSError, ValueError, IndexError) as e:
+        # The job may have started, so running it again here could write a second answer
+        print(f"Error: daemon connection failed: {e}", file=sys.stderr)
+        return 1
+    if status == 504:
+        # The job ran and may still write its answer, so it is not run again here
+        print(reply.get("error") or "Error: daemon job timed out", file=sys.stderr)
+        return 1
+    if status != 200:
+        _dbg(f"daemon refused job ({status}): {reply.get('error')}")
+        return None
+    code = int(reply.get("exit_code", 1))
+    _dbg(f"daemon finished job {reply.get('job_id')} exit={code}")
+    if code != 0 and reply.get("error"):
+        print(reply["error"], file=sys.stderr)
+    return code
+
+
+def client_main(argv: Optional[List[str]] = None) -> int:
+    argv = [a for a in (sys.argv[1:] if argv is None else argv) if a != "--submit"]
+    paths = [_flag(argv, n) for n in ("--system-prompt-file", "--user-input-file", "--output-file")]
+    api_key = (_flag(argv, "--api-key") or os.environ.get("PROMPTOPT_API_KEY") or os.environ.get("OPENAI_API_KEY") or "").strip()
+    if all(paths) and api_key:
+        try:
+            with open(paths[0], 'r', encoding='utf-8') as f:
+                sys_prompt = f.read()
+            with open(paths[1], 'r', encoding='utf-8') as f:
+                user_input = f.read()
+            code = submit(argv, sys_prompt, user_input, api_key)
+            if code is not None:
+                return code
+        except OSError as e:
+            _dbg(f"daemon submit failed: {e}")
+    _dbg("no daemon took the job; running in-process")
+    import promptopt
+    return promptopt.main(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(client_main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Resident PromptOpt daemon.
+
+`promptopt.py --serve` keeps one interpreter alive on a loopback HTTP port so
+hotkey invocations skip module imports and (with the pooled transport)
+connection setup. promptopt_client.py is the thin client: it posts the same
+argv `main()` accepts, with the prompt/input file contents inlined, and the
+daemon replies once the job has finished with its exit code and error. A
+job still running after the client's wait budget (`wait_sec` in the request,
+default promptopt_client.WAIT_TIMEOUT) gets a 504 instead, so a stuck
+upstream request does not hold the connection open forever.
+
+The daemon advertises its port and a per-process token in a state file under
+the temp directory; jobs without the token are rejected.
+"""
+import json
+import os
+import secrets
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional, Tuple
+
+from promptopt_client import STATE_FILE, WAIT_TIMEOUT, read_state
+
+DEFAULT_PORT = 8765
+
+
+def _dbg(msg: str) -> None:
+    try:
+        print(f"DBG: {msg}", file=sys.stderr)
+    except Exception:
+        pass
+
+
+def _write_state(port: int, token: str) -> None:
+    tmp = f"{STATE_FILE}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({"port": port, "token": token, "pid": os.getpid()}, f)
+    os.replace(tmp, STATE_FILE)
+
+
+def _clear_state(token: str) -> None:
+    state = read_state()
+    if state and state.get("token") == token:
+        try:
+            os.remove(STATE_FILE)
+        except OSError:
+            pass
+
+
+def serve(run_job: Callable, build_parser: Callable, port: Optional[int] = None, max_workers: Optional[int] = None) -> int:
+    """
+    Run the daemon until interrupted.
+
+    Args:
+        run_job: promptopt.run(args, sys_prompt, user_input, result) -> exit code
+        build_parser: promptopt.build_parser, used to parse each job's argv
+        port: Loopback port (default: PROMPTOPT_SERVE_PORT or 8765)
+        max_workers: Concurrent jobs (default: PROMPTOPT_SERVE_WORKERS or 4)
+    """
+    if port is None:
+        try:
+            port = int(os.environ.get("PROMPTOPT_SERVE_PORT", str(DEFAULT_PORT)))
+        except ValueError:
+            port = DEFAULT_PORT
+    if max_workers is None:
+        try:
+            max_workers = int(os.environ.get("PROMPTOPT_SERVE_WORKERS", "4"))
+        except ValueError:
+            max_workers = 4
+
+    token = secrets.token_hex(16)
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="promptopt-job")
+    counter = {"next": 0, "running": 0, "done": 0}
+    lock = threading.Lock()
+
+    def execute(job_id: int, args, sys_prompt: str, user_input: str, api_key: str) -> Tuple[int, Optional[str]]:
+        """(exit code, error message) of one job; a crash is reported like a failed run."""
+        with lock:
+            counter["running"] += 1
+        result: dict = {}
+        try:
+            args.api_key = api_key or args.api_key
+            code = run_job(args, sys_prompt=sys_prompt, user_input=user_input, result=result)
+            _dbg(f"job {job_id} finished exit={code}")
+            return code, result.get("error")
+        except Exception as e:
+            _dbg(f"job {job_id} crashed: {e}")
+            return 1, f"Error: {e}"
+        finally:
+            with lock:
+                counter["running"] -= 1
+                counter["done"] += 1
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *a):
+            _dbg("daemon: " + (fmt % a))
+
+        def _reply(self, status: int, obj: dict) -> None:
+            data = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self) -> bool:
+            if secrets.compare_digest(self.headers.get("X-PromptOpt-Token", ""), token):
+                return True
+            self._reply(403, {"error": "bad token"})
+            return False
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            if self.path == "/health":
+                with lock:
+                    self._reply(200, {"ok": True, "pid": os.getpid(), "running": counter["running"], "done": counter["done"]})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            if self.path != "/jobs":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", "0"))
+                job = json.loads(self.rfile.read(length).decode("utf-8"))
+                argv = job.get("argv") or []
+                if not isinstance(argv, list) or "--serve" in argv:
+                    raise ValueError("invalid argv")
+                args = build_parser().parse_args([str(a) for a in argv])
+                if not args.output_file:
+                    raise ValueError("--output-file is required")
+                wait_sec = float(job.get("wait_sec") or WAIT_TIMEOUT)
+            except SystemExit:
+                self._reply(400, {"error": "invalid arguments"})
+                return
+            except Exception as e:
+                self._reply(400, {"error": str(e)})
+                return
+            with lock:
+                counter["next"] += 1
+                job_id = counter["next"]
+            # The client waits on this request, so it learns the outcome without polling
+            future = executor.submit(execute, job_id, args, job.get("system_prompt"), job.get("user_input"), job.get("api_key") or "")
+            try:
+                code, error = future.result(timeout=wait_sec)
+            except FutureTimeout:
+                # A job that has started cannot be stopped; it finishes in the background
+                future.cancel()
+                _dbg(f"job {job_id} still running after {wait_sec:g}s; replying 504")
+                self._reply(504, {"job_id": job_id, "error": f"Error: job did not finish within {wait_sec:g}s"})
+                return
+            self._reply(200, {"job_id": job_id, "exit_code": code, "error": error})
+
+    try:
+        httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    except OSError as e:
+        print(f"Error: cannot bind 127.0.0.1:{port}: {e}", file=sys.stderr)
+        return 1
+    httpd.daemon_threads = True
+    bound_port = httpd.server_address[1]
+    _write_state(bound_port, token)
+    _dbg(f"daemon listening on 127.0.0.1:{bound_port} (workers={max_workers}, state={STATE_FILE})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _clear_state(token)
+        httpd.server_close()
+        executor.shutdown(wait=True)
+    return 0
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk response cache for PromptOpt.
+
+Entries are keyed by a SHA-256 of the resolved endpoint plus the request
+payload (model, system prompt, user input, temperature, provider routing;
+the `stream` flag is ignored so streamed and non-streamed calls share
+entries). Each entry records the chunk boundaries of the original stream so a
+hit can be replayed into the output file at the same granularity the AHK
+preview saw the first time.
+
+Writes go to a unique temp file followed by `os.replace`, which is atomic on
+both Windows and POSIX, so concurrent PromptOpt processes never observe a
+partial entry. Recency is tracked with the entry's mtime (touched on every
+hit); when the directory grows past the size budget the least recently used
+entries are evicted.
+
+Environment:
+    PROMPTOPT_CACHE=1          enable the cache (or pass --cache; --no-cache always bypasses)
+    PROMPTOPT_CACHE_DIR        cache directory (default: %TEMP%/promptopt_cache)
+    PROMPTOPT_CACHE_TTL        entry lifetime in seconds (default 86400)
+    PROMPTOPT_CACHE_MAX_MB     size budget in megabytes (default 50)
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+STATS_FILE = "stats.json"
+
+
+def cache_key(url: str, payload: dict) -> str:
+    """Hash of the resolved endpoint and every payload field that affects the output."""
+    material = {k: v for k, v in payload.items() if k != "stream"}
+    blob = json.dumps({"url": url, "payload": material}, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU cache with TTL.
+
+    Args:
+        cache_dir: Directory holding one JSON file per entry
+        ttl_sec: Seconds an entry stays valid after it was written
+        max_bytes: Total entry size before least-recently-used entries are evicted
+    """
+
+    def __init__(self, cache_dir: str, ttl_sec: float = 86400.0, max_bytes: int = 50 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Return the cached response as its original list of chunks, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+        if time.time() - float(entry.get("created", 0)) > self.ttl_sec:
+            self._count("expired")
+            self._count("misses")
+            _remove_quietly(path)
+            return None
+        text = entry.get("text", "")
+        chunks = _split_chunks(text, entry.get("chunks") or [len(text)])
+        try:
+            os.utime(path, None)  # LRU: mark as recently used
+        except OSError:
+            pass
+        self._count("hits")
+        return chunks
+
+    def put(self, key: str, chunks: List[str], model: str = "") -> None:
+        """Store a completed response; chunk boundaries are kept for streamed replay."""
+        text = "".join(chunks)
+        if not text:
+            return
+        entry = {
+            "created": time.time(),
+            "model": model,
+            "text": text,
+            "chunks": [len(c) for c in chunks if c],
+        }
+        tmp = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp, 'w', encoding='utf-8', newline='') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            _remove_quietly(tmp)
+            return
+        self._count("stores")
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop expired entries, then least-recently-used ones until under the size budget."""
+        entries = []
+        now = time.time()
+        removed = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if not name.endswith(".json") or name == STATS_FILE or name.startswith("."):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # mtime is the last access, so an entry untouched for a full TTL is certainly expired
+            if now - st.st_mtime > self.ttl_sec:
+                _remove_quietly(path)
+                removed += 1
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                _remove_quietly(path)
+                total -= size
+                removed += 1
+        if removed:
+            with self._lock:
+                self._stats["evictions"] += removed
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def flush_stats(self) -> Dict[str, int]:
+        """
+        Add this process's hit/miss counters to the persistent totals in stats.json.
+
+        Best effort: concurrent processes may occasionally overwrite each other's
+        increment, which is acceptable for a diagnostic counter.
+        """
+        with self._lock:
+            delta = dict(self._stats)
+            for k in self._stats:
+                self._stats[k] = 0
+        path = os.path.join(self.cache_dir, STATS_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                totals = json.load(f)
+        except (OSError, ValueError):
+            totals = {}
+        for k, v in delta.items():
+            totals[k] = int(totals.get(k, 0)) + v
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(totals, f)
+            os.replace(tmp, path)
+        except OSError:
+            _remove_quietly(tmp)
+        return totals
+
+
+def _split_chunks(text: str, sizes: List[int]) -> List[str]:
+    chunks = []
+    pos = 0
+    for n in sizes:
+        if n <= 0:
+            continue
+        chunks.append(text[pos:pos + n])
+        pos += n
+    if pos < len(text):
+        chunks.append(text[pos:])
+    return [c for c in chunks if c]
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def open_cache(enabled: Optional[bool] = None) -> Optional[ResponseCache]:
+    """
+    Build the cache from the environment.
+
+    enabled=None defers to PROMPTOPT_CACHE; False (--no-cache) always bypasses.
+    """
+    if enabled is None:
+        enabled = os.environ.get("PROMPTOPT_CACHE", "").strip() == "1"
+    if not enabled:
+        return None
+    cache_dir = os.environ.get("PROMPTOPT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "promptopt_cache")
+    try:
+        ttl = float(os.environ.get("PROMPTOPT_CACHE_TTL", "86400"))
+    except ValueError:
+        ttl = 86400.0
+    try:
+        max_mb = float(os.environ.get("PROMPTOPT_CACHE_MAX_MB", "50"))
+    except ValueError:
+        max_mb = 50.0
+    try:
+        return ResponseCache(cache_dir, ttl_sec=ttl, max_bytes=int(max_mb * 1024 * 1024))
+    except OSError:
+        return None
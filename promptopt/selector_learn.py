@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Learned meta-prompt selection from the user's own choices.
+
+With PROMPTOPT_SELECTOR_LEARN=1 the selector appends to a local JSONL history:
+
+  select   what `select` returned (reason, id), to count the menus shown
+           and avoided
+  choice   the meta-prompt the user picked from the menu, recorded with
+           `meta_prompt_selector.py --record-choice ID --input FILE`, along
+           with the heuristic scores shown and the text's hashed n-gram
+           features; the text itself is never stored. Nothing in this tree
+           shows the menu, so whatever does (or the user) must make that
+           call: picks are not logged on their own
+
+`--train` fits a multinomial logistic regression (NumPy) on the recorded
+choices. Features are hashed word unigrams and bigrams plus the heuristic
+scores. A held-out fifth calibrates a softmax temperature, then the model is
+refit on every choice. It is saved as JSON with float32 weights, so `select`
+can use it without NumPy. The model only steps in where the heuristic would
+show the menu. It auto-selects when its calibrated confidence clears
+LEARNED_MIN_CONFIDENCE and the heuristic's own hit rate on menu choices.
+
+Environment:
+    PROMPTOPT_SELECTOR_LEARN=1    log selections and choices, use a trained model
+    PROMPTOPT_SELECTOR_HISTORY    history file (default %APPDATA%/PromptOpt/selector_history.jsonl);
+                                  the model is saved next to it as selector_model.json
+"""
+import base64
+import json
+import math
+import os
+import re
+import sys
+import time
+import zlib
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+HASH_DIM = 1 << 12
+FEATURE_CHARS = 64 * 1024
+MODEL_FILE = 'selector_model.json'
+MODEL_VERSION = 1
+
+MIN_TRAIN_RECORDS = 30
+MAX_TRAIN_RECORDS = 500  # most recent choices; keeps training in the tens of milliseconds
+LEARNED_MIN_CONFIDENCE = 0.8
+EPOCHS = 200
+L2 = 1e-4
+
+# Words, and single symbols so that fences, braces and @ still count
+_TOKEN_RE = re.compile(r'[a-z0-9_]+|[^\sa-z0-9_]')
+
+
+def text_features(text: str) -> Dict[int, float]:
+    """Hashed unigram and bigram counts, log-scaled and L2-normalized."""
+    if len(text) > FEATURE_CHARS:
+        text = text[:FEATURE_CHARS * 3 // 4] + '\n' + text[-FEATURE_CHARS // 4:]
+    tokens = _TOKEN_RE.findall(text.lower())
+    counts: Dict[int, int] = {}
+    for gram in tokens + [a + ' ' + b for a, b in zip(tokens, tokens[1:])]:
+        h = zlib.crc32(gram.encode('utf-8')) % HASH_DIM
+        counts[h] = counts.get(h, 0) + 1
+    values = {h: 1.0 + math.log(c) for h, c in counts.items()}
+    norm = math.sqrt(sum(v * v for v in values.values())) or 1.0
+    return {h: v / norm for h, v in values.items()}
+
+
+class LinearModel:
+    """Softmax over `classes` of hashed features plus heuristic scores; inference is stdlib only."""
+
+    def __init__(self, classes: List[str], score_ids: List[str], weights: array, bias: List[float],
+                 temperature: float, threshold: float, stats: Dict):
+        self.classes = classes
+        self.score_ids = score_ids
+        self.weights = weights  # (HASH_DIM + len(score_ids)) x len(classes), row-major
+        self.bias = bias
+        self.temperature = temperature
+        self.threshold = threshold
+        self.stats = stats
+
+    def predict(self, features: Dict[int, float], scores: Dict[str, float]) -> Tuple[str, float]:
+        """(class, calibrated probability) of the most likely class."""
+        k = len(self.classes)
+        w = self.weights
+        logits = list(self.bias)
+        inputs = list(features.items()) + [(HASH_DIM + j, scores.get(sid, 0.0)) for j, sid in enumerate(self.score_ids)]
+        for idx, value in inputs:
+            if value:
+                row = idx * k
+                for c in range(k):
+                    logits[c] += value * w[row + c]
+        top = max(logits)
+        exp = [math.exp((z - top) / self.temperature) for z in logits]
+        best = max(range(k), key=exp.__getitem__)
+        return self.classes[best], exp[best] / sum(exp)
+
+    def save(self, path: str) -> None:
+        weights = array('f', self.weights)
+        if sys.byteorder != 'little':
+            weights.byteswap()
+        payload = {
+            'version': MODEL_VERSION,
+            'hash_dim': HASH_DIM,
+            'classes': self.classes,
+            'score_ids': self.score_ids,
+            'bias': self.bias,
+            'temperature': self.temperature,
+            'threshold': self.threshold,
+            'stats': self.stats,
+            'weights': base64.b64encode(weights.tobytes()).decode('ascii'),
+        }
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['LinearModel']:
+        """The saved model, or None if there is none or it was saved by another version."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+            if payload.get('version') != MODEL_VERSION or payload.get('hash_dim') != HASH_DIM:
+                return None
+            weights = array('f')
+            weights.frombytes(base64.b64decode(payload['weights']))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if sys.byteorder != 'little':
+            weights.byteswap()
+        return cls(payload['classes'], payload['score_ids'], weights, payload['bias'],
+                   payload['temperature'], payload['threshold'], payload.get('stats', {}))
+
+
+def _fit(gram, onehot, lr: float):
+    """Logistic regression by momentum gradient descent in the span of the
+    training rows (W = X.T @ A), so each epoch costs n x n instead of n x features."""
+    import numpy as np
+    n, k = onehot.shape
+    a, b = np.zeros((n, k)), np.zeros(k)
+    va, vb = np.zeros((n, k)), np.zeros(k)
+    for _ in range(EPOCHS):
+        la, lb = a + 0.9 * va, b + 0.9 * vb
+        z = gram @ la + lb
+        z -= z.max(axis=1, keepdims=True)
+        p = np.exp(z)
+        p /= p.sum(axis=1, keepdims=True)
+        g = (p - onehot) / n
+        va = 0.9 * va - lr * (g + L2 * la)
+        vb = 0.9 * vb - lr * g.sum(axis=0)
+        a += va
+        b += vb
+    return a, b
+
+
+def train(records: List[Dict], meta_prompt_ids: List[str]) -> LinearModel:
+    """Fit a LinearModel on the `choice` records; ValueError if there are too few."""
+    import numpy as np
+    start = time.perf_counter()
+    choices = [r for r in records if r.get('event') == 'choice' and r.get('chosen') in meta_prompt_ids]
+    choices = choices[-MAX_TRAIN_RECORDS:]
+    classes = sorted({r['chosen'] for r in choices})
+    if len(choices) < MIN_TRAIN_RECORDS or len(classes) < 2:
+        raise ValueError(f'need at least {MIN_TRAIN_RECORDS} recorded choices of 2+ meta-prompts, '
+                         f'have {len(choices)} of {len(classes)}')
+
+    n, k = len(choices), len(classes)
+    x = np.zeros((n, HASH_DIM + len(meta_prompt_ids)))
+    for i, r in enumerate(choices):
+        for h, v in r['features']:
+            x[i, h] = v
+        for j, sid in enumerate(meta_prompt_ids):
+            x[i, HASH_DIM + j] = r['scores'].get(sid, 0.0)
+    y = np.array([classes.index(r['chosen']) for r in choices])
+    onehot = np.eye(k)[y]
+    gram = x @ x.T
+    lr = 8.0 / max(1.0, float(gram.diagonal().max()))
+
+    # Calibrate on every fifth choice, then refit on all of them
+    held = np.arange(n) % 5 == 4
+    a, b = _fit(gram[np.ix_(~held, ~held)], onehot[~held], lr)
+    logits = gram[np.ix_(held, ~held)] @ a + b
+
+    def probabilities(t: float):
+        z = (logits - logits.max(axis=1, keepdims=True)) / t
+        p = np.exp(z)
+        return p / p.sum(axis=1, keepdims=True)
+
+    temperatures = [0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0]
+    temperature = min(temperatures, key=lambda t: -np.log(probabilities(t)[np.arange(held.sum()), y[held]] + 1e-12).mean())
+
+    # The model has to beat how often the user already takes the heuristic's top pick
+    heuristic_hits = sum(1 for r in choices if r.get('shown') == r['chosen']) / n
+    threshold = max(LEARNED_MIN_CONFIDENCE, heuristic_hits)
+    p = probabilities(temperature)
+    confident = p.max(axis=1) >= threshold
+    correct = p.argmax(axis=1) == y[held]
+
+    a, b = _fit(gram, onehot, lr)
+    weights = array('f', (x.T @ a).astype(np.float32).ravel().tolist())
+    stats = {
+        'choices': n,
+        'held_out': int(held.sum()),
+        'heuristic_hit_rate': round(heuristic_hits, 3),
+        'held_out_accuracy': round(float(correct.mean()), 3),
+        'confident_share': round(float(confident.mean()), 3),
+        'confident_accuracy': round(float(correct[confident].mean()), 3) if confident.any() else None,
+        'trained_at': int(time.time()),
+        'train_ms': round((time.perf_counter() - start) * 1000, 1),
+    }
+    return LinearModel(classes, list(meta_prompt_ids), weights, [float(v) for v in b], temperature, threshold, stats)
+
+
+class SelectionLearner:
+    """History log and learned model of one user; see the module docstring."""
+
+    def __init__(self, history_path: str):
+        self.history_path = history_path
+        self.model_path = os.path.join(os.path.dirname(history_path) or '.', MODEL_FILE)
+        self._model: Optional[LinearModel] = None
+        self._loaded = False
+
+    @property
+    def model(self) -> Optional[LinearModel]:
+        # Loaded on first use: only selections that would show the menu need it
+        if not self._loaded:
+            self._model = LinearModel.load(self.model_path)
+            self._loaded = True
+        return self._model
+
+    def predict(self, text: str, scored) -> Optional[Tuple[str, float]]:
+        """(meta-prompt id, confidence) if the model is confident enough to skip the menu."""
+        model = self.model
+        if model is None:
+            return None
+        chosen, confidence = model.predict(text_features(text), {mp.id: score for mp, score in scored})
+        return (chosen, confidence) if confidence >= model.threshold else None
+
+    def log(self, record: Dict) -> None:
+        """Append one record; a history that cannot be written never breaks selection."""
+        try:
+            os.makedirs(os.path.dirname(self.history_path) or '.', exist_ok=True)
+            with open(self.history_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(record, ts=int(time.time()))) + '\n')
+        except OSError:
+            pass
+
+    def log_selection(self, result: Dict) -> None:
+        self.log({'event': 'select', 'id': result.get('id'), 'reason': result.get('reason'),
+                  'auto_selected': result.get('auto_selected')})
+
+    def record_choice(self, text: str, scored, chosen: str) -> None:
+        features = text_features(text)
+        self.log({
+            'event': 'choice',
+            'chosen': chosen,
+            'shown': scored[0][0].id if scored else None,
+            'scores': {mp.id: round(score, 6) for mp, score in scored},
+            'features': [[h, round(v, 5)] for h, v in sorted(features.items())],
+        })
+
+    def records(self) -> List[Dict]:
+        try:
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # a line cut short by a crash
+        return records
+
+    def train(self, meta_prompt_ids: List[str]) -> LinearModel:
+        model = train(self.records(), meta_prompt_ids)
+        os.makedirs(os.path.dirname(self.model_path) or '.', exist_ok=True)
+        model.save(self.model_path)
+        self._model, self._loaded = model, True
+        return model
+
+    def report(self) -> str:
+        records = self.records()
+        selections = [r for r in records if r.get('event') == 'select']
+        reasons: Dict[str, int] = {}
+        for r in selections:
+            reasons[r.get('reason')] = reasons.get(r.get('reason'), 0) + 1
+        learned = reasons.get('learned', 0)
+        menus = sum(1 for r in selections if not r.get('auto_selected'))
+        choices = sum(1 for r in records if r.get('event') == 'choice')
+        lines = [
+            f'Selector history: {self.history_path}',
+            f'  selections: {len(selections)} ({reasons.get("high_confidence", 0)} auto-selected by the heuristic, '
+            f'{learned} by the learned model, {menus} menus shown)',
+            f'  menus avoided by the learned model: {learned} of {learned + menus}'
+            + (f' ({learned / (learned + menus):.0%})' if learned + menus else ''),
+            f'  choices recorded: {choices}',
+        ]
+        if menus and not choices:
+            lines.append('  menu picks are not logged automatically; record each with --record-choice ID')
+        model = self.model
+        if model is None:
+            lines.append(f'  model: none (train with --train after {MIN_TRAIN_RECORDS} choices)')
+        else:
+            s = model.stats
+            lines.append(f'  model: {len(model.classes)} meta-prompts from {s.get("choices")} choices in '
+                         f'{s.get("train_ms")} ms; threshold {model.threshold:.2f} '
+                         f'(heuristic top pick chosen {s.get("heuristic_hit_rate", 0):.0%})')
+            if s.get('confident_accuracy') is not None:
+                lines.append(f'  held out: confident on {s["confident_share"]:.0%} of menus, '
+                             f'{s["confident_accuracy"]:.0%} of those right')
+        return '\n'.join(lines)
+
+
+def history_path_from_env() -> str:
+    path = os.environ.get('PROMPTOPT_SELECTOR_HISTORY', '').strip()
+    if path:
+        return path
+    base = os.environ.get('APPDATA') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(base, 'PromptOpt', 'selector_history.jsonl')
+
+
+def open_learner() -> Optional[SelectionLearner]:
+    """Learner for this user, or None unless PROMPTOPT_SELECTOR_LEARN=1."""
+    if os.environ.get('PROMPTOPT_SELECTOR_LEARN', '').strip() != '1':
+        return None
+    return SelectionLearner(history_path_from_env())
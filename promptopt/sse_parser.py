@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Incremental Server-Sent Events parser for PromptOpt streaming.
+
+`SSEParser.feed()` takes raw socket blocks (any size, split anywhere),
+frames events on blank lines, and decodes each event's data once, so large
+reads avoid per-line decode/strip overhead. It follows the SSE framing rules
+that the old readline loop ignored: multi-line `data:` fields are joined with
+newlines, `event:`/`id:`/`retry:` fields are kept, comment lines (`: ...`,
+e.g. OpenRouter's keep-alive `: OPENROUTER PROCESSING`) are counted and
+skipped, and CRLF/CR line endings are accepted even when split across reads.
+
+`chat_events()` turns an SSE event from an OpenAI-compatible
+`/chat/completions` stream into typed `ChatEvent`s: content deltas,
+finish_reason (with the routed provider, if any), the final usage chunk,
+provider errors and `[DONE]`.
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+
+@dataclass
+class SSEEvent:
+    data: str
+    event: str = "message"
+    id: Optional[str] = None
+    retry: Optional[int] = None
+
+
+@dataclass
+class ChatEvent:
+    kind: str  # 'content' | 'finish' | 'usage' | 'error' | 'done'
+    text: str = ""
+    value: Any = field(default=None)
+
+
+class SSEParser:
+    """Stateful SSE framer; feed bytes in, get complete events out."""
+
+    def __init__(self):
+        self._buf = b""
+        self.last_event_id: Optional[str] = None
+        self.retry: Optional[int] = None
+        self.comments = 0
+        self.events = 0
+        self.bytes = 0
+
+    def feed(self, data: bytes) -> List[SSEEvent]:
+        self.bytes += len(data)
+        buf = self._buf + data if self._buf else data
+        if b"\r" in buf:
+            tail = b""
+            if buf.endswith(b"\r"):
+                # May be the first half of a CRLF split across reads
+                buf, tail = buf[:-1], b"\r"
+            buf = buf.replace(b"\r\n", b"\n").replace(b"\r", b"\n") + tail
+        cut = buf.rfind(b"\n\n")
+        if cut < 0:
+            self._buf = buf
+            return []
+        # Everything up to the last blank line is whole events (and whole UTF-8
+        # sequences), so the block is decoded once rather than per line
+        self._buf = buf[cut + 2:]
+        return self._parse_blocks(buf[:cut].decode("utf-8", errors="replace").split("\n\n"))
+
+    def close(self) -> List[SSEEvent]:
+        """Dispatch a final event that was not followed by a blank line."""
+        block, self._buf = self._buf.rstrip(b"\r\n"), b""
+        if not block:
+            return []
+        return self._parse_blocks([block.decode("utf-8", errors="replace")])
+
+    def _parse_blocks(self, blocks: List[str]) -> List[SSEEvent]:
+        out = []
+        for block in blocks:
+            # Fast path: the overwhelmingly common single-line `data: {...}` event
+            if block[:6] == "data: " and "\n" not in block:
+                out.append(SSEEvent(block[6:], "message", self.last_event_id, self.retry))
+            elif block:
+                ev = self._parse_block(block)
+                if ev is not None:
+                    out.append(ev)
+        self.events += len(out)
+        return out
+
+    def _parse_block(self, block: str) -> Optional[SSEEvent]:
+        data_parts: List[str] = []
+        event = "message"
+        for line in block.split("\n"):
+            if not line:
+                continue
+            if line[0] == ":":  # comment / keep-alive
+                self.comments += 1
+                continue
+            name, sep, value = line.partition(":")
+            if sep and value[:1] == " ":
+                value = value[1:]
+            if name == "data":
+                data_parts.append(value)
+            elif name == "event":
+                event = value or "message"
+            elif name == "id":
+                if "\0" not in value:
+                    self.last_event_id = value
+            elif name == "retry":
+                if value.isdigit():
+                    self.retry = int(value)
+        if not data_parts:
+            return None
+        return SSEEvent("\n".join(data_parts), event, self.last_event_id, self.retry)
+
+
+# C scanner without the json.loads() wrapper; keys are memoised per call, which
+# is what makes decoding a whole block of events in one call cheaper
+_scan_once = json.JSONDecoder().scan_once
+
+
+def chat_events(ev: SSEEvent) -> List[ChatEvent]:
+    """Decode one Chat Completions SSE event into typed events."""
+    out: List[ChatEvent] = []
+    _decode_into(out, ev)
+    return out
+
+
+def chat_events_batch(events: List[SSEEvent]) -> List[ChatEvent]:
+    """
+    Decode every event from one feed() call, in order.
+
+    When the block carries several JSON events they are parsed with a single
+    scanner call; any mismatch falls back to decoding events one by one.
+    """
+    out: List[ChatEvent] = []
+    objs = None
+    if len(events) > 1:
+        batch = [ev.data for ev in events if ev.data[:1] == "{" and ev.data[-1:] == "}"]
+        if len(batch) > 1:
+            joined = "[" + ",".join(batch) + "]"
+            try:
+                objs, end = _scan_once(joined, 0)
+            except (ValueError, StopIteration):
+                objs = None
+            if objs is not None and (end != len(joined) or len(objs) != len(batch)):
+                objs = None
+    if objs is None:
+        for ev in events:
+            _decode_into(out, ev)
+        return out
+    it = iter(objs)
+    for ev in events:
+        if ev.data[:1] == "{" and ev.data[-1:] == "}":
+            _append_chat(out, ev, next(it))
+        else:
+            _decode_into(out, ev)
+    return out
+
+
+def _decode_into(out: List[ChatEvent], ev: SSEEvent) -> None:
+    data = ev.data
+    if data == "[DONE]":
+        out.append(ChatEvent("done"))
+        return
+    try:
+        obj = json.loads(data)
+    except ValueError:
+        if ev.event == "error":
+            out.append(ChatEvent("error", data))
+        return
+    _append_chat(out, ev, obj)
+
+
+def _append_chat(out: List[ChatEvent], ev: SSEEvent, obj: Any) -> None:
+    if type(obj) is not dict:
+        return
+    if "error" in obj or ev.event == "error":
+        err = obj.get("error")
+        msg = err.get("message", "") if isinstance(err, dict) else str(err or ev.data)
+        out.append(ChatEvent("error", msg, obj))
+        return
+    choices = obj.get("choices")
+    if choices and type(choices) is list:
+        ch0 = choices[0]
+        if type(ch0) is dict:
+            delta = ch0.get("delta")
+            if type(delta) is dict:
+                piece = delta.get("content")
+                if piece and type(piece) is str:
+                    out.append(ChatEvent("content", piece))
+            reason = ch0.get("finish_reason")
+            if reason:
+                # OpenRouter names the upstream provider on each chunk; keep it once, on the finish event
+                out.append(ChatEvent("finish", str(reason), obj.get("provider")))
+    usage = obj.get("usage")
+    if type(usage) is dict:
+        out.append(ChatEvent("usage", "", usage))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Compact intermediate representation passed between Agent Mode stages.
+
+Without it every stage re-sends raw text: Stage 2 the whole input (Context
+Scout bundle included) plus Stage 1's fenced, pretty-printed answer, Stage 4
+that answer again, Stage 5b the eval JSON with `indent=2`. With it:
+
+  request      the user's request with the context bundle replaced by a
+               one-line reference listing its files; only Stage 1 reads the
+               bundle itself, and later stages work from its analysis. The
+               bundle is not attached to the final prompt, so the output has
+               the same shape as with raw stages
+  analysis_ir  Stage 1's decoded fields as minified JSON (fence and
+               commentary dropped)
+  feedback_ir  Stage 5's critical issues and fixes as minified JSON
+
+`IR_KEYS` maps each compact key to the raw one it replaces, so a stage's
+prompt can also be rendered the old way to show the tokens saved.
+"""
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+# How a Context Scout bundle is appended to the input sent to a model
+CONTEXT_MARKER = "\n\n---\n\n# Context\n"
+
+# Compact context key -> raw key it stands in for
+IR_KEYS = {"request": "input", "analysis_ir": "analysis", "feedback_ir": "feedback"}
+
+_FILE_RE = re.compile(r'<file path="([^"]*)">\n(.*?)\n</file>', re.DOTALL)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), for comparing prompts without a tokenizer."""
+    return (len(text) + 3) // 4
+
+
+def minify_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def join_context(request: str, bundle: str) -> str:
+    """The request with a Context Scout bundle appended under `# Context` (unchanged when there is none)."""
+    return request + CONTEXT_MARKER + bundle if bundle.strip() else request
+
+
+def bundle_files(bundle: str) -> List[Tuple[str, int]]:
+    """(path, line count) of each `<file>` block in a context bundle."""
+    return [(m.group(1), m.group(2).count("\n") + 1) for m in _FILE_RE.finditer(bundle)]
+
+
+def context_reference(bundle: str) -> str:
+    files = bundle_files(bundle)
+    listing = ", ".join(f"{path} ({lines} lines)" for path, lines in files) or f"{estimate_tokens(bundle)} tokens of text"
+    return ("[Context bundle: " + listing + ". The analysis above was made from it; "
+            "refer to these files by path.]")
+
+
+def seed_context(request: str, bundle: str = "") -> Dict[str, str]:
+    """
+    Initial stage-graph context: the raw `input`, the compact `request` and the `context` bundle.
+
+    The caller passes the bundle it built separately, so text in the request
+    that happens to look like the `# Context` marker is never taken for one.
+    """
+    bundle = bundle if bundle.strip() else ""
+    return {"input": join_context(request, bundle), "request": request + ("\n\n" + context_reference(bundle) if bundle else ""), "context": bundle}
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Per-stage model routing for Agent Mode.
+
+By default every Agent Mode stage runs on the job's `--model`. A route sends
+a stage to its own model chain instead, optionally pinned to OpenRouter
+providers (`provider.only`): JSON extraction (Stage 1) and scoring (Stage 5)
+can go to a small fast model while Final Assembly stays on a strong one.
+
+Each routed stage tries its models in order, like the standard-mode
+`models_to_try` loop, and falls back to the job's model last. A stage that
+has already written output is not retried (its text is on screen).
+
+Route syntax (CLI and environment):
+    STAGE=MODEL[,MODEL...][@PROVIDER[,PROVIDER...]]
+    e.g. analysis=openai/gpt-oss-20b,meta-llama/llama-3.3-70b-instruct@cerebras
+
+STAGE is a stage key (analysis, clarified, skeleton, final, fused, eval,
+rewrite), its number (1, 2, 3, 4, 5, 5b), or `*` for every stage without a
+route of its own. The fused Stage 3+4 call uses the `final` route unless it
+has one. Best-of-N candidates and their scoring calls are `final#N` and
+`eval#N` (also `4#N`, `5#N`) and use the `final` / `eval` route unless they
+have their own, so candidates can run on different models.
+
+Config file (JSON):
+    {"analysis": {"models": ["openai/gpt-oss-20b"], "provider_only": ["cerebras"]},
+     "eval": "openai/gpt-oss-20b"}
+
+Later sources override earlier ones per stage: config file, then
+PROMPTOPT_STAGE_MODELS, then `--stage-model`.
+
+Latency saved (while tracing): `LatencyHistory` keeps a moving average of
+each stage's duration per model. When a routed stage finishes, its trace span gets
+`baseline_model`, `baseline_ms` (that stage's average on the job's model)
+and `saved_ms`, once the history has a baseline to compare against.
+
+Environment:
+    PROMPTOPT_STAGE_MODELS          routes separated by `;`
+    PROMPTOPT_STAGE_ROUTES          path of a JSON routes file (like --stage-routes)
+    PROMPTOPT_STAGE_LATENCY_FILE    latency history (default: %TEMP%/promptopt_stage_latency.json)
+"""
+import json
+import os
+import tempfile
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+STAGE_KEYS = ("analysis", "clarified", "skeleton", "final", "fused", "eval", "rewrite")
+STAGE_ALIASES = {"1": "analysis", "2": "clarified", "3": "skeleton", "4": "final", "5": "eval", "5b": "rewrite"}
+
+# Weight of the newest sample in the moving average
+EWMA_ALPHA = 0.3
+
+
+@dataclass
+class StageRoute:
+    """Model chain (tried in order) and optional OpenRouter `provider.only` list for one stage."""
+    models: List[str]
+    provider_only: Optional[List[str]] = None
+
+
+def _stage_key(name: str) -> str:
+    key, hash_, n = name.strip().lower().partition("#")
+    key = STAGE_ALIASES.get(key, key)
+    if hash_ and key in ("final", "eval") and n.isdigit():
+        return f"{key}#{n}"
+    if hash_ or (key != "*" and key not in STAGE_KEYS):
+        raise ValueError(f"unknown Agent Mode stage {name!r} in stage route (expected one of: {', '.join(STAGE_KEYS)}, 1-5, 5b, *)")
+    return key
+
+
+def _split(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def parse_route(spec: str) -> tuple:
+    """'STAGE=MODEL[,MODEL...][@PROVIDER,...]' -> (stage key, StageRoute)."""
+    stage, sep, rest = spec.partition("=")
+    if not sep:
+        raise ValueError(f"stage route {spec!r} must look like STAGE=MODEL[,MODEL...][@PROVIDER,...]")
+    models, at, providers = rest.partition("@")
+    route = StageRoute(_split(models), _split(providers) if at else None)
+    if not route.models:
+        raise ValueError(f"stage route {spec!r} names no model")
+    return _stage_key(stage), route
+
+
+def load_routes_file(path: str) -> Dict[str, StageRoute]:
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"stage routes file {path} must hold a JSON object")
+    routes: Dict[str, StageRoute] = {}
+    for stage, value in data.items():
+        if isinstance(value, str):
+            value = {"models": [value]}
+        if not isinstance(value, dict):
+            raise ValueError(f"stage routes file {path}: entry {stage!r} must be a model name or an object")
+        models = value.get("models") or ([value["model"]] if value.get("model") else [])
+        providers = value.get("provider_only")
+        if isinstance(models, str):
+            models = [models]
+        if isinstance(providers, str):
+            providers = _split(providers)
+        if not models:
+            raise ValueError(f"stage routes file {path}: entry {stage!r} names no model")
+        routes[_stage_key(stage)] = StageRoute([str(m) for m in models], [str(p) for p in providers] if providers else None)
+    return routes
+
+
+class StageRouter:
+    """
+    Resolve each stage's model chain.
+
+    Args:
+        default_model: The job's model; unrouted stages use only this, routed
+                       stages fall back to it last
+        routes: Stage key (or `*`) -> StageRoute
+    """
+
+    def __init__(self, default_model: str, routes: Optional[Dict[str, StageRoute]] = None):
+        self.default_model = default_model
+        self.routes = dict(routes or {})
+
+    def __bool__(self) -> bool:
+        return bool(self.routes)
+
+    def route(self, stage_key: str) -> StageRoute:
+        r = self.routes.get(stage_key)
+        if r is None and "#" in stage_key:
+            r = self.routes.get(stage_key.partition("#")[0])
+        if r is None and stage_key == "fused":
+            r = self.routes.get("final")
+        if r is None:
+            r = self.routes.get("*")
+        if r is None:
+            return StageRoute([self.default_model])
+        models = list(dict.fromkeys(r.models + [self.default_model]))
+        return StageRoute(models, r.provider_only)
+
+    def describe(self) -> List[str]:
+        lines = []
+        for key in sorted(self.routes, key=lambda k: (k == "*", STAGE_KEYS.index(k.partition("#")[0]) if k.partition("#")[0] in STAGE_KEYS else 0, k)):
+            r = self.route(key) if key != "*" else self.routes[key]
+            only = f" provider.only={r.provider_only}" if r.provider_only else ""
+            lines.append(f"stage route: {key} -> {' > '.join(r.models)}{only}")
+        return lines
+
+
+def router_from_config(default_model: str, stage_models: Iterable[str] = (), routes_file: Optional[str] = None) -> StageRouter:
+    """Merge the routes file, PROMPTOPT_STAGE_MODELS and --stage-model specs (later wins per stage)."""
+    routes: Dict[str, StageRoute] = {}
+    path = routes_file or os.environ.get("PROMPTOPT_STAGE_ROUTES", "").strip()
+    if path:
+        routes.update(load_routes_file(path))
+    env_specs = [s for s in os.environ.get("PROMPTOPT_STAGE_MODELS", "").split(";") if s.strip()]
+    for spec in env_specs + list(stage_models):
+        key, route = parse_route(spec)
+        routes[key] = route
+    return StageRouter(default_model, routes)
+
+
+class LatencyHistory:
+    """
+    Moving average of stage duration per (stage, model), persisted as JSON.
+
+    Writes use a temp file plus `os.replace`; concurrent processes may lose
+    each other's latest sample, which only delays the average.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._data: Dict[str, Dict[str, dict]] = data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            self._data = {}
+
+    def average_ms(self, stage_key: str, model: str) -> Optional[float]:
+        entry = self._data.get(stage_key, {}).get(model)
+        return entry["ewma_ms"] if isinstance(entry, dict) and "ewma_ms" in entry else None
+
+    def record(self, stage_key: str, model: str, duration_ms: float) -> None:
+        with self._lock:
+            entry = self._data.setdefault(stage_key, {}).get(model)
+            if entry is None:
+                entry = {"ewma_ms": duration_ms, "n": 0}
+            else:
+                entry["ewma_ms"] = EWMA_ALPHA * duration_ms + (1 - EWMA_ALPHA) * entry["ewma_ms"]
+            entry["ewma_ms"] = round(entry["ewma_ms"], 1)
+            entry["n"] += 1
+            self._data[stage_key][model] = entry
+
+    def save(self) -> None:
+        with self._lock:
+            payload = json.dumps(self._data, indent=1, sort_keys=True)
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8', newline='') as f:
+                f.write(payload)
+            os.replace(tmp, self.path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def open_latency_history() -> LatencyHistory:
+    return LatencyHistory(os.environ.get("PROMPTOPT_STAGE_LATENCY_FILE") or os.path.join(tempfile.gettempdir(), "promptopt_stage_latency.json"))
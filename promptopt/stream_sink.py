@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Coalescing output-file writer for streamed responses.
+
+The AHK result window polls the output file, so every streamed delta used to
+be written with its own open/append/close. At 2k+ tokens/s that is thousands
+of syscalls per response. `StreamSink` buffers deltas and flushes on a time
+or size budget (default 30 ms / 4 KB), still opening and closing the file per
+flush so Windows readers are never locked out.
+
+Every flush writes whole UTF-8 characters: text is buffered as `str`, a
+trailing high surrogate (half of an astral character split across SSE
+events) is held back until its pair arrives, and the file is opened in binary
+append mode so nothing re-encodes or splits a multi-byte sequence.
+
+Environment:
+    PROMPTOPT_FLUSH_MS     flush interval in milliseconds (default 30)
+    PROMPTOPT_FLUSH_BYTES  flush once this many bytes are buffered (default 4096)
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _is_high_surrogate(ch: str) -> bool:
+    return "\ud800" <= ch <= "\udbff"
+
+
+def _encode(text: str) -> bytes:
+    # Re-pair surrogate halves that arrived in separate deltas, then encode;
+    # anything still unpaired becomes U+FFFD rather than invalid UTF-8.
+    try:
+        text = text.encode("utf-16", "surrogatepass").decode("utf-16")
+    except UnicodeError:
+        pass
+    return text.encode("utf-8", errors="replace")
+
+
+class StreamSink:
+    """
+    Buffered append-only writer for one output file.
+
+    Args:
+        path: Output file polled by the AHK preview
+        truncate: Start from an empty file (the first flush happens immediately)
+        flush_interval: Seconds between time-based flushes
+        flush_bytes: Buffered size that forces a flush
+    """
+
+    def __init__(self, path: str, truncate: bool = False, flush_interval: Optional[float] = None, flush_bytes: Optional[int] = None):
+        self.path = path
+        self.flush_interval = flush_interval if flush_interval is not None else _env_number("PROMPTOPT_FLUSH_MS", 30) / 1000.0
+        self.flush_bytes = int(flush_bytes if flush_bytes is not None else _env_number("PROMPTOPT_FLUSH_BYTES", 4096))
+        self._buf: List[str] = []
+        self._buf_len = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._wake = threading.Event()
+        self._last_flush = time.monotonic()
+        self._started = self._last_flush
+        self.chunks = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.write_seconds = 0.0
+        if truncate:
+            parent = os.path.dirname(path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            with open(path, 'wb'):
+                pass
+        self._flusher = threading.Thread(target=self._flush_loop, name="promptopt-sink", daemon=True)
+        self._flusher.start()
+
+    def write(self, text: str) -> None:
+        """Queue a delta; flushes inline once the size budget or interval is exceeded."""
+        if not text:
+            return
+        with self._lock:
+            if self._closed:
+                raise ValueError("write to closed StreamSink")
+            self._buf.append(text)
+            # len() counts code points; *4 bounds the UTF-8 size without encoding on the hot path
+            self._buf_len += len(text)
+            self.chunks += 1
+            due = self._buf_len * 4 >= self.flush_bytes or (time.monotonic() - self._last_flush) >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self, final: bool = False) -> None:
+        """Write buffered text; a dangling high surrogate is kept unless final."""
+        with self._lock:
+            if not self._buf:
+                return
+            text = "".join(self._buf)
+            held = ""
+            if not final and _is_high_surrogate(text[-1]):
+                text, held = text[:-1], text[-1]
+            self._buf = [held] if held else []
+            self._buf_len = len(held)
+            if not text:
+                return
+            data = _encode(text)
+            t0 = time.monotonic()
+            try:
+                with open(self.path, 'ab') as f:
+                    f.write(data)
+            except OSError:
+                # e.g. a transient sharing violation while the preview reads the file; retry next flush
+                self._buf.insert(0, text)
+                self._buf_len += len(text)
+                self.flush_errors += 1
+                if final:
+                    raise
+                return
+            self._last_flush = time.monotonic()
+            self.write_seconds += self._last_flush - t0
+            self.bytes_written += len(data)
+            self.flushes += 1
+
+    def _flush_loop(self) -> None:
+        # Deltas that arrive just before a stall would otherwise sit in the buffer until the next one
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            if self._closed:
+                return
+            if self._buf and (time.monotonic() - self._last_flush) >= self.flush_interval:
+                self.flush()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self.flush(final=True)
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            "chunks": self.chunks,
+            "bytes": self.bytes_written,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "write_ms": round(self.write_seconds * 1000.0, 2),
+            "seconds": round(elapsed, 3),
+            "chunks_per_sec": round(self.chunks / elapsed, 1),
+            "bytes_per_sec": round(self.bytes_written / elapsed, 1),
+        }
+
+    def report(self) -> str:
+        s = self.stats()
+        return (f"stream sink: {s['chunks']} chunks, {s['bytes']} bytes in {s['flushes']} flushes "
+                f"over {s['seconds']}s ({s['chunks_per_sec']} chunks/s, {s['bytes_per_sec']} B/s)")
+
+    def __enter__(self) -> "StreamSink":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
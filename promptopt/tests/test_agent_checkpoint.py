@@ -0,0 +1,95 @@
+"""
+Agent Mode checkpoint tests with a fake stage call (no network).
+
+Checks that a failed run's completed stages are replayed on resume without
+being called again, that a changed input or a stage moved to another
+routed model invalidates them, and that garbage collection drops run
+directories by age and by size.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+import pytest  # noqa: E402
+
+from agent_checkpoint import CheckpointStore  # noqa: E402
+from agent_pipeline import SectionWriter, StageGraphRunner, build_graph  # noqa: E402
+
+
+class _Sink:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+
+def _call(calls, fail_on=None):
+    def call(stage, prompt, section):
+        calls.append(stage.key)
+        if stage.key == fail_on:
+            raise TimeoutError("stage timed out")
+        raw = '```json\n{"task_type": "coding"}\n```' if stage.key == "analysis" else f"{stage.key}:{len(prompt)}"
+        section.write(raw)
+        return raw
+    return call
+
+
+def _run(store, user_input, calls, resume, fail_on=None, variant=None):
+    sink = _Sink()
+    checkpoint = store.run("http://mock/v1", "m/a", user_input, resume=resume, variant=variant)
+    runner = StageGraphRunner(build_graph("sequential"), _call(calls, fail_on), SectionWriter(sink), total=4, checkpoint=checkpoint)
+    return runner, runner.run({"input": user_input}), "".join(sink.parts), checkpoint
+
+
+def test_resume_replays_completed_stages_and_reruns_the_rest(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    calls = []
+    with pytest.raises(TimeoutError):
+        _run(store, "parse dates", calls, resume=False, fail_on="final")
+    assert calls == ["analysis", "clarified", "skeleton", "final"]
+
+    calls.clear()
+    runner, ctx, out, checkpoint = _run(store, "parse dates", calls, resume=True)
+    assert calls == ["final"]
+    assert runner.resumed == ["analysis", "clarified", "skeleton"]
+    assert ctx["task_type"] == "coding"
+    assert '<STAGE name="Clarification">\nclarified:' in out
+    checkpoint.discard()
+    assert not os.path.exists(checkpoint.path)
+
+    # Different input: different run directory, nothing to replay
+    calls.clear()
+    _run(store, "parse times", calls, resume=True)
+    assert calls == ["analysis", "clarified", "skeleton", "final"]
+
+
+def test_stage_routed_to_another_model_is_not_replayed(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    calls = []
+    with pytest.raises(TimeoutError):
+        _run(store, "parse dates", calls, resume=False, fail_on="final", variant=lambda key: "m/a")
+    calls.clear()
+    # Same prompts, but Clarification now routes to m/b; Structure's prompt (and so its checkpoint) is unchanged
+    runner, _, _, _ = _run(store, "parse dates", calls, resume=True, variant=lambda key: "m/b" if key == "clarified" else "m/a")
+    assert calls == ["clarified", "final"]
+    assert runner.resumed == ["analysis", "skeleton"]
+
+
+def test_gc_removes_expired_then_oldest_runs(tmp_path):
+    store = CheckpointStore(str(tmp_path), ttl_sec=3600, max_bytes=2500)
+    now = time.time()
+    for i, age in enumerate((7200, 300, 200, 100)):
+        run = store.run("u", "m", f"input {i}")
+        run.save("analysis", "sys", "prompt", "x" * 1000)
+        for name in os.listdir(run.path):
+            os.utime(os.path.join(run.path, name), (now - age, now - age))
+        os.utime(run.path, (now - age, now - age))
+    assert store.gc() == 2
+    left = sorted(os.listdir(tmp_path))
+    assert left == sorted(os.path.basename(store.run("u", "m", f"input {i}").path) for i in (2, 3))
@@ -0,0 +1,157 @@
+"""
+Agent Mode stage graph tests with a fake stage call (no network).
+
+Checks that independent stages overlap, that concurrent sections stay
+contiguous in the output, that the rewrite stage is skipped when the
+self-eval passes, that Stage 1's streamed task_type starts Structure
+early, that adaptive depth picks the short or full path from Stage 1, and
+that a failing stage stops its siblings writing to the caller's sink.
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+import pytest  # noqa: E402
+from agent_pipeline import SectionWriter, StageGraphRunner, agent_path, build_graph  # noqa: E402
+
+
+class _ListSink:
+    def __init__(self):
+        self.parts = []
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self.parts.append(text)
+
+    def text(self):
+        return "".join(self.parts)
+
+
+def _fake_call(delay=0.05, eval_json='{"pass": true, "overall_score": 4.8}'):
+    def call(stage, prompt, section):
+        for piece in (f"{stage.key}-", "out"):
+            time.sleep(delay / 2)
+            section.write(piece)
+        if stage.key == "analysis":
+            return '```json\n{"task_type": "coding"}\n```'
+        if stage.key == "eval":
+            return eval_json
+        return f"{stage.key}-out"
+    return call
+
+
+def test_parallel_graph_overlaps_structure_and_clarification():
+    sink = _ListSink()
+    runner = StageGraphRunner(build_graph("parallel"), _fake_call(), SectionWriter(sink), total=4)
+    ctx = runner.run({"input": "write a parser"})
+    assert ctx["task_type"] == "coding"
+    t = runner.timings
+    assert t["skeleton"].start < t["clarified"].end and t["clarified"].start < t["skeleton"].end
+    assert [s.key for s in runner.critical_path()][0] == "analysis"
+    assert runner.critical_path()[-1].key == "final"
+    # Both overlapping sections are written whole, one after the other
+    out = sink.text()
+    assert '<STAGE name="Clarification">\nclarified-out\n</STAGE>' in out
+    assert '<STAGE name="Structure">\nskeleton-out\n</STAGE>' in out
+
+
+def test_sequential_graph_with_eval_skips_rewrite_when_passing():
+    runner = StageGraphRunner(build_graph("sequential", enable_eval=True), _fake_call(0.0), SectionWriter(_ListSink()), total=5)
+    ctx = runner.run({"input": "x"})
+    assert "rewrite" not in ctx
+    assert runner.skipped == ["rewrite"]
+    order = sorted(runner.timings.values(), key=lambda s: s.start)
+    assert [s.key for s in order] == ["analysis", "clarified", "skeleton", "final", "eval"]
+
+
+def test_failed_eval_with_fixes_runs_rewrite():
+    call = _fake_call(0.0, eval_json='{"pass": false, "suggested_fixes": ["tighten scope"]}')
+    runner = StageGraphRunner(build_graph("sequential", enable_eval=True), call, SectionWriter(_ListSink()), total=5)
+    ctx = runner.run({"input": "x"})
+    assert ctx["rewrite"] == "rewrite-out"
+    assert '"tighten scope"' in ctx["feedback"]
+
+
+def test_task_type_streams_early_so_structure_starts_before_analysis_ends():
+    prewarmed = []
+
+    def call(stage, prompt, section):
+        if stage.key == "analysis":
+            # task_type completes early; the rest of the object is slow and the tail is malformed
+            for piece in ('```json\n{"task_type": "co', 'ding",', ' "primary_goal": "x"', ', "ambiguities": [oops', "\n```"):
+                section.write(piece)
+                time.sleep(0.05)
+            return '```json\n{"task_type": "coding", "primary_goal": "x", "ambiguities": [oops\n```'
+        section.write(f"{stage.key}-out")
+        return f"{stage.key}-out"
+
+    runner = StageGraphRunner(build_graph("parallel"), call, SectionWriter(_ListSink()), total=4, prewarm=prewarmed.append)
+    ctx = runner.run({"input": "x"})
+    t = runner.timings
+    assert ctx["task_type"] == "coding"
+    assert t["skeleton"].start < t["analysis"].end
+    assert prewarmed == [1] and "task_type" in runner.early
+
+
+def _analysis_call(analysis, calls):
+    def call(stage, prompt, section):
+        calls.append(stage.key)
+        raw = {"analysis": analysis, "eval": '{"pass": true, "overall_score": 4.6}'}.get(stage.key, f"{stage.key}-out")
+        section.write(raw)
+        return raw
+    return call
+
+
+def test_adaptive_short_path_fuses_stages_2_to_4():
+    calls, sink = [], _ListSink()
+    analysis = '```json\n{"task_type": "writing", "ambiguities": [], "contradictions": []}\n```'
+    runner = StageGraphRunner(build_graph("sequential", enable_eval=True, adaptive=True), _analysis_call(analysis, calls), SectionWriter(sink), total=5)
+    ctx = runner.run({"input": "x"})
+    assert calls == ["analysis", "fused", "eval"]
+    assert agent_path(ctx) == "short" and ctx["final"] == "fused-out"
+    assert runner.skipped == ["clarified", "skeleton", "final", "rewrite"]
+    assert "Stages 2-4 fused" in sink.text()
+
+    # The fused prompt carries both the Stage 3 scaffolding and the Stage 4 checklist
+    fused = next(st for st in runner.stages if st.key == "fused")
+    prompt = fused.render({"input": "x", "task_type": "writing", "analysis": "{}"})
+    assert 'If task_type == "writing"' in prompt and "FINAL ASSEMBLY CHECKLIST" in prompt
+
+
+def test_adaptive_keeps_full_path_for_ambiguous_or_unreadable_analysis():
+    for analysis in ('{"task_type": "coding", "ambiguities": ["which date formats?"], "contradictions": []}',
+                     '{"task_type": "coding", "ambiguities": [oops'):
+        calls = []
+        runner = StageGraphRunner(build_graph("parallel", adaptive=True), _analysis_call(analysis, calls), SectionWriter(_ListSink()), total=4)
+        ctx = runner.run({"input": "x"})
+        assert sorted(calls) == ["analysis", "clarified", "final", "skeleton"]
+        assert agent_path(ctx) == "full" and ctx["final"] == "final-out"
+        assert runner.skipped == ["fused"]
+
+
+def test_failed_stage_detaches_the_writer_from_running_siblings():
+    sink = _ListSink()
+    release, wrote = threading.Event(), threading.Event()
+
+    def call(stage, prompt, section):
+        if stage.key == "skeleton":
+            raise TimeoutError("stage timed out")
+        if stage.key == "clarified":
+            release.wait(2)
+            section.write("late")
+            wrote.set()
+        return '{"task_type": "coding"}' if stage.key == "analysis" else f"{stage.key}-out"
+
+    runner = StageGraphRunner(build_graph("parallel"), call, SectionWriter(sink), total=4)
+    with pytest.raises(TimeoutError):
+        runner.run({"input": "x"})
+    before = sink.text()
+    release.set()
+    assert wrote.wait(2)
+    assert sink.text() == before and "late" not in before
@@ -0,0 +1,176 @@
+"""
+asyncio client tests against a throwaway loopback server.
+
+Checks keep-alive reuse, that HTTP errors surface as urllib.error.HTTPError
+(as urlopen() callers expect) and that connections past their lifetime are
+retired, that cancelling a task or a CancelToken aborts a stalled stream
+promptly, that deadlines bound a whole request (also from the CLI's
+--deadline), and that the concurrency semaphore caps requests in flight.
+"""
+
+import asyncio
+import json
+import sys
+import threading
+import time
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "bench"))
+
+from async_client import AsyncClient, AsyncConnectionPool, CancelToken, iter_sync  # noqa: E402
+from mock_openai import MockConfig, MockOpenAI  # noqa: E402
+from promptopt import build_parser, run  # noqa: E402
+
+_state = {"active": 0, "peak": 0}
+_lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        if self.path == "/stall":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            event = b'data: {"choices":[{"delta":{"content":"hi"}}]}\n\n'
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            self.wfile.flush()
+            time.sleep(3)
+            return
+        with _lock:
+            _state["active"] += 1
+            _state["peak"] = max(_state["peak"], _state["active"])
+        time.sleep(0.1 if self.path == "/slow" else 0)
+        with _lock:
+            _state["active"] -= 1
+        status = 429 if self.path == "/limited" else 200
+        body = json.dumps({"ok": status == 200}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+
+def test_reuse_and_semaphore_caps_in_flight_requests():
+    httpd, base = _server()
+
+    async def go():
+        client = AsyncClient(max_concurrency=2)
+        results = await asyncio.gather(*[client.post_json(f"{base}/slow", {}, {}, 5) for _ in range(6)])
+        assert all(r["ok"] for r in results)
+        await client.post_json(f"{base}/fast", {}, {}, 5)
+        return client.pool.stats()
+
+    try:
+        stats = asyncio.run(go())
+        assert _state["peak"] <= 2
+        assert stats["new"] == 2 and stats["reused"] == 5
+    finally:
+        httpd.shutdown()
+
+
+def test_http_error_keeps_connection_and_lifetime_retires_it():
+    httpd, base = _server()
+
+    async def go(max_lifetime):
+        client = AsyncClient(pool=AsyncConnectionPool(max_lifetime=max_lifetime))
+        try:
+            await client.post_json(f"{base}/limited", {}, {}, 5)
+            raise AssertionError("expected HTTPError")
+        except urllib.error.HTTPError as e:
+            assert e.code == 429 and json.loads(e.read())["ok"] is False
+        assert (await client.post_json(f"{base}/fast", {}, {}, 5))["ok"]
+        return client.pool.stats()
+
+    try:
+        assert asyncio.run(go(300.0))["reused"] == 1
+        stats = asyncio.run(go(0.0))
+        assert stats["new"] == 2 and stats["reused"] == 0
+    finally:
+        httpd.shutdown()
+
+
+def test_task_cancel_and_deadline_abort_stalled_stream():
+    httpd, base = _server()
+
+    async def first_then_cancel():
+        client = AsyncClient()
+        got = []
+
+        async def consume():
+            async for ev in client.stream_events(f"{base}/stall", {}, {}, 10):
+                got.append(ev.text)
+
+        task = asyncio.ensure_future(consume())
+        while not got:
+            await asyncio.sleep(0.01)
+        t0 = time.monotonic()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return got, time.monotonic() - t0, client.pool.stats()["idle"]
+
+    async def deadline():
+        client = AsyncClient()
+        t0 = time.monotonic()
+        try:
+            async for _ in client.stream_events(f"{base}/stall", {}, {}, 10, deadline_sec=0.3):
+                pass
+        except TimeoutError:
+            return time.monotonic() - t0
+        raise AssertionError("expected TimeoutError")
+
+    try:
+        got, cancel_secs, idle = asyncio.run(first_then_cancel())
+        assert got == ["hi"] and cancel_secs < 0.5 and idle == 0
+        assert asyncio.run(deadline()) < 1.0
+    finally:
+        httpd.shutdown()
+
+
+def test_cancel_token_stops_blocking_iteration():
+    httpd, base = _server()
+    token = CancelToken()
+    pieces = []
+    try:
+        stream = AsyncClient().stream_events(f"{base}/stall", {}, {}, 10)
+        threading.Timer(0.3, token.cancel).start()
+        t0 = time.monotonic()
+        for ev in iter_sync(stream, cancel=token):
+            pieces.append(ev.text)
+        assert pieces == ["hi"]
+        assert time.monotonic() - t0 < 1.5
+    finally:
+        httpd.shutdown()
+
+
+def test_cli_deadline_bounds_each_call(tmp_path):
+    (tmp_path / "sys.txt").write_text("Optimize the prompt.", encoding="utf-8")
+    (tmp_path / "in.txt").write_text("sort a list", encoding="utf-8")
+    argv = ["--system-prompt-file", str(tmp_path / "sys.txt"), "--user-input-file", str(tmp_path / "in.txt"),
+            "--output-file", str(tmp_path / "out.txt"), "--api-key", "sk-test", "--model", "m/a", "--stream", "--deadline", "0.5"]
+    with MockOpenAI(MockConfig(tokens=20, stall_after=2, stall=3)) as mock:
+        result = {}
+        t0 = time.monotonic()
+        assert run(build_parser().parse_args(argv + ["--base-url", mock.base_url]), result=result) == 1
+        assert time.monotonic() - t0 < 2.0 and "deadline exceeded" in result["error"]
@@ -0,0 +1,52 @@
+"""
+Offline benchmark harness tests.
+
+Checks that the mock server answers JSON and SSE requests with the stage
+shapes Agent Mode expects, injects errors and stalls, and that one
+end-to-end benchmark run writes comparable JSON results.
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "bench"))
+
+import pytest  # noqa: E402
+
+from bench_e2e import compare, main as bench_main  # noqa: E402
+from mock_openai import MockConfig, MockOpenAI  # noqa: E402
+from promptopt import extract_output_text, try_call, try_stream  # noqa: E402
+
+
+def test_mock_server_json_sse_errors_and_stalls():
+    with MockOpenAI(MockConfig(tokens=5, errors={"m/down": 429}, stall_after=2, stall=0.3)) as mock:
+        text = extract_output_text(try_call(mock.base_url, "m/a", "sys", "hello", "sk-test", 5))
+        t0 = time.monotonic()
+        streamed = "".join(try_stream(mock.base_url, "m/a", "sys", "hello", "sk-test", 5))
+        assert streamed == text and len(text.split()) == 5
+        assert time.monotonic() - t0 >= 0.3
+        analysis = extract_output_text(try_call(mock.base_url, "m/a", "sys", "## REQUIRED OUTPUT (JSON)\n{}", "sk-test", 5))
+        assert json.loads(analysis.split("```json")[1].split("```")[0])["task_type"] == "coding"
+        with pytest.raises(ValueError, match="HTTP 429: Rate limit exceeded"):
+            try_call(mock.base_url, "m/down", "sys", "hello", "sk-test", 5)
+        assert mock.status_counts == {200: 3, 429: 1}
+
+
+def test_bench_run_writes_results_and_compares(tmp_path, capsys):
+    out = tmp_path / "bench.json"
+    assert bench_main(["--modes", "standard", "--runs", "1", "--no-warmup", "--tokens", "8", "--json", str(out)]) == 0
+    results = json.loads(out.read_text(encoding="utf-8"))
+    standard = results["modes"]["standard"]
+    assert standard["exit_codes"] == [0] and standard["output_bytes"] > 0
+    assert 0 < standard["ttfb_ms"]["median"] <= standard["wall_ms"]["median"]
+    assert results["mock"]["tokens"] == 8
+
+    slower = json.loads(json.dumps(results))
+    slower["modes"]["standard"]["wall_ms"]["median"] *= 2
+    rows = {(mode, metric): pct for mode, metric, _, _, pct in compare(slower, results)}
+    assert rows[("standard", "wall_ms")] == pytest.approx(100.0)
+    assert "standard" in capsys.readouterr().out
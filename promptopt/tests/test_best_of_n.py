@@ -0,0 +1,94 @@
+"""
+Best-of-N Final Assembly tests.
+
+Checks that N candidates are generated and scored concurrently, that the
+tournament passes the best one on as `final` (keeping every candidate in the
+output), that a failing winner still goes to the rewrite, and that an
+end-to-end run with candidates takes about as long as a single pass.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "bench"))
+
+from agent_pipeline import SectionWriter, StageGraphRunner, build_graph  # noqa: E402
+from mock_openai import FINAL_PROMPT, MockConfig, MockOpenAI  # noqa: E402
+from promptopt import run_agent_mode  # noqa: E402
+from stage_routing import router_from_config  # noqa: E402
+
+GOOD = FINAL_PROMPT.format(body="Sort the list in place.")
+WEAK = "Here is a prompt: sort things if possible, maybe in a reasonable way."
+
+
+class _ListSink:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+
+def _call(finals, evals=None, delay=0.05):
+    def call(stage, prompt, section):
+        time.sleep(delay)
+        if stage.key == "analysis":
+            raw = '{"task_type": "coding"}'
+        elif stage.key.startswith("final#"):
+            raw = finals[int(stage.key[6:]) - 1]
+        elif stage.key.startswith("eval#"):
+            raw = evals[int(stage.key[5:]) - 1]
+        else:
+            raw = f"{stage.key}-out"
+        section.write(raw)
+        return raw
+    return call
+
+
+def test_local_tournament_picks_the_best_candidate_concurrently():
+    stages = build_graph("sequential", enable_eval=True, candidates=3)
+    assert [st.key for st in stages if "#" in st.key] == ["final#1", "eval#1", "final#2", "eval#2", "final#3", "eval#3"]
+    assert [st.profile.temperature for st in stages if st.key.startswith("final#")] == [0.2, 0.6, 1.0]
+
+    sink = _ListSink()
+    runner = StageGraphRunner(stages, _call([WEAK, GOOD, WEAK]), SectionWriter(sink), total=5)
+    ctx = runner.run({"input": "x"})
+    assert ctx["final"] == GOOD
+    assert sorted(runner.local) == ["eval#1", "eval#2", "eval#3", "tournament"]
+    t = runner.timings
+    assert t["final#3"].start < t["final#1"].end  # generated side by side
+    assert runner.skipped == ["rewrite"]
+    out = "".join(sink.parts)
+    assert out.count(WEAK) == 2 and "Winner: Final Assembly 2/3 (t=0.6)" in out
+
+
+def test_model_scored_losing_winner_goes_to_rewrite():
+    evals = ['{"overall_score": 2.0, "pass": false, "suggested_fixes": ["a"]}',
+             '{"overall_score": 3.5, "pass": false, "suggested_fixes": ["b"]}']
+    runner = StageGraphRunner(build_graph("parallel", enable_eval=True, candidates=2, scorer="model"),
+                              _call([WEAK, WEAK + " v2"], evals, delay=0.0), SectionWriter(_ListSink()), total=5)
+    ctx = runner.run({"input": "x"})
+    assert ctx["final"] == WEAK + " v2" and '"b"' in ctx["feedback"]
+    assert ctx["rewrite"] == "rewrite-out" and "tournament" in runner.local
+    # Candidates route as `final` unless given their own model
+    router = router_from_config("m/job", ["final=m/a", "4#2=m/b"])
+    assert router.route("final#1").models == ["m/a", "m/job"] and router.route("final#2").models == ["m/b", "m/job"]
+
+
+def test_best_of_n_costs_about_one_pass(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPTOPT_AGENT_CHECKPOINT", "0")
+    walls, result = [], {}
+    with MockOpenAI(MockConfig(ttfb=0.15, token_delay=0.003, tokens=40)) as mock:
+        for n in (1, 4):
+            start = time.monotonic()
+            code = run_agent_mode("sort a list", "m/n", mock.base_url, "sk-test", str(tmp_path / f"out{n}.txt"), 5, candidates=n, result=result)
+            walls.append(time.monotonic() - start)
+            assert code == 0
+    text = (tmp_path / "out4.txt").read_text(encoding="utf-8")
+    assert text.count('<STAGE name="Final Assembly ') == 4 and '<STAGE name="Tournament">' in text
+    assert result["candidate"] == 1
+    # Three more sequential Stage 4 calls would add ~0.9s
+    assert walls[1] < walls[0] + 0.45
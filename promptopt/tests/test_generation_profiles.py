@@ -0,0 +1,88 @@
+"""
+Per-stage generation profile tests against the local mock server.
+
+Checks that a stage's max_tokens, stop sequences and JSON mode reach the
+request, that a model refusing one of them by name is retried without it
+for the rest of that run only, that a stage cut off at its cap is retried
+without the cap, and that a JSON stage whose answer does not parse gets
+one repair call.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "bench"))
+
+from agent_pipeline import FENCE_STOP, PROFILES, GenerationProfile, build_graph  # noqa: E402
+from mock_openai import MockConfig, MockOpenAI  # noqa: E402
+from promptopt import build_chat_request, call_api_simple, rejected_params, run_agent_mode  # noqa: E402
+from tracing import Tracer  # noqa: E402
+
+
+def test_profiles_reach_the_request_and_fall_back_when_rejected(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPTOPT_AGENT_CHECKPOINT", "0")
+    graph = {st.key: st for st in build_graph("sequential", enable_eval=True, profiles=True)}
+    assert graph["analysis"].profile.json_mode and not graph["final"].profile.json_mode
+    assert build_graph("sequential")[0].profile is None
+    _, payload, _ = build_chat_request("http://127.0.0.1:1/v1", "m/a", "s", "u", "sk-test", params=PROFILES["eval"].params())
+    assert payload["max_tokens"] == 1000 and payload["stop"] == [FENCE_STOP] and payload["response_format"] == {"type": "json_object"}
+
+    with MockOpenAI(MockConfig(tokens=20, ramble=8)) as mock:
+        # The stop sequence drops the prose after the fence; max_tokens truncates
+        fenced = call_api_simple(mock.base_url, "m/a", "s", "## REQUIRED OUTPUT (JSON)", "sk-test", params={"stop": [FENCE_STOP]})
+        assert fenced.endswith("}\n```") or fenced.endswith("}")
+        assert len(call_api_simple(mock.base_url, "m/a", "s", "hi", "sk-test", params={"max_tokens": 5}).split()) == 5
+
+    params = PROFILES["analysis"].params()
+    assert rejected_params(ValueError("HTTP 400: Unsupported parameter: 'max_tokens'"), params) == ["max_tokens"]
+    assert rejected_params(ValueError("HTTP 422: response_format json_object is not supported"), params) == ["response_format"]
+    for other in ("HTTP 400: This model's maximum context length is 8192 tokens", "HTTP 400: Bad gateway", "HTTP 500: stop"):
+        assert rejected_params(ValueError(other), params) == []
+
+    with MockOpenAI(MockConfig(tokens=5, reject_params=True)) as mock:
+        for run in (1, 2):
+            code = run_agent_mode("sort a list", "m/no-params", mock.base_url, "sk-test", str(tmp_path / "out.txt"), 5)
+            assert code == 0
+            # Stage 1 learns each refused param once (the mock names one per error); later stages go without.
+            # The next run, e.g. in the daemon, starts over
+            assert mock.status_counts.get(400) == 3 * run
+
+
+def test_stage_cut_off_at_its_cap_is_retried_without_it(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPTOPT_AGENT_CHECKPOINT", "0")
+    monkeypatch.setitem(PROFILES, "clarified", GenerationProfile(max_tokens=10))
+    out = tmp_path / "out.txt"
+
+    def clarification() -> str:
+        return out.read_text(encoding="utf-8").split('<STAGE name="Clarification">\n')[1].split("\n</STAGE>")[0]
+
+    for streaming in (False, True):
+        with MockOpenAI(MockConfig(tokens=20)) as mock:
+            assert run_agent_mode("sort a list", "m/a", mock.base_url, "sk-test", str(out), 5, streaming=streaming) == 0
+            requests = mock.status_counts[200]
+        # Non-streaming: the capped answer stops at "length" and is asked again without the cap.
+        # Streaming: the stage is sent without a cap, since its text is already on screen
+        assert len(clarification().split()) == 20
+        assert requests == (5 if not streaming else 4)
+
+
+def test_unparseable_json_stage_gets_one_repair_call(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPTOPT_AGENT_CHECKPOINT", "0")
+    monkeypatch.setenv("PROMPTOPT_AGENT_LOCAL_EVAL", "0")
+    tracer = Tracer(str(tmp_path / "trace.jsonl"))
+    run = tracer.start_run(mode="agent")
+    out = tmp_path / "out.txt"
+    with MockOpenAI(MockConfig(tokens=5, bad_json=True)) as mock:
+        code = run_agent_mode("sort a list", "m/json", mock.base_url, "sk-test", str(out), 5, enable_eval=True, trace=run)
+    run.end()
+    assert code == 0
+
+    text = out.read_text(encoding="utf-8")
+    assert '<STAGE name="Goal Extraction (JSON repair)">' in text and '<STAGE name="Self-Eval (JSON repair)">' in text
+    spans = [json.loads(line) for line in (tmp_path / "trace.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert spans[-1]["json_repaired"] == ["analysis", "eval"]
+    # Stage 3 was built for the repaired task_type, not the "other" fallback
+    assert "coding" in text.split('<STAGE name="Structure">')[0]
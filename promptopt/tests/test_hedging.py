@@ -0,0 +1,56 @@
+"""
+HedgedRace tests with in-process contenders (no network).
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from hedging import HedgedRace  # noqa: E402
+
+
+def _slow(delay, text, seen=None):
+    def start(token):
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline:
+            if token.cancelled:
+                if seen is not None:
+                    seen.set()
+                return
+            time.sleep(0.005)
+        yield text
+    return start
+
+
+def _fail(token):
+    raise ValueError("HTTP 429: rate limited")
+    yield  # pragma: no cover
+
+
+def test_hedge_delay_launches_fallback_and_cancels_primary():
+    cancelled = threading.Event()
+    race = HedgedRace([("primary", _slow(2.0, "late", cancelled)), ("fallback", _slow(0.0, "fast"))], hedge_delay=0.05)
+    assert "".join(race) == "fast"
+    assert race.winner.label == "fallback"
+    assert cancelled.wait(1.0)
+
+
+def test_failed_primary_falls_through_without_waiting_for_delay():
+    race = HedgedRace([("primary", _fail), ("fallback", _slow(0.0, "ok"))], hedge_delay=30.0)
+    started = time.monotonic()
+    assert "".join(race) == "ok"
+    assert time.monotonic() - started < 5.0
+    assert "primary failed" in race.report()
+
+
+def test_all_failures_reraise_last_error():
+    race = HedgedRace([("a", _fail), ("b", _fail)], launch_now=2)
+    try:
+        list(race)
+        raise AssertionError("expected ValueError")
+    except ValueError as e:
+        assert "429" in str(e)
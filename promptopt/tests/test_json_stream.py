@@ -0,0 +1,62 @@
+"""
+Streaming JSON field extractor tests.
+
+Checks that fields surface as soon as their values complete regardless of
+how the text is split, and that fences, trailing prose, undecodable values
+and truncated output do not lose the fields that did decode.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from json_stream import JSONFieldStream, extract_json_fields  # noqa: E402
+
+OBJ = {
+    "primary_goal": 'Parse {dates} with "quotes", commas and \\ escapes',
+    "task_type": "coding",
+    "score": 4.5,
+    "pass": True,
+    "nested": {"a": [1, {"b": "]}"}], "c": None},
+    "fixes": [],
+}
+
+
+def test_fields_surface_in_order_for_any_split():
+    raw = "Sure! Here is the analysis:\n```json\n" + json.dumps(OBJ, indent=2) + "\n```\nLet me know if {anything} else."
+    for step in (1, 3, 7, len(raw)):
+        stream = JSONFieldStream()
+        order = []
+        for i in range(0, len(raw), step):
+            order.extend(stream.feed(raw[i:i + step]))
+        assert stream.fields == OBJ and stream.complete and not stream.errors
+        assert order == list(OBJ)
+
+    # task_type is available as soon as its closing quote arrives
+    stream = JSONFieldStream()
+    cut = raw.index('"coding"') + len('"coding"')
+    assert stream.feed(raw[:cut]) == {"primary_goal": OBJ["primary_goal"], "task_type": "coding"}
+
+
+def test_malformed_and_truncated_output_keeps_decoded_fields():
+    bad = extract_json_fields('{"task_type": "qa", "score": 4..5, "list": [1, 2,], "pass": false, "tail": "unterminated')
+    assert bad.fields == {"task_type": "qa", "pass": False}
+    assert bad.errors == ["score", "list"] and not bad.complete
+    assert extract_json_fields("no json here").fields == {}
+    assert extract_json_fields('{"a": 1,}').fields == {"a": 1}
+
+
+def test_braces_in_leading_prose_do_not_hide_the_object():
+    raw = 'I kept {dates}, {"name"} and { x } as written.\n```json\n' + json.dumps(OBJ) + "\n```"
+    for step in (1, 4, len(raw)):
+        stream = JSONFieldStream()
+        for i in range(0, len(raw), step):
+            stream.feed(raw[i:i + step])
+        assert stream.fields == OBJ and stream.complete and not stream.errors
+
+    # A whole response prefers the object that opens a line over an inline example
+    inline = 'The shape is {"k": 1} per field.\n```json\n{"task_type": "qa"}\n```'
+    assert extract_json_fields(inline).fields == {"task_type": "qa"}
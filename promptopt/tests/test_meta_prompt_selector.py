@@ -0,0 +1,190 @@
+"""
+Meta-prompt selector matcher tests.
+
+Checks the compiled single-pass matcher: it counts keywords exactly like
+`str.count`, and its scores match the per-meta-prompt methods while a large
+log is scanned once. Checks the pickled index is reused until selector.json
+changes. Checks large inputs are scored from windows sampled across the
+text, and that such a sample can pick differently from a full scan when
+the signal sits only in windows it did not read. Checks batch scoring
+reproduces the scalar scores (skipped without NumPy). Checks a model
+trained on recorded menu choices skips the menu only where it is
+confident.
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from meta_prompt_selector import (INDEX_FILE, WINDOW_CHARS, KeywordAutomaton, MetaPromptSelector,  # noqa: E402
+                                  build_index_report, score_corpus, spread_order, text_windows)
+from selector_learn import LinearModel, SelectionLearner, open_learner, text_features  # noqa: E402
+
+META_PROMPT_DIR = REPO_ROOT.parent / "meta-prompts"
+
+TEXTS = [
+    "Refactor this Python function: ```def f(x):\n    return x```",
+    "Summarize the main points from https://example.com/post and extract the key points from the page.",
+    "Rewrite this email to make it more professional and change tone.",
+    "Based on documents retrieved: {{context}} answer using context from the knowledge base.",
+    "Use tool calls step-by-step: think then act, then call function and run.",
+    "RelaceEditTool: insert a line in the function block, minimal diff, json edit payload.",
+    "\u017fcrape this page\n\u017fcrape that site",  # long s matches "s" under IGNORECASE
+    "c++c++ unit test test testtest pypy __init__ @decorator <CODE>x</code> İstanbul DJANGO",
+    "   \n\t  ",
+    "plan",
+]
+LOG = "\n".join(f"2026-10-17 12:{i % 60:02d}:00 INFO worker-{i % 7} processed batch {i} in {i % 13} ms (queue ok)"
+                for i in range(4000))
+
+
+def test_automaton_counts_like_str_count():
+    keywords = ["aa", "a", "test", "unit test", "py", "python", "c++"]
+    automaton = KeywordAutomaton(keywords)
+    for text in ["aaaaa", "unit test unit testtest", "python py pypy", "c++c++c+", ""]:
+        counts = automaton.count(text)
+        assert {kw: text.count(kw) for kw in keywords if text.count(kw)} == counts
+    assert KeywordAutomaton([]).count("anything") == {}
+
+
+def test_compiled_scores_match_per_prompt_scoring():
+    selector = MetaPromptSelector(str(META_PROMPT_DIR))
+    for text in TEXTS + [LOG, TEXTS[0] + LOG + TEXTS[1]]:
+        hits = selector.matcher.scan(text)
+        for mp in selector.meta_prompts:
+            assert abs(mp.score_hits(hits) - mp.score(text)) < 1e-12, (mp.id, text[:40])
+    assert selector.select(TEXTS[0])["id"].startswith("coding")
+
+
+def test_large_log_is_scanned_once_for_all_meta_prompts(monkeypatch):
+    selector = MetaPromptSelector(str(META_PROMPT_DIR))
+    legacy = {mp.id: mp.score(LOG) for mp in selector.meta_prompts}
+    scans = []
+    scan = selector.matcher.scan
+    monkeypatch.setattr(selector.matcher, "scan", lambda text: scans.append(len(text)) or scan(text))
+    for mp in selector.meta_prompts:
+        monkeypatch.setattr(mp, "score", None)  # the per-prompt rescans must not run
+    compiled = {mp.id: score for mp, score in selector.score_all(LOG)}
+    assert compiled == legacy and scans == [len(LOG)]
+
+
+def test_index_is_reused_until_definitions_change(tmp_path, capsys):
+    shutil.copy(META_PROMPT_DIR / "selector.json", tmp_path)
+    definitions = tmp_path / "selector.json"
+    built = MetaPromptSelector(str(tmp_path))
+    assert built.index_status == "built" and (tmp_path / INDEX_FILE).exists()
+    cached = MetaPromptSelector(str(tmp_path))
+    assert cached.index_status == "hit"
+    assert cached.select(TEXTS[0]) == built.select(TEXTS[0])
+
+    stat = definitions.stat()
+    os.utime(definitions, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert MetaPromptSelector(str(tmp_path)).index_status == "hit (hash)"
+    assert MetaPromptSelector(str(tmp_path)).index_status == "hit"
+
+    definitions.write_text(definitions.read_text(encoding="utf-8").replace('"weight": 0.9', '"weight": 0.5'), encoding="utf-8")
+    changed = MetaPromptSelector(str(tmp_path))
+    assert changed.index_status == "built" and changed.meta_prompts[0].weight == 0.5
+
+    (tmp_path / INDEX_FILE).write_bytes(b"not a pickle")
+    assert MetaPromptSelector(str(tmp_path)).index_status == "built"
+    assert build_index_report(str(tmp_path)) == 0
+    assert "13 meta-prompts" in capsys.readouterr().out
+
+
+def test_large_inputs_are_scored_from_spread_windows():
+    assert spread_order(9) == [0, 8, 4, 2, 6, 1, 3, 5, 7] and spread_order(1) == [0]
+    spans = text_windows(LOG, 1000)
+    assert "".join(LOG[a:b] for a, b in spans) == LOG
+    assert all(LOG[b - 1].isspace() for a, b in spans[:-1])
+
+    selector = MetaPromptSelector(str(META_PROMPT_DIR))
+    # The only signal is at the very end: a prefix scan would miss it
+    text = LOG * 2 + "\n" + TEXTS[1]
+    scored, scanned = selector.score_stream(text)
+    assert scanned < 0.1
+    assert scored[0][0].id == selector.score_all(text)[0][0].id == "browser-meta"
+    assert selector.select(text * 4)["scanned"] < 0.03
+    assert selector.select(TEXTS[1])["scanned"] == 1.0
+
+
+def test_sampled_pick_can_differ_from_the_full_scan():
+    # 40 one-window blocks: browser text in the five windows read first, email-rewrite text in the rest
+    read_first = set(spread_order(40)[:5])
+    blocks = [((TEXTS[1] if i in read_first else TEXTS[2]) + "\n" + LOG)[:WINDOW_CHARS - 1] + "\n" for i in range(40)]
+    text = "".join(blocks)
+    assert len(text_windows(text)) == 40
+
+    selector = MetaPromptSelector(str(META_PROMPT_DIR))
+    scored, scanned = selector.score_stream(text)
+    full = selector.score_all(text)
+    assert scanned < 0.1 and scored[0][0].id == "browser-meta" and full[0][0].id == "browser-edit"
+    # Neither margin clears SCORE_GAP, so both show the menu rather than auto-selecting the wrong one
+    assert not selector.select(text)["auto_selected"]
+
+    selector.stream_min_chars = 0  # always score the whole text
+    assert selector.score_stream(text) == (full, 1.0)
+
+
+def test_batch_scores_match_the_scalar_path_exactly(tmp_path, capsys):
+    pytest.importorskip("numpy")
+    selector = MetaPromptSelector(str(META_PROMPT_DIR), {"stream_min_chars": 0})
+    rng = random.Random(7)
+    vocab = [kw for mp in selector.meta_prompts for kw in mp.keywords] + ["the", "please", "https://x.io", "```x```", "{{q}}", "before", "\n"]
+    texts = TEXTS + [LOG] + [" ".join(rng.choice(vocab) for _ in range(rng.randint(0, 80))) for _ in range(200)]
+    scores, ids = selector.score_batch(texts)
+    assert scores.shape == (len(texts), len(selector.meta_prompts))
+    assert scores.tolist() == [[mp.score(text) for mp in selector.meta_prompts] for text in texts]
+    assert ids == [selector.select(text)["id"] for text in texts]
+
+    corpus = tmp_path / "corpus.jsonl"
+    corpus.write_text("".join(json.dumps({"text": text}) + "\n" for text in TEXTS[:3]), encoding="utf-8")
+    assert score_corpus(str(META_PROMPT_DIR), None, str(corpus), str(tmp_path / "out.jsonl")) == 0
+    results = [json.loads(line) for line in (tmp_path / "out.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [r["id"] for r in results] == ids[:3] and "scored 3 texts" in capsys.readouterr().err
+
+
+def test_learned_model_skips_menus_it_is_confident_about(tmp_path, monkeypatch):
+    features = text_features("Fix the quarterly report.\n```x```")
+    assert features == text_features("Fix the quarterly report.\n```x```")
+    assert abs(sum(v * v for v in features.values()) - 1) < 1e-9
+    monkeypatch.delenv("PROMPTOPT_SELECTOR_LEARN", raising=False)
+    assert open_learner() is None
+    unrecorded = SelectionLearner(str(tmp_path / "menus.jsonl"))
+    unrecorded.log_selection({"id": "general-meta", "reason": "ambiguous", "auto_selected": False})
+    assert "record each with --record-choice ID" in unrecorded.report()
+
+    selector = MetaPromptSelector(str(META_PROMPT_DIR))
+    # Texts the heuristic cannot tell apart, but this user always picks the same prompt for each topic
+    topics = {"writing-meta": "quarterly invoice ledger reconciliation memo",
+              "rag-meta": "glacier sediment core isotope survey"}
+    learner = SelectionLearner(str(tmp_path / "history.jsonl"))
+    rng = random.Random(3)
+    for i in range(40):
+        chosen = list(topics)[i % 2]
+        text = " ".join(rng.sample(topics[chosen].split(), 4)) + f" item {i}"
+        learner.record_choice(text, selector.score_all(text), chosen)
+    assert "features" in learner.records()[0] and "quarterly" not in (tmp_path / "history.jsonl").read_text(encoding="utf-8")
+
+    pytest.importorskip("numpy")
+    model = learner.train([mp.id for mp in selector.meta_prompts])
+    assert model.stats["train_ms"] < 2000 and model.stats["held_out_accuracy"] == 1.0
+    assert LinearModel.load(learner.model_path).predict(features, {})[0] in topics
+
+    text = "isotope survey of the glacier sediment core"
+    assert not selector.select(text)["auto_selected"]
+    selector.learner = SelectionLearner(str(tmp_path / "history.jsonl"))
+    result = selector.select(text)
+    assert result["reason"] == "learned" and result["id"] == "rag-meta" and result["learned_confidence"] >= 0.8
+    assert not selector.select(text, force_menu=True)["auto_selected"]
+    selector.learner.log_selection(result)
+    selector.learner.log_selection({"id": "general-meta", "reason": "ambiguous", "auto_selected": False})
+    assert "menus avoided by the learned model: 1 of 2 (50%)" in selector.learner.report()
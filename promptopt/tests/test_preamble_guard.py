@@ -0,0 +1,75 @@
+"""
+Streaming preamble guard tests.
+
+Checks that the guard releases clean output as soon as it can tell it is
+not a preamble, strips a preamble line without ever emitting it, aborts in
+retry mode, keeps (and only flags) content lines that start with an opener
+word, and that a standard-mode streaming run against the mock server
+cancels a preamble stream and retries with the corrected instruction.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "bench"))
+
+from mock_openai import MockConfig, MockOpenAI  # noqa: E402
+from preamble_guard import PreambleGuard, strip_preamble  # noqa: E402
+from promptopt import build_parser, run  # noqa: E402
+
+
+def _feed(guard, text, step=3):
+    emitted = [guard.feed(text[i:i + step]) for i in range(0, len(text), step)]
+    return emitted + [guard.finish()]
+
+
+def test_guard_strips_or_aborts_before_anything_is_emitted():
+    clean = PreambleGuard()
+    assert clean.feed("# Ro") == "# Ro" and clean.feed("le") == "le"
+    assert "".join(_feed(PreambleGuard(), "  Her", 2)) == "Her"  # a short answer that only looked like a preamble
+    assert "".join(_feed(PreambleGuard(), "Heroes win.")) == "Heroes win."
+
+    guard = PreambleGuard()
+    out = _feed(guard, "Here is the optimized prompt:\n\n---\n\n# Role\nYou are a tester.")
+    assert "".join(out) == "# Role\nYou are a tester." and guard.verdict == "stripped"
+    assert not any("Here" in piece or "---" in piece for piece in out)
+
+    retry = PreambleGuard(mode="retry")
+    assert not any(_feed(retry, "Sure! Below is a prompt.\n\n# Role")) and retry.abort
+
+
+def test_content_that_starts_with_an_opener_word_is_kept():
+    for text in ("Absolutely no network calls are allowed.\nStep 2",
+                 "Absolutely no network calls are allowed.\n\nStep 2",
+                 "Certainly-not-optional fields must be set.\n\n1. id",
+                 "Sure-footed agents check every path.\n\n---\nrest",
+                 "Of course means the default path:\n1. parse",
+                 "Here is the list:\n# Role",
+                 "Here is " + "a very long first line " * 20 + ".\n\nbody"):
+        guard = PreambleGuard(mode="retry")
+        assert "".join(_feed(guard, text)) == text and not guard.abort
+        assert guard.verdict == "flagged" and text.startswith(guard.flagged)
+        assert strip_preamble(text) == text
+    surely = PreambleGuard()
+    assert "".join(_feed(surely, "Surely valid.\n\nx")) == "Surely valid.\n\nx" and surely.verdict == "clean"
+
+
+def test_stream_with_preamble_is_cancelled_and_retried(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPTOPT_PREAMBLE_GUARD", "retry")
+    (tmp_path / "sys.txt").write_text("Optimize the prompt.", encoding="utf-8")
+    (tmp_path / "in.txt").write_text("sort a list", encoding="utf-8")
+    out, trace = tmp_path / "out.txt", tmp_path / "trace.jsonl"
+    with MockOpenAI(MockConfig(tokens=8, token_delay=0.02, preamble="Here is the optimized prompt:\n\n")) as mock:
+        args = build_parser().parse_args(["--system-prompt-file", str(tmp_path / "sys.txt"), "--user-input-file", str(tmp_path / "in.txt"),
+                                          "--output-file", str(out), "--api-key", "sk-test", "--base-url", mock.base_url,
+                                          "--model", "m/chatty", "--stream", "--trace", str(trace)])
+        assert run(args) == 0
+        assert mock.status_counts[200] == 2
+    text = out.read_text(encoding="utf-8")
+    assert text and not text.startswith("Here")
+    spans = [json.loads(line) for line in trace.read_text(encoding="utf-8").splitlines()]
+    assert spans[-1]["preamble"] == "retry"
+    assert [s["outcome"] for s in spans if s["kind"] == "http"] == ["cancelled", "ok"]
@@ -0,0 +1,110 @@
+"""
+Local Stage 5 pre-evaluator tests (no network).
+
+Checks that prompt_lint scores a well-formed prompt as a clear pass and a
+sloppy one as a clear fail with fixes, in Stage 5's JSON schema, that the
+self-eval stage only calls the model for borderline prompts, and that the
+shared preamble rules differ between the lint and dspy_prompt_opt only on a
+leading markdown heading.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+import pytest  # noqa: E402
+from agent_pipeline import SectionWriter, StageGraphRunner, build_graph  # noqa: E402
+from prompt_lint import check_preamble, lint_prompt, local_verdict  # noqa: E402
+
+GOOD = """# Role
+You are a senior Python engineer.
+
+## Requirements
+1. Parse ISO 8601 dates with `datetime.fromisoformat`.
+2. Raise `ValueError` on invalid input; you may not use third-party libraries.
+3. Run in O(n) time for n characters.
+
+## Output Format
+Return one Python code block, then a bullet list of edge cases.
+
+Example:
+```python
+parse("2024-01-01")
+```
+
+## Edge Cases
+- If the input is empty, raise ValueError("empty input").
+"""
+
+SLOPPY = "Here is your prompt: write something appropriate about [TOPIC], if possible.\n\nLet me know if you want changes!"
+
+BORDERLINE = """You are a writing assistant.
+
+## Requirements
+1. Write a short story with a reasonable length.
+2. Use natural dialogue if possible.
+
+## Output Format
+Plain prose.
+"""
+
+
+class _Sink:
+    def write(self, text):
+        pass
+
+
+def test_lint_scores_in_stage5_schema():
+    good = lint_prompt(GOOD)
+    assert set(good) == {"scores", "overall_score", "pass", "critical_issues", "suggested_fixes"}
+    assert set(good["scores"].values()) == {5} and good["pass"] and local_verdict(good) == "pass"
+
+    sloppy = lint_prompt(SLOPPY)
+    assert not sloppy["pass"] and local_verdict(sloppy) == "fail"
+    assert sloppy["scores"]["actionability"] == 1
+    assert any("[TOPIC]" in issue for issue in sloppy["critical_issues"])
+    assert "Start directly with the prompt content" in sloppy["suggested_fixes"]
+
+    middle = lint_prompt(BORDERLINE)
+    assert local_verdict(middle) is None
+    assert middle["scores"]["clarity"] == 4  # "if possible"
+
+
+def test_self_eval_calls_the_model_only_when_borderline():
+    for final, expect_calls, expect_rewrite in ((GOOD, [], False), (SLOPPY, [], True), (BORDERLINE, ["eval"], False)):
+        calls = []
+
+        def call(stage, prompt, section):
+            if stage.key in ("eval", "rewrite"):
+                calls.append(stage.key)
+            raw = {"final": final, "eval": '{"pass": true, "overall_score": 4.2}'}.get(stage.key, f"{stage.key}-out")
+            section.write(raw)
+            return raw
+
+        runner = StageGraphRunner(build_graph("sequential", enable_eval=True, local_eval=True), call, SectionWriter(_Sink()), total=5)
+        ctx = runner.run({"input": "x"})
+        assert [c for c in calls if c == "eval"] == expect_calls
+        assert runner.local == ([] if expect_calls else ["eval"])
+        assert ("rewrite" in ctx) == expect_rewrite
+        if expect_rewrite:
+            # The local fixes are the rewrite's feedback
+            assert json.loads(ctx["feedback"])["suggested_fixes"] == lint_prompt(SLOPPY)["suggested_fixes"]
+
+
+def test_preamble_rules_are_shared_with_the_formatter_check():
+    for text, why in ((None, "Output is None"), ("", "Output is empty"), (" x", "Output starts with whitespace"),
+                      ("Here is the prompt:", "Output starts with a preamble"), ("- item", "Output does not start with structured content")):
+        assert check_preamble(text) == check_preamble(text, markdown=False) == (False, why)
+    assert check_preamble(GOOD) == (True, "")
+    assert check_preamble(GOOD, markdown=False) == (False, "Output does not start with structured content")
+    assert check_preamble("<role>", markdown=False) == (True, "")
+
+
+def test_formatter_check_uses_the_shared_rules():
+    pytest.importorskip("dspy")
+    pytest.importorskip("dotenv")
+    from dspy_prompt_opt import validate_formatted_output
+    assert validate_formatted_output(GOOD) == check_preamble(GOOD, markdown=False)
@@ -0,0 +1,94 @@
+"""
+Batch mode tests with a fake job runner (no network).
+
+Checks per-item overrides reach the job, results stream to JSONL, a second
+run resumes by skipping items that already succeeded, and an interrupted
+run drops queued items but still saves the ones already running.
+"""
+
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from promptopt import build_parser  # noqa: E402
+import promptopt_batch  # noqa: E402
+from promptopt_batch import batch_main, percentile  # noqa: E402
+
+
+def _fake_run(calls):
+    def run_job(args, sys_prompt=None, user_input=None, result=None):
+        calls.append((user_input, args.model, args.agent_mode, sys_prompt))
+        if "fail" in user_input:
+            result["error"] = "Error: HTTP 429: rate limited"
+            return 2
+        body = f"optimized {user_input}"
+        if args.agent_mode:
+            body = f'<STAGE name="Goal Extraction">\n{{}}\n</STAGE>\n\n---FINAL---\n{body}'
+        Path(args.output_file).write_text(body, encoding="utf-8")
+        result["model"] = args.model
+        return 0
+    return run_job
+
+
+def test_batch_runs_items_and_resumes(tmp_path):
+    items = tmp_path / "items.jsonl"
+    items.write_text("\n".join(json.dumps(x) for x in [
+        {"id": "a", "input": "one"},
+        {"id": "b", "input": "two", "model": "m/override", "agent_mode": True},
+        {"id": "c", "input": "please fail", "system_prompt": "SYS"},
+    ]) + "\n", encoding="utf-8")
+    out = tmp_path / "out.jsonl"
+    calls = []
+    code = batch_main([str(items), "--out", str(out), "--concurrency", "2", "--model", "m/default"], _fake_run(calls), build_parser)
+    assert code == 1
+    recs = {r["id"]: r for r in map(json.loads, out.read_text(encoding="utf-8").splitlines())}
+    assert recs["a"]["status"] == "ok" and recs["a"]["model"] == "m/default"
+    assert recs["b"]["output"] == "optimized two" and recs["b"]["model"] == "m/override"
+    assert recs["c"]["status"] == "error" and "429" in recs["c"]["error"]
+    assert ("please fail", "m/default", False, "SYS") in calls
+
+    # Resume: only the failed item runs again
+    calls.clear()
+    batch_main([str(items), "--out", str(out), "--model", "m/default"], _fake_run(calls), build_parser)
+    assert [c[0] for c in calls] == ["please fail"]
+
+
+def test_directory_input_and_percentiles(tmp_path):
+    src = tmp_path / "lib"
+    (src / "sub").mkdir(parents=True)
+    (src / "x.md").write_text("first", encoding="utf-8")
+    (src / "sub" / "y.txt").write_text("second", encoding="utf-8")
+    out = tmp_path / "out.jsonl"
+    assert batch_main([str(src), "--out", str(out)], _fake_run([]), build_parser) == 0
+    ids = sorted(json.loads(line)["id"] for line in out.read_text(encoding="utf-8").splitlines())
+    assert ids == ["sub/y.txt", "x.md"]
+    vals = sorted(float(v) for v in range(1, 101))
+    assert percentile(vals, 50) == 50.0 and percentile(vals, 99) == 99.0
+
+
+def test_interrupt_saves_running_items_and_drops_queued_ones(tmp_path, monkeypatch):
+    started = threading.Event()
+    calls = []
+
+    def items(source):
+        yield {"id": "a", "input": "one"}
+        yield {"id": "b", "input": "two"}
+        started.wait(2)
+        raise KeyboardInterrupt
+
+    def run_job(args, sys_prompt=None, user_input=None, result=None):
+        started.set()
+        time.sleep(0.2)  # still running when the interrupt arrives
+        return _fake_run(calls)(args, sys_prompt, user_input, result)
+
+    monkeypatch.setattr(promptopt_batch, "iter_items", items)
+    out = tmp_path / "out.jsonl"
+    assert batch_main(["items.jsonl", "--out", str(out), "--concurrency", "1"], run_job, build_parser) == 130
+    recs = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    assert [(r["id"], r["status"]) for r in recs] == [("a", "ok")]
+    assert [c[0] for c in calls] == ["one"]
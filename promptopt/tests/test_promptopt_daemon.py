@@ -0,0 +1,72 @@
+"""
+Resident daemon tests.
+
+Checks that the thin client waits for the daemon to finish a job and exits
+with its status (so the bridge's clipboard and done handling run), that
+failed and crashed jobs come back with their error, that a job outliving
+the client's wait budget gets a 504 instead of holding the connection, and
+that the client loads none of the backend's modules.
+"""
+
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+import promptopt_client  # noqa: E402
+import promptopt_daemon  # noqa: E402
+from promptopt import build_parser  # noqa: E402
+
+
+def _run_job(args, sys_prompt, user_input, result):
+    if user_input == "stuck":
+        time.sleep(1.5)
+        return 0
+    if user_input == "crash":
+        raise RuntimeError("boom")
+    if user_input == "fail":
+        result["error"] = "Error: HTTP 401: bad key"
+        return 1
+    time.sleep(0.2)
+    Path(args.output_file).write_text(f"{sys_prompt}|{user_input}|{args.api_key}", encoding="utf-8")
+    return 0
+
+
+def test_client_waits_for_the_job_and_returns_its_status(tmp_path, monkeypatch, capsys):
+    state = str(tmp_path / "state.json")
+    monkeypatch.setattr(promptopt_client, "STATE_FILE", state)
+    monkeypatch.setattr(promptopt_daemon, "STATE_FILE", state)
+    assert promptopt_client.submit([], "s", "u", "k") is None  # no daemon advertised
+
+    threading.Thread(target=promptopt_daemon.serve, args=(_run_job, build_parser), kwargs={"port": 0}, daemon=True).start()
+    for _ in range(100):
+        if promptopt_client.read_state():
+            break
+        time.sleep(0.02)
+    (tmp_path / "sys.txt").write_text("sys", encoding="utf-8")
+    out = tmp_path / "out.txt"
+
+    def client(text):
+        (tmp_path / "in.txt").write_text(text, encoding="utf-8")
+        return promptopt_client.client_main(["--system-prompt-file", str(tmp_path / "sys.txt"), "--user-input-file", str(tmp_path / "in.txt"),
+                                             "--output-file", str(out), "--api-key", "sk-test"])
+
+    assert client("hello") == 0
+    assert out.read_text(encoding="utf-8") == "sys|hello|sk-test"  # written before the client returned
+    assert client("fail") == 1 and "HTTP 401: bad key" in capsys.readouterr().err
+    assert client("crash") == 1 and "Error: boom" in capsys.readouterr().err
+
+    start = time.monotonic()
+    assert promptopt_client.submit(["--output-file", str(out)], "s", "stuck", "k", wait_sec=0.3) == 1
+    assert time.monotonic() - start < 1.2 and "did not finish within 0.3s" in capsys.readouterr().err
+
+
+def test_client_does_not_load_the_backend():
+    code = ("import sys, promptopt_client; "
+            "print(sorted(m for m in ('promptopt', 'async_client', 'urllib.request', 'http.client') if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
@@ -0,0 +1,51 @@
+"""
+Response cache tests: chunk-preserving round trip, TTL expiry and LRU eviction.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from response_cache import ResponseCache, cache_key  # noqa: E402
+
+
+def test_key_ignores_stream_flag_but_not_model():
+    base = {"model": "a", "messages": [{"role": "user", "content": "x"}], "temperature": 0.2}
+    url = "https://example.invalid/v1/chat/completions"
+    assert cache_key(url, base) == cache_key(url, dict(base, stream=True))
+    assert cache_key(url, base) != cache_key(url, dict(base, model="b"))
+
+
+def test_round_trip_preserves_chunk_boundaries(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("k", ["Hel", "lo ", "wörld"])
+    assert cache.get("k") == ["Hel", "lo ", "wörld"]
+    assert cache.get("missing") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_sec=0.0)
+    cache.put("k", ["text"])
+    time.sleep(0.01)
+    assert cache.get("k") is None
+    assert not os.path.exists(tmp_path / "k.json")
+
+
+def test_lru_eviction_keeps_recently_used_entry(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=10_000)
+    cache.put("old", ["x" * 4000])
+    cache.put("hot", ["y" * 4000])
+    past = time.time() - 100
+    os.utime(tmp_path / "hot.json", (past, past))
+    os.utime(tmp_path / "old.json", (past - 50, past - 50))
+    assert cache.get("hot") is not None  # touch: now most recently used
+    cache.put("new", ["z" * 4000])
+    assert cache.get("old") is None
+    assert cache.get("hot") is not None
+    assert cache.get("new") is not None
@@ -0,0 +1,63 @@
+"""
+SSE framing and Chat Completions event decoding tests.
+
+Feeds streams split at awkward byte boundaries and checks that multi-line
+data, comments, event/id fields and usage/finish chunks come out intact.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from sse_parser import SSEParser, chat_events, chat_events_batch  # noqa: E402
+
+
+def _feed_bytewise(raw: bytes):
+    parser = SSEParser()
+    events = []
+    for i in range(len(raw)):
+        events.extend(parser.feed(raw[i:i + 1]))
+    events.extend(parser.close())
+    return parser, events
+
+
+def test_multiline_data_comments_and_fields_split_anywhere():
+    raw = (": OPENROUTER PROCESSING\r\n\r\n"
+           "event: note\r\nid: 7\r\ndata: first\r\ndata: second\r\n\r\n"
+           "data: café \U0001F642\n\n"
+           "retry: 1500\ndata: tail").encode("utf-8")
+    parser, events = _feed_bytewise(raw)
+    assert [ev.data for ev in events] == ["first\nsecond", "café \U0001F642", "tail"]
+    assert events[0].event == "note"
+    assert events[0].id == "7" and events[1].id == "7"
+    assert events[2].retry == 1500
+    assert parser.comments == 1
+
+
+def test_chat_events_surface_content_finish_usage_and_done():
+    chunks = [
+        {"choices": [{"delta": {"role": "assistant", "content": "Hel"}}]},
+        {"choices": [{"delta": {"content": "lo"}, "finish_reason": None}]},
+        {"choices": [{"delta": {}, "finish_reason": "stop"}]},
+        {"choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5}},
+    ]
+    raw = b"".join(b"data: " + json.dumps(c).encode("utf-8") + b"\n\n" for c in chunks) + b"data: [DONE]\n\n"
+    parser = SSEParser()
+    typed = chat_events_batch(parser.feed(raw))
+    assert [(e.kind, e.text) for e in typed] == [("content", "Hel"), ("content", "lo"), ("finish", "stop"), ("usage", ""), ("done", "")]
+    assert typed[3].value["total_tokens"] == 5
+    # The per-event path agrees with the batched one
+    parser = SSEParser()
+    single = [e for ev in parser.feed(raw) for e in chat_events(ev)]
+    assert [(e.kind, e.text) for e in single] == [(e.kind, e.text) for e in typed]
+
+
+def test_batch_falls_back_on_malformed_event_and_reports_errors():
+    raw = (b'data: {"choices":[{"delta":{"content":"a"}}]}\n\n'
+           b'data: {not json}\n\n'
+           b'data: {"error":{"message":"upstream overloaded","code":502}}\n\n')
+    typed = chat_events_batch(SSEParser().feed(raw))
+    assert [(e.kind, e.text) for e in typed] == [("content", "a"), ("error", "upstream overloaded")]
@@ -0,0 +1,80 @@
+"""
+Compact stage IR tests.
+
+Checks that stages after Stage 1 see a reference to the Context Scout bundle
+instead of the bundle, minified Stage 1 / Stage 5 JSON instead of the raw
+answers, that the final prompt does not carry the bundle, and that the
+runner's token accounting shows the reduction. Also checks that a request
+containing the `# Context` marker text is kept whole when no bundle is
+attached.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "bench"))
+
+from agent_pipeline import SectionWriter, StageGraphRunner, build_graph  # noqa: E402
+from mock_openai import MockConfig, MockOpenAI  # noqa: E402
+from promptopt import run_agent_mode  # noqa: E402
+from stage_ir import CONTEXT_MARKER, bundle_files, join_context, seed_context  # noqa: E402
+from tracing import Tracer  # noqa: E402
+
+BUNDLE = "".join(f'<file path="src/mod{i}.py">\n' + "\n".join(f"{n}|x = {n}" for n in range(1, 41)) + "\n</file>\n" for i in range(3))
+REQUEST = "Add retries to the fetch helper"
+
+
+class _NullSink:
+    def write(self, text):
+        pass
+
+
+def test_stages_after_analysis_get_references_and_minified_json():
+    ctx = seed_context(REQUEST, BUNDLE)
+    assert ctx["input"] == REQUEST + CONTEXT_MARKER + BUNDLE and ctx["context"] == BUNDLE and bundle_files(BUNDLE)[0] == ("src/mod0.py", 40)
+    assert "src/mod2.py (40 lines)" in ctx["request"] and "x = 7" not in ctx["request"]
+
+    prompts = {}
+
+    def call(stage, prompt, section):
+        prompts[stage.key] = prompt
+        if stage.key == "analysis":
+            return '```json\n{\n  "task_type": "coding",\n  "primary_goal": "retries"\n}\n```\nDone.'
+        if stage.key == "eval":
+            return json.dumps({"scores": {"clarity": 2}, "overall_score": 2.5, "pass": False,
+                               "critical_issues": ["vague"], "suggested_fixes": ["say how many retries"]}, indent=2)
+        return f"{stage.key}-out"
+
+    runner = StageGraphRunner(build_graph("sequential", enable_eval=True, compact=True), call, SectionWriter(_NullSink()), total=5)
+    runner.run(ctx)
+    assert "x = 7" in prompts["analysis"]
+    assert "x = 7" not in prompts["clarified"] and "[Context bundle: src/mod0.py" in prompts["clarified"]
+    assert '{"task_type":"coding","primary_goal":"retries"}' in prompts["final"] and "Done." not in prompts["final"]
+    assert '{"critical_issues":["vague"],"suggested_fixes":["say how many retries"]}' in prompts["rewrite"]
+    compact, raw = runner.tokens["clarified"]
+    assert raw - compact > 200  # the bundle is ~280 tokens
+    assert "% saved" in runner.report()
+
+
+def test_final_prompt_leaves_the_bundle_out(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPTOPT_AGENT_CHECKPOINT", "0")
+    tracer = Tracer(str(tmp_path / "trace.jsonl"))
+    run = tracer.start_run(mode="agent")
+    out = tmp_path / "out.txt"
+    with MockOpenAI(MockConfig(tokens=5)) as mock:
+        assert run_agent_mode(REQUEST, "m/ir", mock.base_url, "sk-test", str(out), 5, trace=run, context=BUNDLE) == 0
+    run.end()
+    final = out.read_text(encoding="utf-8").split("---FINAL---\n", 1)[1]
+    assert CONTEXT_MARKER not in final and "x = 7" not in final
+    spans = [json.loads(line) for line in (tmp_path / "trace.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert spans[-1]["input_tokens_est"] < spans[-1]["input_tokens_raw_est"]
+
+
+def test_marker_text_in_the_request_is_not_taken_for_a_bundle():
+    request = "Write docs for this template:" + CONTEXT_MARKER + "this is the user text"
+    ctx = seed_context(request)
+    assert ctx["request"] == ctx["input"] == request and ctx["context"] == ""
+    assert join_context(request, "  \n") == request
@@ -0,0 +1,93 @@
+"""
+Per-stage model routing tests against the local mock server.
+
+Checks how routes from the config file, PROMPTOPT_STAGE_MODELS and
+--stage-model merge, that `provider.only` is sent per call, and that an
+Agent Mode run falls back along a stage's chain and records the latency
+saved against the job's model in the trace, and that a failing stage
+aborts the requests of stages still in flight.
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "bench"))
+
+import pytest  # noqa: E402
+
+from mock_openai import MockConfig, MockOpenAI  # noqa: E402
+from promptopt import build_chat_request, run_agent_mode  # noqa: E402
+from stage_routing import LatencyHistory, router_from_config  # noqa: E402
+from tracing import Tracer  # noqa: E402
+
+
+def test_routes_merge_by_precedence_and_fall_back_to_the_job_model(tmp_path, monkeypatch):
+    routes = tmp_path / "routes.json"
+    routes.write_text(json.dumps({"analysis": "m/file", "4": {"models": ["m/strong"], "provider_only": "anthropic"}, "*": "m/any"}), encoding="utf-8")
+    monkeypatch.setenv("PROMPTOPT_STAGE_MODELS", "analysis=m/env;eval=m/env-eval")
+    router = router_from_config("m/job", ["1=m/cli,m/cli2@cerebras,groq"], str(routes))
+
+    analysis = router.route("analysis")
+    assert analysis.models == ["m/cli", "m/cli2", "m/job"] and analysis.provider_only == ["cerebras", "groq"]
+    assert router.route("eval").models == ["m/env-eval", "m/job"]
+    assert router.route("fused").models == ["m/strong", "m/job"] and router.route("fused").provider_only == ["anthropic"]
+    assert router.route("clarified").models == ["m/any", "m/job"]
+
+    monkeypatch.delenv("PROMPTOPT_STAGE_MODELS")
+    assert router_from_config("m/job").route("final").models == ["m/job"]
+    with pytest.raises(ValueError, match="unknown Agent Mode stage"):
+        router_from_config("m/job", ["polish=m/x"])
+
+    # The route's providers replace PROMPTOPT_PROVIDER_ONLY for that call
+    monkeypatch.setenv("PROMPTOPT_PROVIDER_ONLY", "deepinfra")
+    _, payload, _ = build_chat_request("https://openrouter.ai/api/v1", "m/a", "s", "u", "sk-or-x", provider_only=["cerebras"])
+    assert payload["provider"] == {"only": ["cerebras"]}
+    _, payload, _ = build_chat_request("https://openrouter.ai/api/v1", "m/a", "s", "u", "sk-or-x")
+    assert payload["provider"] == {"only": ["deepinfra"]}
+
+
+def test_routed_stage_falls_back_and_traces_latency_saved(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPTOPT_STAGE_LATENCY_FILE", str(tmp_path / "latency.json"))
+    monkeypatch.setenv("PROMPTOPT_AGENT_CHECKPOINT", "0")
+    # A slow baseline for Stage 1 on the job's model, as if earlier runs had recorded it
+    history = LatencyHistory(str(tmp_path / "latency.json"))
+    history.record("analysis", "m/big", 5000.0)
+    history.save()
+
+    tracer = Tracer(str(tmp_path / "trace.jsonl"))
+    run = tracer.start_run(mode="agent")
+    router = router_from_config("m/big", ["analysis=m/broken,m/small"])
+    with MockOpenAI(MockConfig(tokens=5, errors={"m/broken": 503})) as mock:
+        code = run_agent_mode("sort a list", "m/big", mock.base_url, "sk-test", str(tmp_path / "out.txt"), 5, trace=run, router=router)
+    run.end()
+    assert code == 0
+
+    spans = [json.loads(line) for line in (tmp_path / "trace.jsonl").read_text(encoding="utf-8").splitlines()]
+    stage = next(s for s in spans if s["kind"] == "stage" and s["name"] == "analysis")
+    calls = [s for s in spans if s["kind"] == "http" and s["parent_id"] == stage["span_id"]]
+    assert [(c["model"], c["attempt"], c["outcome"]) for c in calls] == [("m/broken", 0, "error"), ("m/small", 1, "ok")]
+    assert stage["model"] == "m/small" and stage["baseline_model"] == "m/big" and stage["baseline_ms"] == 5000.0
+    assert stage["saved_ms"] == pytest.approx(5000.0 - stage["duration_ms"], abs=50)
+    assert spans[-1]["routing_saved_ms"] == stage["saved_ms"]
+    assert {s["model"] for s in spans if s["kind"] == "stage" and s["name"] != "analysis"} == {"m/big"}
+    assert "m/small" in json.loads((tmp_path / "latency.json").read_text(encoding="utf-8"))["analysis"]
+
+
+def test_failed_stage_aborts_requests_still_in_flight(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMPTOPT_AGENT_CHECKPOINT", "0")
+    trace = tmp_path / "trace.jsonl"
+    run = Tracer(str(trace)).start_run(mode="agent")
+    # Stage 1 streams slowly on m/ok; Structure starts from its early task_type and fails on m/bad
+    router = router_from_config("m/bad", ["analysis=m/ok"])
+    with MockOpenAI(MockConfig(tokens=100, token_delay=0.05, errors={"m/bad": 500})) as mock:
+        assert run_agent_mode("x", "m/bad", mock.base_url, "sk-test", str(tmp_path / "out.txt"), 10, graph="parallel", trace=run, router=router) == 1
+        for _ in range(100):  # the stream would take 5 s to finish on its own
+            spans = [json.loads(line) for line in trace.read_text(encoding="utf-8").splitlines()] if trace.exists() else []
+            if any(s["kind"] == "http" and s["model"] == "m/ok" for s in spans):
+                break
+            time.sleep(0.02)
+    assert [(s["model"], s["outcome"]) for s in spans if s["kind"] == "http"] == [("m/bad", "error"), ("m/ok", "cancelled")]
@@ -0,0 +1,44 @@
+"""
+StreamSink tests: coalescing, UTF-8 boundary safety and the time-based flush.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from stream_sink import StreamSink  # noqa: E402
+
+
+def test_coalesces_many_deltas_into_few_flushes(tmp_path):
+    out = tmp_path / "out.txt"
+    with StreamSink(str(out), truncate=True, flush_interval=10.0, flush_bytes=4096) as sink:
+        for i in range(20000):
+            sink.write("tok ")
+    assert out.read_text(encoding="utf-8") == "tok " * 20000
+    assert sink.flushes < 100
+    assert sink.stats()["chunks"] == 20000
+
+
+def test_split_surrogate_pair_is_written_as_one_character(tmp_path):
+    out = tmp_path / "out.txt"
+    sink = StreamSink(str(out), truncate=True, flush_interval=10.0, flush_bytes=1)
+    sink.write("smile \ud83d")  # high surrogate arrives in one SSE delta...
+    assert out.read_bytes() == b"smile "
+    sink.write("\ude00!")  # ...its low surrogate in the next
+    sink.close()
+    assert out.read_text(encoding="utf-8") == "smile \U0001F600!"
+
+
+def test_idle_buffer_is_flushed_by_timer(tmp_path):
+    out = tmp_path / "out.txt"
+    sink = StreamSink(str(out), truncate=True, flush_interval=0.02, flush_bytes=1 << 20)
+    sink.write("a")
+    sink.write("b")
+    deadline = time.monotonic() + 2.0
+    while time.monotonic() < deadline and out.read_text(encoding="utf-8") != "ab":
+        time.sleep(0.01)
+    assert out.read_text(encoding="utf-8") == "ab"
+    sink.close()
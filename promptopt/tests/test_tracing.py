@@ -0,0 +1,104 @@
+"""
+Latency tracing tests against a throwaway loopback server.
+
+Checks that a traced streaming call and a traced non-streaming call write
+nested JSONL spans with timings, provider and usage, and that a cancelled
+stream is recorded as cancelled.
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from async_client import CancelToken  # noqa: E402
+from promptopt import http_span, try_call, try_stream  # noqa: E402
+from tracing import Tracer  # noqa: E402
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))))
+        if not body.get("stream"):
+            data = json.dumps({"provider": "Cerebras", "choices": [{"message": {"content": "done"}}], "usage": {"prompt_tokens": 3, "completion_tokens": 1}}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = [{"choices": [{"delta": {"content": p}}]} for p in ("é", "ab")]
+        chunks.append({"provider": "Groq", "choices": [{"delta": {}, "finish_reason": "stop"}], "usage": {"prompt_tokens": 5, "completion_tokens": 2}})
+        for obj in chunks:
+            event = b"data: " + json.dumps(obj).encode("utf-8") + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            self.wfile.flush()
+        if body["model"] == "stall":
+            time.sleep(3)
+            return
+        event = b"data: [DONE]\n\n"
+        self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(event), event))
+
+
+def _server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+
+
+def _spans(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_stream_and_call_spans_nest_under_run(tmp_path):
+    httpd, base = _server()
+    tracer = Tracer(str(tmp_path / "trace.jsonl"))
+    run = tracer.start_run(mode="test")
+    try:
+        assert "".join(try_stream(base, "m/a", "sys", "hi", "sk-test", 5, span=http_span(run, "m/a", 0, stream=True))) == "éab"
+        try_call(base, "m/b", "sys", "hi", "sk-test", 5, span=http_span(run, "m/b", 1))
+        run.end()
+    finally:
+        httpd.shutdown()
+
+    stream, call, root = _spans(tmp_path / "trace.jsonl")
+    assert root["kind"] == "run" and root["parent_id"] is None
+    assert {stream["run_id"], call["run_id"]} == {tracer.run_id}
+    assert stream["parent_id"] == call["parent_id"] == root["span_id"]
+    assert stream["outcome"] == "ok" and stream["deltas"] == 2 and stream["bytes"] == 4
+    assert stream["provider"] == "Groq" and stream["finish_reason"] == "stop" and stream["completion_tokens"] == 2
+    assert stream["ttfb_ms"] <= stream["first_delta_ms"] <= stream["duration_ms"]
+    assert stream["reused"] is False and stream["connect_ms"] > 0
+    assert call["attempt"] == 1 and call["provider"] == "Cerebras" and call["bytes"] == 4 and call["reused"] is True
+
+
+def test_cancelled_stream_is_recorded_as_cancelled(tmp_path):
+    httpd, base = _server()
+    tracer = Tracer(str(tmp_path / "trace.jsonl"))
+    token = CancelToken()
+    try:
+        stream = try_stream(base, "stall", "sys", "hi", "sk-test", 10, cancel=token, span=http_span(tracer.start_run(), "stall"))
+        threading.Timer(0.3, token.cancel).start()
+        assert "".join(stream) == "éab"
+        deadline = time.monotonic() + 2
+        while not (tmp_path / "trace.jsonl").exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        httpd.shutdown()
+    (span,) = _spans(tmp_path / "trace.jsonl")
+    assert span["outcome"] == "cancelled" and span["deltas"] == 2 and "error" not in span
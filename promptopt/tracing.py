@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Structured latency tracing for PromptOpt.
+
+With `--trace FILE` (or PROMPTOPT_TRACE=FILE) every job appends JSONL spans
+to FILE: one `run` span per job, one `stage` span per Agent Mode stage and
+one `http` span per provider call. Spans share the job's `run_id` and point
+at their parent with `parent_id`, so a run can be rebuilt end to end even
+when batch or daemon jobs interleave in the same file.
+
+Every record carries `start` (epoch seconds), `duration_ms` and `outcome`
+('ok' | 'error' | 'cancelled' | 'timeout' | 'skipped' | 'resumed' | 'local';
+'local' is a stage answered without a model call). HTTP spans add
+`model`, `provider`, `attempt` (index in the fallback chain), `status`,
+`connect_ms` (0 on a reused connection), `deltas`, `bytes` (output text,
+UTF-8), `wire_bytes`, token usage when reported, and the offsets
+`queue_ms` (concurrency slot acquired), `ttfb_ms` (status line received) and
+`first_delta_ms`, all measured from the span start. Prompts, outputs and keys
+are never written; error messages are truncated.
+
+A span is written once, when it ends, so children appear before parents.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+MAX_ERROR_CHARS = 300
+
+_file_locks: Dict[str, threading.Lock] = {}
+_file_locks_guard = threading.Lock()
+
+
+def _lock_for(path: str) -> threading.Lock:
+    # One lock per file so concurrent jobs in one process never interleave lines
+    with _file_locks_guard:
+        return _file_locks.setdefault(path, threading.Lock())
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Tracer:
+    """Appends finished spans for one run to a JSONL file."""
+
+    def __init__(self, path: str, run_id: Optional[str] = None):
+        self.path = os.path.abspath(path)
+        self.run_id = run_id or _new_id()
+        self._lock = _lock_for(self.path)
+        self.write_errors = 0
+
+    def start_run(self, **attrs: Any) -> "Span":
+        return Span(self, "run", "run", None, attrs)
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        try:
+            with self._lock:
+                parent = os.path.dirname(self.path)
+                if parent:
+                    os.makedirs(parent, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8", newline="") as f:
+                    f.write(line)
+        except OSError:
+            # Tracing must never fail a job
+            self.write_errors += 1
+
+
+class Span:
+    """
+    One timed operation. Use `child()` for nested work and `end()` (or the
+    context manager) to record it; ending twice is a no-op.
+    """
+
+    def __init__(self, tracer: Tracer, kind: str, name: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.kind = kind
+        self.name = name
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.attrs: Dict[str, Any] = dict(attrs)
+        self.start_wall = time.time()
+        self._t0 = time.monotonic()
+        self.ended = False
+
+    def child(self, kind: str, name: str, **attrs: Any) -> "Span":
+        return Span(self.tracer, kind, name, self.span_id, attrs)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def elapsed_ms(self) -> float:
+        return round((time.monotonic() - self._t0) * 1000.0, 2)
+
+    def mark(self, name: str) -> None:
+        """Record `<name>_ms` since the span started, only the first time."""
+        key = f"{name}_ms"
+        if key not in self.attrs:
+            self.attrs[key] = self.elapsed_ms()
+
+    def end(self, outcome: str = "ok", error: Optional[str] = None) -> None:
+        if self.ended:
+            return
+        self.ended = True
+        record: Dict[str, Any] = {
+            "run_id": self.tracer.run_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "name": self.name,
+            "start": round(self.start_wall, 6),
+            "duration_ms": self.elapsed_ms(),
+            "outcome": outcome,
+        }
+        if error:
+            record["error"] = error[:MAX_ERROR_CHARS]
+        record.update(self.attrs)
+        self.tracer.emit(record)
+
+    def fail(self, exc: BaseException) -> None:
+        """End with the outcome that matches an exception."""
+        outcome = outcome_for(exc)
+        self.end(outcome, None if outcome == "cancelled" else f"{type(exc).__name__}: {exc}")
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc is None:
+            self.end()
+        else:
+            self.fail(exc)
+
+
+def outcome_for(exc: BaseException) -> str:
+    if isinstance(exc, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    if isinstance(exc, TimeoutError):
+        return "timeout"
+    return "error"
+
+
+def child_span(parent: Optional[Span], kind: str, name: str, **attrs: Any) -> Optional[Span]:
+    """`parent.child(...)`, or None when tracing is off."""
+    return parent.child(kind, name, **attrs) if parent is not None else None
+
+
+def open_tracer(path: Optional[str] = None) -> Optional[Tracer]:
+    """Tracer for this run from `--trace` or PROMPTOPT_TRACE; None when tracing is off."""
+    path = path or os.environ.get("PROMPTOPT_TRACE", "").strip()
+    return Tracer(path) if path else None